@@ -0,0 +1,68 @@
+"""
+anytime pathfinding: how good a path ara* (lib.pathfinding.AnytimeAstar, find_path's "anytime" mode) has after a
+10/50/200ms budget, vs waiting for a* to find the optimal one
+
+for every budget a fresh search gets that long, the bound is what it promises (at most that many times longer than
+optimal) and actual is how much longer its path really is. "optimal" is how long ara* takes to get all the way to
+the optimal path, which is more work than a* since it searched with inflated heuristics first
+
+the 100x100x5 wall is the bad case: the straight line to the goal runs into a wall that goes almost all the way
+across, and the inflated heuristic keeps the search in front of it until that's all been expanded
+
+run from the repo root with `python -m bench.anytime`
+"""
+
+import random
+import time
+
+from lib.pathfinding import astar, AnytimeAstar
+from lib.util import *
+
+from bench.hierarchical import free_block, synthetic_site
+from bench.jps import pillar_field_map
+from bench.pathfinding import path_length, wide_corridor_map
+from bench.swarm import swarm_site
+
+BUDGETS = [0.01, 0.05, 0.2] # seconds
+
+def swarm_site_map():
+    return swarm_site(200)[0]
+
+def site_query():
+    rand = random.Random(1)
+    world_map = synthetic_site()
+    return world_map, free_block(world_map, rand, (0, 60)), free_block(world_map, rand, (440, 500))
+
+CASES = [
+        ("pillar field", lambda: (pillar_field_map(), (3, 4, 2), (196, 187, 7))),
+        ("bench.swarm site (200 drones)", lambda: (swarm_site_map(), (1, 0, 0), (58, 70, 0))),
+        ("500x500x10 site", site_query),
+        ("100x100x5 wall", lambda: (wide_corridor_map(), (5, 5, 0), (5, 95, 4))),
+        ]
+
+if __name__ == "__main__":
+    for name, make_case in CASES:
+        world_map, a, b = make_case()
+        passable = world_map.snapshot().passable_func(set())
+        stats = {}
+        t_start = time.perf_counter()
+        optimal = path_length(astar(a, b, passable, stats=stats))
+        t_astar = time.perf_counter() - t_start
+        print(f"{name}: {a} -> {b}")
+        print(f"    a*                {t_astar*1000:8.1f}ms  expansions={stats['expansions']}")
+        for budget in BUDGETS:
+            search = AnytimeAstar(a, b, passable)
+            t_start = time.perf_counter()
+            path = search.improve(deadline=t_start + budget)
+            elapsed = time.perf_counter() - t_start
+            if path == None:
+                print(f"    ara* {budget*1000:4.0f}ms budget {elapsed*1000:8.1f}ms  no path yet")
+                continue
+            print(f"    ara* {budget*1000:4.0f}ms budget {elapsed*1000:8.1f}ms  bound={search.bound:.3f}  "
+                  f"actual={path_length(path)/optimal:.3f}")
+        search = AnytimeAstar(a, b, passable)
+        stats = {}
+        t_start = time.perf_counter()
+        path = search.improve(stats=stats)
+        print(f"    ara* optimal      {(time.perf_counter() - t_start)*1000:8.1f}ms  expansions={stats['expansions']}  "
+              f"actual={path_length(path)/optimal:.3f}")
@@ -0,0 +1,128 @@
+"""
+corridor throughput with several drones: everyone planning alone vs cooperative batch planning
+
+drones shuttle between pads at the south and north ends of the ground corridor, so they all have to get through
+the gap in the wall. every drone moves at most one block per timestep (2s, a 10m block at 5m/s)
+
+    independent -- what drone/__main__.py does: find_path for yourself, reserve the next block before every move,
+                   and on a failed reservation unreserve, wait ~5s and plan again
+    cooperative -- WorldMap.plan_batch for the whole fleet, again every time a drone finishes a mission or is left
+                   without a path
+
+run from the repo root with `python -m bench.cooperative`
+"""
+
+import random
+import time
+
+from lib.util import *
+
+from bench.pathfinding import ground_corridor_map
+
+TIMESTEP = 2 # seconds
+SIM_STEPS = 600 # 20 simulated minutes
+BACKOFF_STEPS = 3 # ~5s
+
+SOUTH_PADS = [(x, y, 1) for y in [-38, -35] for x in range(-9, 10, 3)]
+NORTH_PADS = [(x, y, 1) for y in [27, 24] for x in range(-9, 10, 3)]
+
+class Fleet:
+    """
+    drones with missions between pads, every drone heads to a free pad at the other end of the corridor
+    """
+
+    def __init__(self, n_drones: int, seed: int):
+        self.rand = random.Random(seed)
+        self.world_map = ground_corridor_map()
+        self.ids = [f"drone{i}" for i in range(n_drones)]
+        self.goals = {}
+        self.missions = 0
+        for id, pad in zip(self.ids, SOUTH_PADS):
+            self.world_map.update_drone(id, self.world_map.get_block_center(pad))
+        for id in self.ids:
+            self.new_mission(id)
+
+    def new_mission(self, id: str):
+        pads = NORTH_PADS if self.world_map.drone_block(id)[1] < 0 else SOUTH_PADS
+        taken = set(self.goals.values()) | {self.world_map.drone_block(i) for i in self.ids}
+        self.goals[id] = self.rand.choice([p for p in pads if p not in taken])
+
+    def move(self, id: str, block: MapBlockCoord):
+        self.world_map.update_drone(id, self.world_map.get_block_center(block))
+        if block == self.goals[id]:
+            self.missions += 1
+            self.new_mission(id)
+            return True
+        return False
+
+    def check_separation(self):
+        blocks = [self.world_map.drone_block(i) for i in self.ids]
+        for i, a in enumerate(blocks):
+            for b in blocks[i+1:]:
+                assert not blocks_touch(a, b), f"drones at {a} and {b} got too close"
+
+def run_independent(n_drones: int, seed: int=0):
+    fleet = Fleet(n_drones, seed)
+    world_map = fleet.world_map
+    paths = {}
+    waiting = {id: 0 for id in fleet.ids}
+    for _ in range(SIM_STEPS):
+        for id in fleet.ids:
+            if waiting[id] > 0:
+                waiting[id] -= 1
+                continue
+            block = world_map.drone_block(id)
+            if id not in paths:
+                path = world_map.find_path(block, fleet.goals[id], {id})
+                if path == None:
+                    waiting[id] = BACKOFF_STEPS
+                    continue
+                paths[id] = path
+            path = paths[id]
+            next_block = path[path.index(block)+1]
+            if not world_map.reserve_block(id, next_block):
+                reserved = world_map.reserved_block(id)
+                if reserved != None:
+                    world_map.unreserve_block(id, reserved)
+                del paths[id]
+                waiting[id] = BACKOFF_STEPS
+                continue
+            if fleet.move(id, next_block):
+                del paths[id]
+        fleet.check_separation()
+    return fleet.missions, 0
+
+def run_cooperative(n_drones: int, seed: int=0):
+    fleet = Fleet(n_drones, seed)
+    world_map = fleet.world_map
+    paths = {}
+    t_plan = 0
+    replan = True
+    planning_time = 0.0
+    for step in range(SIM_STEPS):
+        if replan:
+            t_start = time.perf_counter()
+            paths = world_map.plan_batch(dict(fleet.goals))
+            planning_time += time.perf_counter() - t_start
+            t_plan = step
+            replan = False
+        # everyone moves at once, so the separation check is only valid once they all have
+        for id in fleet.ids:
+            path = paths[id]
+            if path == None:
+                replan = True
+                continue
+            i = min(step+1 - t_plan, len(path)-1)
+            if fleet.move(id, path[i][0]):
+                replan = True
+        fleet.check_separation()
+    return fleet.missions, planning_time
+
+if __name__ == "__main__":
+    minutes = SIM_STEPS * TIMESTEP / 60
+    print(f"missions completed per simulated minute ({minutes:.0f} minutes simulated)")
+    for n_drones in [1, 2, 4, 6, 8]:
+        independent, _ = run_independent(n_drones)
+        cooperative, planning_time = run_cooperative(n_drones)
+        print(f"{n_drones:>2} drones: independent {independent/minutes:6.2f} | cooperative {cooperative/minutes:6.2f} "
+              f"(planning took {planning_time*1000:.0f}ms total)")
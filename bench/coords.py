@@ -0,0 +1,55 @@
+"""
+coordinate <-> block conversion: the precomputed tangent plane in MapBlockCoordSystem vs going through aerpawlib
+
+times scalar and batch conversions. tests/test_mapping.py checks that the new math stays within a bound of the
+aerpawlib-based conversions it replaced (the legacy_ functions below)
+
+run from the repo root with `python -m bench.coords`
+"""
+
+import random
+import time
+
+import numpy as np
+
+from aerpawlib.util import Coordinate, VectorNED
+
+from lib.mapping import MapBlockCoordSystem
+from lib.util import *
+
+CENTER = Coordinate(35.7274488, -78.6960209, 30)
+RESOLUTION = 10
+RADIUS = 2000 # meters around the center that get checked (in the tests), a bit more than a test site
+
+# the aerpawlib-based versions MapBlockCoordSystem used before
+
+def legacy_coord_to_block(coord_system: MapBlockCoordSystem, coord: Coordinate) -> MapBlockCoord:
+    delta_vec = coord - coord_system._center_coords
+    x, y, z = [int(i // coord_system._resolution) for i in [delta_vec.east, delta_vec.north, -delta_vec.down]]
+    return (x, y, z)
+
+def legacy_get_block_center(coord_system: MapBlockCoordSystem, block: MapBlockCoord) -> Coordinate:
+    x, y, z = [(i+0.5) * coord_system._resolution for i in block]
+    return coord_system._center_coords + VectorNED(y, x, -z)
+
+def time_per_item(func, items):
+    t_start = time.perf_counter()
+    func(items)
+    return (time.perf_counter() - t_start) / len(items)
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    coord_system = MapBlockCoordSystem(CENTER, RESOLUTION)
+    blocks = [(rand.randint(-200, 200), rand.randint(-200, 200), rand.randint(-5, 20)) for _ in range(50000)]
+    coords = [coord_system.get_block_center(b) for b in blocks]
+    coord_rows = np.array([(c.lat, c.lon, c.alt) for c in coords])
+    timings = [
+            ("coord -> block, aerpawlib", lambda cs: [legacy_coord_to_block(coord_system, c) for c in cs], coords),
+            ("coord -> block, scalar", lambda cs: [coord_system.coord_to_block(c) for c in cs], coords),
+            ("coord -> block, batch", coord_system.coords_to_blocks, coord_rows),
+            ("block -> center, aerpawlib", lambda bs: [legacy_get_block_center(coord_system, b) for b in bs], blocks),
+            ("block -> center, scalar", lambda bs: [coord_system.get_block_center(b) for b in bs], blocks),
+            ("block -> center, batch", lambda bs: coord_system.blocks_to_coords(bs, centers=True), np.array(blocks)),
+            ]
+    for label, func, items in timings:
+        print(f"{label:28} {time_per_item(func, items)*1e6:8.3f}us per item")
@@ -0,0 +1,68 @@
+"""
+routing by flight time (speeds/climb penalty, see lib.costs) vs by distance on the ground corridor
+
+the corridor gets a fast transit lane (2x cruise speed) running north-south through the gap in the wall, a slow
+zone (0.5x) along both faces of the wall, and a climb penalty. drones fly pad-to-pad missions across the wall like in
+bench.cooperative. for each mode this prints the estimated flight time of a mission and what that means for missions
+per minute per drone, plus what the search itself costs
+
+    distance -- the old behaviour, shortest path ignoring speeds (its flight time is still measured with them)
+    time -- astar minimising flight time
+    time (incremental) -- the same with d* lite, checked to find paths that are just as fast
+
+run from the repo root with `python -m bench.costs`
+"""
+
+import time
+
+from lib.pathfinding import astar
+from lib.util import *
+
+from bench.cooperative import NORTH_PADS, SOUTH_PADS
+from bench.pathfinding import ground_corridor_map
+
+BLOCK_SIZE = 10 # meters, same as ground/__main__.py
+CRUISE_SPEED = 5 # m/s
+
+def corridor_with_costs():
+    world_map = ground_corridor_map()
+    with world_map.batch():
+        world_map.set_speed((-10, -1, -2), (10, -1, 2), 0.5)
+        world_map.set_speed((-10, 11, -2), (10, 11, 2), 0.5)
+        world_map.set_speed((0, -40, 1), (2, 30, 2), 2)
+        world_map.set_climb_penalty(0.5)
+    return world_map
+
+def to_seconds(cost: float) -> float:
+    return cost * BLOCK_SIZE / CRUISE_SPEED
+
+if __name__ == "__main__":
+    world_map = corridor_with_costs()
+    snapshot = world_map.snapshot()
+    passable = snapshot.passable_func(set())
+    missions = [(a, b) for a in SOUTH_PADS for b in NORTH_PADS] + [(b, a) for a in SOUTH_PADS for b in NORTH_PADS]
+
+    def _distance(a, b, stats):
+        return astar(a, b, passable, stats=stats)
+    def _time(a, b, stats):
+        return world_map.find_path(a, b, set(), stats=stats, mode="astar")
+    def _incremental(a, b, stats):
+        return world_map.find_path(a, b, set(), stats=stats, mode="incremental")
+
+    results = {}
+    for name, find_path in [("distance", _distance), ("time", _time), ("time (incremental)", _incremental)]:
+        world_map.path_cache.clear()
+        stats = {}
+        t_start = time.perf_counter()
+        paths = [find_path(a, b, stats) for a, b in missions]
+        elapsed = time.perf_counter() - t_start
+        flight_times = [to_seconds(snapshot.costs.path_cost(path)) for path in paths]
+        results[name] = flight_times
+        average = sum(flight_times) / len(flight_times)
+        print(f"{name:18}  flight time/mission={average:6.1f}s  missions/min/drone={60/average:5.2f}  "
+              f"expansions/search={stats['expansions']/len(missions):7.1f}  "
+              f"time/search={elapsed/len(missions)*1000:6.2f}ms")
+
+    for i, (t_astar, t_incremental) in enumerate(zip(results["time"], results["time (incremental)"])):
+        assert abs(t_astar - t_incremental) < 1e-3, f"incremental path for mission {missions[i]} is slower"
+    print(f"cost layer: {snapshot.costs.nbytes} bytes for {len(snapshot.blocks)} blocks")
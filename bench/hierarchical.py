@@ -0,0 +1,94 @@
+"""
+long-distance queries on a synthetic 500x500x10 site: flat a* vs hierarchical (chunked) search
+
+the site is open air with rows of buildings and a few long walls with gaps in them, roughly what a few km of
+test site looks like at 10m blocks. after the queries a building gets added with fill_map to show that only the
+chunks around it need to be rebuilt
+
+run from the repo root with `python -m bench.hierarchical`
+"""
+
+import math
+import random
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+from bench.pathfinding import path_length
+
+SIZE = 500
+HEIGHT = 10
+
+def synthetic_site(seed: int=0) -> WorldMap:
+    rand = random.Random(seed)
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid",
+                         bounds=((0, 0, 0), (SIZE-1, SIZE-1, HEIGHT-1)))
+    world_map.fill_map((0, 0, 0), (SIZE-1, SIZE-1, HEIGHT-1), Traversability.FREE)
+    # buildings of random footprint/height
+    for _ in range(600):
+        x, y = rand.randrange(SIZE-12), rand.randrange(SIZE-12)
+        world_map.fill_map((x, y, 0), (x+rand.randint(2, 10), y+rand.randint(2, 10), rand.randint(2, HEIGHT-1)),
+                           Traversability.BLOCKED)
+    # full height walls across the site with a couple of gaps each
+    for wall_x in [120, 250, 380]:
+        world_map.fill_map((wall_x, 0, 0), (wall_x+1, SIZE-1, HEIGHT-1), Traversability.BLOCKED)
+        for _ in range(2):
+            gap_y = rand.randrange(SIZE-6)
+            world_map.fill_map((wall_x, gap_y, 0), (wall_x+1, gap_y+5, HEIGHT-1), Traversability.FREE)
+    return world_map
+
+def free_block(world_map: WorldMap, rand: random.Random, x_range) -> MapBlockCoord:
+    while True:
+        block = (rand.randrange(*x_range), rand.randrange(SIZE), rand.randrange(HEIGHT))
+        if world_map._map.get(block) == Traversability.FREE:
+            return block
+
+def timed(func):
+    stats = {}
+    t_start = time.perf_counter()
+    path = func(stats)
+    return path, stats, time.perf_counter() - t_start
+
+if __name__ == "__main__":
+    rand = random.Random(1)
+    t_start = time.perf_counter()
+    world_map = synthetic_site()
+    print(f"building the map: {(time.perf_counter() - t_start)*1000:.0f}ms")
+
+    queries = [(free_block(world_map, rand, (0, 60)), free_block(world_map, rand, (SIZE-60, SIZE)))
+               for _ in range(4)]
+
+    # the first query has to build every chunk it looks at
+    _, _, cold_time = timed(lambda s: world_map.find_path(*queries[0], set(), stats=s, mode="hierarchical"))
+    print(f"first query (building chunks as needed): {cold_time*1000:.0f}ms")
+    t_start = time.perf_counter()
+    world_map.hierarchical_planner.prepare((0, 0, 0), (SIZE-1, SIZE-1, HEIGHT-1))
+    print(f"preparing the remaining chunks: {(time.perf_counter() - t_start)*1000:.0f}ms")
+
+    flat_times, hier_times, ratios = [], [], []
+    for a, b in queries:
+        world_map.path_cache.clear()
+        flat, flat_stats, flat_time = timed(lambda s: world_map.find_path(a, b, set(), stats=s))
+        hier, hier_stats, hier_time = timed(lambda s: world_map.find_path(a, b, set(), stats=s, mode="hierarchical"))
+        assert (flat == None) == (hier == None), "hierarchical search disagrees on whether there's a path"
+        flat_times.append(flat_time)
+        hier_times.append(hier_time)
+        if flat != None:
+            assert all(blocks_touch(p, q) for p, q in zip(hier, hier[1:]))
+            ratios.append(path_length(hier) / path_length(flat))
+        print(f"{str(a):>15} -> {str(b):15} flat a*: {flat_stats['expansions']:7} exp {flat_time*1000:8.1f}ms | "
+              f"hierarchical: {hier_stats['abstract_expansions']:5} abstract + {hier_stats.get('expansions', 0):5} "
+              f"exp {hier_time*1000:7.1f}ms" + (" (fell back)" if hier_stats["fallback"] else ""))
+
+    print(f"mean flat a*: {sum(flat_times)/len(flat_times)*1000:.1f}ms, "
+          f"mean hierarchical: {sum(hier_times)/len(hier_times)*1000:.1f}ms, "
+          f"worst path length ratio: {max(ratios, default=math.nan):.3f}")
+
+    # a new building should only cost rebuilding the chunks around it
+    world_map.fill_map((300, 300, 0), (305, 305, 6), Traversability.BLOCKED)
+    t_start = time.perf_counter()
+    world_map.hierarchical_planner.prepare((0, 0, 0), (SIZE-1, SIZE-1, HEIGHT-1))
+    print(f"rebuilding after fill_map: {(time.perf_counter() - t_start)*1000:.1f}ms")
@@ -0,0 +1,55 @@
+"""
+jump point search vs plain a* on open-field and corridor maps
+
+both find equally short paths. jps expands far fewer blocks, but it steps over many more while jumping (listed
+too), which is where its time goes. at best it's about even with a* on the pillar field and ahead on the 100x100x5
+wall, and it's slower on the open field and the ground corridor, which is why it isn't the default anywhere
+
+run from the repo root with `python -m bench.jps`
+"""
+
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+from bench.pathfinding import ground_corridor_map, path_length, wide_corridor_map
+
+def open_field_map() -> WorldMap:
+    # 200x200x10 of nothing but air
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid",
+                         bounds=((0, 0, 0), (199, 199, 9)))
+    world_map.fill_map((0, 0, 0), (199, 199, 9), Traversability.FREE)
+    return world_map
+
+def pillar_field_map() -> WorldMap:
+    # open field with a regular grid of full height 2x2 pillars
+    world_map = open_field_map()
+    for x in range(10, 190, 12):
+        for y in range(10, 190, 12):
+            world_map.fill_map((x, y, 0), (x+1, y+1, 9), Traversability.BLOCKED)
+    return world_map
+
+CASES = [
+        ("open field (straight)", open_field_map, (5, 100, 5), (195, 100, 5)),
+        ("open field (diagonal)", open_field_map, (5, 5, 0), (195, 190, 9)),
+        ("pillar field", pillar_field_map, (3, 4, 2), (196, 187, 7)),
+        ("ground corridor", ground_corridor_map, (-8, -35, 1), (1, 25, 1)),
+        ("100x100x5 wall", wide_corridor_map, (5, 5, 0), (5, 95, 4)),
+        ]
+
+if __name__ == "__main__":
+    for name, make_map, a, b in CASES:
+        world_map = make_map()
+        print(f"{name}: {a} -> {b}")
+        for mode in ["astar", "jps"]:
+            stats = {}
+            world_map.path_cache.clear()
+            t_start = time.perf_counter()
+            path = world_map.find_path(a, b, set(), stats=stats, mode=mode)
+            elapsed = time.perf_counter() - t_start
+            jumped = f" jump steps={stats['jump_steps']:7}" if "jump_steps" in stats else ""
+            print(f"    {mode:6} expansions={stats['expansions']:7}{jumped} time={elapsed*1000:9.2f}ms "
+                  f"length={path_length(path):.2f}")
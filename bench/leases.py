@@ -0,0 +1,112 @@
+"""
+ground station round trips per block flown: reserving one block at a time vs leasing the blocks ahead
+
+drones shuttle between the pads of the ground corridor like in bench.cooperative (one block per timestep)
+
+    per block -- what drone/__init__.py used to do: find_path, then reserve the next block before every move and
+                 stop there, on a failed reservation unreserve, wait ~5s and plan again
+    leases -- what it does now: a smoothed path, and a lease of up to LEASE_BLOCKS blocks up to the end of the
+              current segment whenever the drone doesn't hold the next block. it flies through everything it got
+              in one go, update_drone gives the blocks back behind it
+
+requests counts every call a drone makes to the ground station (pathfind, reserve/lease, unreserve), stops counts
+the gotos (each one starts and ends stopped)
+
+run from the repo root with `python -m bench.leases`
+"""
+
+from lib.util import *
+
+from bench.cooperative import Fleet, SIM_STEPS, TIMESTEP, BACKOFF_STEPS
+
+LEASE_BLOCKS = 8 # same as drone/__init__.py
+
+def run_per_block(n_drones: int, seed: int=0):
+    fleet = Fleet(n_drones, seed)
+    world_map = fleet.world_map
+    paths = {}
+    waiting = {id: 0 for id in fleet.ids}
+    counts = {"requests": 0, "stops": 0, "blocks": 0}
+    for _ in range(SIM_STEPS):
+        for id in fleet.ids:
+            if waiting[id] > 0:
+                waiting[id] -= 1
+                continue
+            block = world_map.drone_block(id)
+            if id not in paths:
+                counts["requests"] += 1
+                path = world_map.find_path(block, fleet.goals[id], {id})
+                if path == None:
+                    waiting[id] = BACKOFF_STEPS
+                    continue
+                paths[id] = path
+            path = paths[id]
+            next_block = path[path.index(block)+1]
+            counts["requests"] += 1
+            if not world_map.reserve_block(id, next_block):
+                counts["requests"] += 1
+                world_map.release_reservations(id)
+                del paths[id]
+                waiting[id] = BACKOFF_STEPS
+                continue
+            counts["stops"] += 1
+            counts["blocks"] += 1
+            if fleet.move(id, next_block):
+                del paths[id]
+        fleet.check_separation()
+    return fleet.missions, counts
+
+def run_leases(n_drones: int, seed: int=0):
+    fleet = Fleet(n_drones, seed)
+    world_map = fleet.world_map
+    paths = {} # maps id -> (swept blocks, [(index of first block, index of last block)] per segment)
+    waiting = {id: 0 for id in fleet.ids}
+    counts = {"requests": 0, "stops": 0, "blocks": 0}
+    for _ in range(SIM_STEPS):
+        for id in fleet.ids:
+            if waiting[id] > 0:
+                waiting[id] -= 1
+                continue
+            block = world_map.drone_block(id)
+            if id not in paths:
+                counts["requests"] += 1
+                result = world_map.find_path(block, fleet.goals[id], {id}, smooth=True)
+                if result == None:
+                    waiting[id] = BACKOFF_STEPS
+                    continue
+                waypoints, segments = result
+                path = [waypoints[0]] + [b for segment in segments for b in segment[1:]]
+                legs = []
+                for segment in segments:
+                    start = legs[-1][1] if len(legs) > 0 else 0
+                    legs.append((start, start + len(segment) - 1))
+                paths[id] = (path, legs)
+            path, legs = paths[id]
+            i = path.index(block)
+            next_block = path[i+1]
+            if next_block not in world_map.reserved_blocks(id):
+                leg_end = next(end for start, end in legs if start <= i < end)
+                counts["requests"] += 1
+                leased = world_map.lease_blocks(id, path[i+1:min(leg_end, i+LEASE_BLOCKS)+1])
+                if len(leased) == 0:
+                    counts["requests"] += 1
+                    world_map.release_reservations(id)
+                    del paths[id]
+                    waiting[id] = BACKOFF_STEPS
+                    continue
+                counts["stops"] += 1
+            counts["blocks"] += 1
+            if fleet.move(id, next_block):
+                del paths[id]
+        fleet.check_separation()
+    return fleet.missions, counts
+
+if __name__ == "__main__":
+    minutes = SIM_STEPS * TIMESTEP / 60
+    print(f"{minutes:.0f} simulated minutes")
+    for n_drones in [1, 4, 8]:
+        for name, run in [("per block", run_per_block), ("leases", run_leases)]:
+            missions, counts = run(n_drones)
+            print(f"{n_drones:>2} drones, {name:9}  missions/min={missions/minutes:5.2f}  "
+                  f"requests/block={counts['requests']/counts['blocks']:.2f}  "
+                  f"stops/block={counts['stops']/counts['blocks']:.2f}")
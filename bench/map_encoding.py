@@ -0,0 +1,57 @@
+"""
+/viewer/map payloads: one json object per block vs lib.encoding's compressed grid
+
+for maps from 7k to 2.5M blocks this prints the size of each payload and how long the server takes to make it and
+a viewer to decode it. decoding json is json.loads plus building the block dict like MapHandler.update_map does,
+decoding the grid is lib.encoding.decode_map (the grid is what the viewer welds from). json+gzip is what turning
+on http compression for the json would get, for comparison
+
+run from the repo root with `python -m bench.map_encoding`
+"""
+
+import gzip
+import json
+import time
+
+import ground.server as server
+from lib.encoding import decode_map
+from lib.util import *
+
+from bench.hierarchical import synthetic_site
+from bench.pathfinding import ground_corridor_map, wide_corridor_map
+
+def timed(func, *args):
+    t_start = time.perf_counter()
+    r = func(*args)
+    return r, time.perf_counter() - t_start
+
+def decode_json(payload: bytes):
+    j = json.loads(payload)
+    blocks = {}
+    for block in j["blocks"]:
+        blocks[deserialize_block(block["block"])] = Traversability(block["val"])
+    return blocks
+
+if __name__ == "__main__":
+    for name, make_map in [("ground corridor", ground_corridor_map), ("100x100x5 wall", wide_corridor_map),
+                           ("500x500x10 site", synthetic_site)]:
+        server.world_map = make_map()
+        server.world_map.update_drone("drone", server.world_map.get_block_center((0, 0, 0)))
+        print(f"{name}: {len(server.world_map.snapshot().blocks)} blocks")
+
+        j, t_json = timed(server._serialize_map)
+        payload, t_dumps = timed(lambda: json.dumps(j).encode())
+        blocks, t_decode = timed(decode_json, payload)
+        print(f"    json       {len(payload)/1000:10.1f}kB  encode={(t_json + t_dumps)*1000:8.1f}ms  "
+              f"decode={t_decode*1000:8.1f}ms")
+        compressed, t_gzip = timed(gzip.compress, payload)
+        print(f"    json+gzip  {len(compressed)/1000:10.1f}kB  encode={(t_json + t_dumps + t_gzip)*1000:8.1f}ms")
+
+        payload, t_encode = timed(server._encode_map)
+        (grid, origin, extra), t_decode = timed(decode_map, payload)
+        print(f"    grid       {len(payload)/1000:10.1f}kB  encode={t_encode*1000:8.1f}ms  "
+              f"decode={t_decode*1000:8.1f}ms")
+
+        assert len(blocks) == int((grid != 0).sum())
+        for block, traversability in list(blocks.items())[::97]:
+            assert grid[tuple(i-o for i, o in zip(block, origin))] == traversability.value
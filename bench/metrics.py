@@ -0,0 +1,71 @@
+"""
+what lib.metrics costs on the hot paths, with metrics.enabled on vs off
+
+    reserve -- reserve_block + release_reservations for a drone on a south pad of the ground corridor (the cheapest
+               thing a drone asks for, so the one where the overhead shows the most)
+    cached pathfind -- find_path that the path cache answers
+    http reserve -- POST /drone/{id}/reserve + /unreserve through the server, with its latency middleware
+
+run from the repo root with `python -m bench.metrics`
+"""
+
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import ground.server as server
+from lib import metrics
+from lib.util import *
+
+from bench.cooperative import NORTH_PADS, SOUTH_PADS
+from bench.pathfinding import ground_corridor_map
+
+N_RESERVE = 100000
+N_PATHFIND = 20000
+N_HTTP = 2000
+
+def bench_reserve(world_map) -> float:
+    x, y, z = SOUTH_PADS[0]
+    block = (x, y+1, z)
+    t_start = time.perf_counter()
+    for _ in range(N_RESERVE):
+        world_map.reserve_block("drone", block)
+        world_map.release_reservations("drone")
+    return (time.perf_counter() - t_start) / N_RESERVE
+
+def bench_pathfind(world_map) -> float:
+    x, y, z = NORTH_PADS[0]
+    goal = (x, y+1, z)
+    world_map.find_path(world_map.drone_block("drone"), goal, {"drone"})
+    t_start = time.perf_counter()
+    for _ in range(N_PATHFIND):
+        world_map.find_path(world_map.drone_block("drone"), goal, {"drone"})
+    return (time.perf_counter() - t_start) / N_PATHFIND
+
+async def bench_http() -> float:
+    x, y, z = SOUTH_PADS[0]
+    block = serialize_block((x, y+1, z))
+    async with TestClient(TestServer(server.make_app())) as client:
+        t_start = time.perf_counter()
+        for _ in range(N_HTTP):
+            async with client.post("/drone/drone/reserve", json=block) as resp:
+                await resp.read()
+            async with client.post("/drone/drone/unreserve") as resp:
+                await resp.read()
+        return (time.perf_counter() - t_start) / N_HTTP
+
+if __name__ == "__main__":
+    world_map = ground_corridor_map()
+    world_map.update_drone("drone", world_map.get_block_center(SOUTH_PADS[0]))
+    server.world_map = world_map
+    results = {}
+    # twice each way, the first pair warms up caches/allocations
+    for enabled in [True, False, True, False]:
+        metrics.enabled = enabled
+        results[enabled] = (bench_reserve(world_map), bench_pathfind(world_map), asyncio.run(bench_http()))
+    metrics.enabled = True
+    for name, i in [("reserve", 0), ("cached pathfind", 1), ("http reserve", 2)]:
+        on, off = results[True][i], results[False][i]
+        print(f"{name:16} off={off*1e6:8.2f}us  on={on*1e6:8.2f}us  overhead={(on-off)*1e6:6.2f}us "
+              f"({(on-off)/off*100:+.1f}%)")
@@ -0,0 +1,123 @@
+"""
+compares WorldMap.find_path against the original sort-every-iteration search
+
+run from the repo root with `python -m bench.pathfinding`
+"""
+
+import math
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+def legacy_find_path(world_map: WorldMap, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring, stats: dict):
+    """
+    the search WorldMap.find_path used before lib.pathfinding, kept here as a baseline
+    """
+    dists = {a: 0}
+    paths = {a: None}
+    blocks_to_traverse = [a]
+    obstacles = set()
+    drone_adj = world_map.drone_adjacent_blocks()
+    for id in drone_adj:
+        if id not in drones_ignoring:
+            obstacles |= drone_adj[id]
+    for block in world_map._occupied_blocks:
+        if world_map._occupied_blocks[block] not in drones_ignoring:
+            obstacles |= adjacent_blocks(block).keys() | {block}
+    expansions = 0
+
+    while len(blocks_to_traverse) > 0:
+        blocks_to_traverse = sorted(blocks_to_traverse, key=lambda x: math.hypot(b[0]-x[0], b[1]-x[1], b[2]-x[2]))
+
+        block = blocks_to_traverse[0]
+        expansions += 1
+        adj_block_dist = adjacent_blocks(block)
+        for adj in adj_block_dist:
+            if adj not in world_map._map:
+                continue
+            if world_map._map[adj] != Traversability.FREE:
+                continue
+            if adj in obstacles:
+                continue
+            dist = dists[block] + adj_block_dist[adj]
+            if adj in dists and dist < dists[adj]:
+                paths[adj] = block
+                dists[adj] = dist
+            if adj not in dists:
+                paths[adj] = block
+                dists[adj] = dist
+                blocks_to_traverse.append(adj)
+
+        if block == b:
+            break
+        blocks_to_traverse.pop(0)
+
+    stats["expansions"] = expansions
+    if b not in paths:
+        return None
+    path = []
+    curr = b
+    while curr != a:
+        path = [curr] + path
+        curr = paths[curr]
+    return [a] + path
+
+def path_length(path):
+    if path == None:
+        return None
+    return sum(math.hypot(*[j-i for i, j in zip(p, q)]) for p, q in zip(path, path[1:]))
+
+def ground_corridor_map() -> WorldMap:
+    # same layout as ground/__main__.py
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10)
+    world_map.fill_map((-10, -40, -2), (10, 30, 2), Traversability.FREE)
+    world_map.fill_map((-10, 0, -2), (10, 10, 2), Traversability.BLOCKED)
+    world_map.fill_map((0, 0, -2), (2, 10, 2), Traversability.FREE)
+    world_map.fill_map((-10, 0, -2), (10, 10, 0), Traversability.BLOCKED)
+    return world_map
+
+def mapping_test_map() -> WorldMap:
+    # same layout as lib/mapping.py's __main__
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 100), 10)
+    world_map.fill_map((-50, -50, 0), (50, 50, 0), Traversability.FREE)
+    world_map.fill_map((5, -50, 0), (5, 49, 0), Traversability.BLOCKED)
+    world_map.update_drone("me", world_map.block_to_coord((5, 50, 0)))
+    return world_map
+
+def wide_corridor_map() -> WorldMap:
+    # 100x100x5 with a wall that has to be flown around
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10)
+    world_map.fill_map((0, 0, 0), (99, 99, 4), Traversability.FREE)
+    world_map.fill_map((0, 50, 0), (89, 52, 4), Traversability.BLOCKED)
+    return world_map
+
+CASES = [
+        ("ground corridor", ground_corridor_map, (-8, -35, 1), (1, 25, 1), set()),
+        ("ground corridor (south->north edge)", ground_corridor_map, (-10, -40, -2), (10, 30, 2), set()),
+        ("mapping __main__", mapping_test_map, (0, 0, 0), (15, 25, 0), {"me"}),
+        ("100x100x5 wall", wide_corridor_map, (5, 5, 0), (5, 95, 4), set()),
+        ]
+
+def run_case(name, make_map, a, b, drones_ignoring):
+    world_map = make_map()
+    results = []
+    for label, search in [("legacy", lambda s: legacy_find_path(world_map, a, b, drones_ignoring, s)),
+                          ("heap a*", lambda s: world_map.find_path(a, b, drones_ignoring, stats=s))]:
+        stats = {}
+        world_map.path_cache.clear()
+        t_start = time.perf_counter()
+        path = search(stats)
+        elapsed = time.perf_counter() - t_start
+        results.append((label, stats["expansions"], elapsed, path_length(path)))
+
+    print(f"{name}: {a} -> {b}")
+    for label, expansions, elapsed, length in results:
+        length_str = "no path" if length == None else f"{length:.2f}"
+        print(f"    {label:8} expansions={expansions:7} time={elapsed*1000:10.2f}ms length={length_str}")
+
+if __name__ == "__main__":
+    for case in CASES:
+        run_case(*case)
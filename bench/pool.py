@@ -0,0 +1,79 @@
+"""
+N simultaneous pathfind requests: searching in the server process vs in a PathfindingPool
+
+each of N threads (like the threads of the threaded http server) asks for a different long path around the
+100x100x5 wall, nothing is cached. in-process the searches take turns on the gil, so the time for all of them grows
+with N; with the pool they run in parallel and should take about as long as one until N passes the number of
+workers/cores. the paths from both are checked against each other
+
+run from the repo root with `python -m bench.pool`
+"""
+
+import os
+import threading
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.pool import PathfindingPool
+from lib.util import *
+
+from bench.pathfinding import path_length
+
+N_REQUESTS = [1, 2, 4, 8]
+REPEATS = 3
+
+def wall_map() -> WorldMap:
+    # same as bench.pathfinding.wide_corridor_map, but on the grid backend that the pool needs
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid",
+                         bounds=((0, 0, 0), (99, 99, 4)))
+    with world_map.batch():
+        world_map.fill_map((0, 0, 0), (99, 99, 4), Traversability.FREE)
+        world_map.fill_map((0, 50, 0), (89, 52, 4), Traversability.BLOCKED)
+    return world_map
+
+def requests(n: int):
+    return [((5 + 10*i, 5, i % 5), (5 + 10*(7-i), 95, 4 - i % 5)) for i in range(n)]
+
+def run_requests(world_map: WorldMap, find_path, n: int):
+    """
+    run n find_paths at once, one per thread. gives (seconds until all are done, paths)
+    """
+    paths = [None] * n
+    def _request(i, a, b):
+        paths[i] = find_path(a, b)
+    threads = [threading.Thread(target=_request, args=(i, a, b)) for i, (a, b) in enumerate(requests(n))]
+    world_map.path_cache.clear()
+    t_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t_start, paths
+
+if __name__ == "__main__":
+    world_map = wall_map()
+    workers = os.cpu_count()
+    pool = PathfindingPool(workers)
+    in_process = lambda a, b: world_map.find_path(a, b, set(), mode="astar")
+    pooled = lambda a, b: pool.find_path(world_map, a, b, set(), mode="astar")
+    # start the workers (and make the shared memory export) before timing anything
+    run_requests(world_map, pooled, workers)
+
+    print(f"{os.cpu_count()} cpus, {workers} workers")
+    for n in N_REQUESTS:
+        times = {}
+        for name, find_path in [("in-process", in_process), ("pool", pooled)]:
+            best = None
+            for _ in range(REPEATS):
+                elapsed, paths = run_requests(world_map, find_path, n)
+                best = elapsed if best == None else min(best, elapsed)
+            times[name] = best
+            lengths = [path_length(path) for path in paths]
+            if name == "in-process":
+                expected = lengths
+            assert lengths == expected, "pool and in-process paths differ"
+        print(f"{n} requests: in-process {times['in-process']*1000:8.1f}ms  pool {times['pool']*1000:8.1f}ms  "
+              f"({times['in-process']/times['pool']:.2f}x)")
+    pool.shutdown()
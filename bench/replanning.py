@@ -0,0 +1,66 @@
+"""
+obstruction-to-new-path latency on the ground corridor: incremental (d* lite) vs a full a* search
+
+a drone flies along its path while obstructions get reported and other drones move around. after every change
+both planners are asked for the new path from wherever the drone is
+
+run from the repo root with `python -m bench.replanning`
+"""
+
+import math
+import time
+
+from lib.util import *
+
+from bench.pathfinding import ground_corridor_map, path_length
+
+START = (-6, -38, 1)
+GOAL = (1, 28, 2)
+
+EVENTS = [
+        ("drone advances 5 blocks", None),
+        ("obstruction in the gap", ((0, 2, 1), (1, 6, 2), Traversability.BLOCKED)),
+        ("drone advances 5 blocks", None),
+        ("other drone moves into corridor", ("other", (-3, -20, 1))),
+        ("obstruction south of gap", ((-4, -8, -2), (4, -6, 2), Traversability.BLOCKED)),
+        ("obstruction cleared", ((0, 2, 1), (1, 6, 2), Traversability.FREE)),
+        ("other drone moves again", ("other", (-1, -10, 0))),
+        ("drone advances 5 blocks", None),
+        ("obstruction north of gap", ((0, 11, -2), (10, 13, 2), Traversability.BLOCKED)),
+        ]
+
+def timed(func):
+    stats = {}
+    t_start = time.perf_counter()
+    path = func(stats)
+    return path, stats.get("expansions", 0), time.perf_counter() - t_start
+
+if __name__ == "__main__":
+    world_map = ground_corridor_map()
+    world_map.update_drone("me", world_map.get_block_center(START))
+    world_map.update_drone("other", world_map.get_block_center((8, 25, 2)))
+    position = START
+
+    def _replan(label):
+        global position
+        # always measure the searches themselves, not the path cache
+        world_map.path_cache.clear()
+        full, full_exp, full_time = timed(lambda s: world_map.find_path(position, GOAL, {"me"}, stats=s))
+        inc, inc_exp, inc_time = timed(
+                lambda s: world_map.find_path(position, GOAL, {"me"}, stats=s, mode="incremental"))
+        assert (full == None) == (inc == None), "planners disagree on whether there's a path"
+        assert full == None or math.isclose(path_length(full), path_length(inc), rel_tol=1e-6), "incremental path isn't optimal"
+        print(f"{label:32} full a*: {full_exp:6} exp {full_time*1000:8.2f}ms | "
+              f"incremental: {inc_exp:6} exp {inc_time*1000:8.2f}ms")
+        return inc
+
+    path = _replan("initial plan")
+    for label, event in EVENTS:
+        if event == None:
+            position = path[min(5, len(path)-1)]
+            world_map.update_drone("me", world_map.get_block_center(position))
+        elif isinstance(event[0], str):
+            world_map.update_drone(event[0], world_map.get_block_center(event[1]))
+        else:
+            world_map.fill_map(*event)
+        path = _replan(label)
@@ -0,0 +1,95 @@
+"""
+scaling of reservation checks with the number of drones
+
+compares WorldMap's indexed can_reserve_block/reserve_block/reserved_block against the original versions that
+rebuilt every drone's adjacency and scanned all reservations on each call
+
+run from the repo root with `python -m bench.reservations`
+"""
+
+import random
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+def legacy_can_reserve_block(world_map: WorldMap, drone_id: str, block: MapBlockCoord) -> bool:
+    if block in world_map._occupied_blocks:
+        return False
+    if world_map._map.get(block) != Traversability.FREE:
+        return False
+    if drone_id not in world_map._drone_locations:
+        return False
+    drone_block = world_map.coord_to_block(world_map._drone_locations[drone_id])
+    if block not in adjacent_blocks(drone_block).keys() | {drone_block}:
+        return False
+    for id, pos in world_map._drone_locations.items():
+        if id == drone_id:
+            continue
+        other_block = world_map.coord_to_block(pos)
+        if block in adjacent_blocks(other_block).keys() | {other_block}:
+            return False
+    for reserved_block, reserved_id in world_map._occupied_blocks.items():
+        if reserved_id != drone_id and reserved_block == block:
+            return False
+    return True
+
+def legacy_reserved_block(world_map: WorldMap, drone_id: str) -> MapBlockCoord:
+    for block, id in world_map._occupied_blocks.items():
+        if id == drone_id:
+            return block
+    return None
+
+def build_swarm(n_drones: int) -> WorldMap:
+    """
+    drones on a lattice 3 blocks apart, each holding a reservation for the block north of it
+    """
+    side = int(n_drones ** 0.5) + 1
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid")
+    world_map.fill_map((-2, -2, 0), (side*3+2, side*3+2, 4), Traversability.FREE)
+    for i in range(n_drones):
+        block = ((i % side)*3, (i // side)*3, 2)
+        world_map.update_drone(f"drone{i}", world_map.get_block_center(block))
+        world_map.reserve_block(f"drone{i}", (block[0], block[1]+1, block[2]))
+    return world_map
+
+def time_per_call(func, args_list):
+    t_start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - t_start) / len(args_list)
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    print(f"{'drones':>7} | {'can_reserve (legacy/indexed)':>30} | {'/can_reserve x26':>24} | "
+          f"{'get_reserved':>22}")
+    for n_drones in [5, 20, 50, 100, 200, 500]:
+        world_map = build_swarm(n_drones)
+        ids = [f"drone{i}" for i in range(n_drones)]
+
+        checks = []
+        for _ in range(2000):
+            id = rand.choice(ids)
+            checks.append((id, tuple(i + rand.randint(-1, 1) for i in world_map.drone_block(id))))
+        legacy = time_per_call(lambda id, b: legacy_can_reserve_block(world_map, id, b), checks)
+        indexed = time_per_call(world_map.can_reserve_block, checks)
+        for id, b in checks:
+            assert legacy_can_reserve_block(world_map, id, b) == world_map.can_reserve_block(id, b)
+
+        # /can_reserve is usually called with a drone's full neighborhood
+        neighborhoods = [(rand.choice(ids),) for _ in range(100)]
+        def _list_check(can_reserve, id):
+            return [can_reserve(id, b) for b in adjacent_blocks(world_map.drone_block(id))]
+        list_legacy = time_per_call(
+                lambda id: _list_check(lambda i, b: legacy_can_reserve_block(world_map, i, b), id), neighborhoods)
+        list_indexed = time_per_call(lambda id: _list_check(world_map.can_reserve_block, id), neighborhoods)
+
+        lookups = [(world_map, rand.choice(ids)) for _ in range(2000)]
+        reserved_legacy = time_per_call(legacy_reserved_block, lookups)
+        reserved_indexed = time_per_call(lambda m, id: m.reserved_block(id), lookups)
+
+        print(f"{n_drones:>7} | {legacy*1e6:12.1f}us / {indexed*1e6:8.2f}us | "
+              f"{list_legacy*1e3:9.2f}ms / {list_indexed*1e3:7.3f}ms | "
+              f"{reserved_legacy*1e6:9.2f}us / {reserved_indexed*1e6:6.2f}us")
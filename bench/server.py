@@ -0,0 +1,120 @@
+"""
+reservation latency of the ground server under mixed load
+
+the server runs in its own process on the ground corridor map, with these clients hitting it over http at once:
+    drones -- N_DRONES drones on the south pads reserving/unreserving the block north of them as fast as they get
+              answers, like drone/__init__.py's next_node. these are the requests whose latency gets measured
+    pathfinders -- drones on the north pads asking for paths to the south pads, a different one every time
+    viewer -- polls /viewer/map and /log/kml every second, like the viewer and google earth do. kml is by far the
+              slowest request (seconds on this map)
+
+once with every handler on the event loop (how the old single threaded bottle server behaved) and once with slow
+handlers sent to the thread pool (ground.server's default)
+
+run from the repo root with `python -m bench.server`
+"""
+
+import asyncio
+import multiprocessing
+import socket
+import time
+
+import aiohttp
+
+from lib.util import *
+
+from bench.cooperative import NORTH_PADS, SOUTH_PADS
+from bench.pathfinding import ground_corridor_map
+
+DURATION = 20 # seconds
+N_DRONES = 8
+N_PATHFINDERS = 4
+
+def _serve(port: int, offload: bool):
+    import ground.server as server
+    from aiohttp import web
+    from ground.ground_logger import Logger
+
+    server.world_map = ground_corridor_map()
+    server.logger = Logger(server.world_map)
+    with server.world_map.batch():
+        for i in range(N_DRONES):
+            server.world_map.update_drone(f"drone{i}", server.world_map.get_block_center(SOUTH_PADS[i]))
+        for i in range(N_PATHFINDERS):
+            server.world_map.update_drone(f"pathfinder{i}", server.world_map.get_block_center(NORTH_PADS[i]))
+    web.run_app(server.make_app(offload=offload), host="127.0.0.1", port=port, print=None)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+async def run_clients(base: str):
+    world_map = ground_corridor_map() # only used for coordinates
+    latencies = []
+    counts = {"pathfind": 0, "viewer": 0}
+    deadline = time.perf_counter() + DURATION
+
+    async with aiohttp.ClientSession() as session:
+        async def _drone(i):
+            x, y, z = SOUTH_PADS[i]
+            block = serialize_block((x, y+1, z))
+            while time.perf_counter() < deadline:
+                t_start = time.perf_counter()
+                async with session.post(f"{base}/drone/drone{i}/reserve", json=block) as resp:
+                    await resp.read()
+                latencies.append(time.perf_counter() - t_start)
+                async with session.post(f"{base}/drone/drone{i}/unreserve") as resp:
+                    await resp.read()
+
+        async def _pathfinder(i):
+            # just south of the pads, the pads themselves have drones on them
+            targets = [world_map.get_block_center((x, y-1, z)) for x, y, z in SOUTH_PADS]
+            n = i
+            while time.perf_counter() < deadline:
+                target = serialize_coordinate(targets[n % len(targets)])
+                async with session.post(f"{base}/drone/pathfinder{i}/pathfind", json=target) as resp:
+                    await resp.read()
+                n += 1
+                counts["pathfind"] += 1
+
+        async def _viewer():
+            while time.perf_counter() < deadline:
+                for path in ["/viewer/map", "/log/kml"]:
+                    async with session.get(f"{base}{path}") as resp:
+                        await resp.read()
+                counts["viewer"] += 1
+                await asyncio.sleep(1)
+
+        await asyncio.gather(*[_drone(i) for i in range(N_DRONES)], *[_pathfinder(i) for i in range(N_PATHFINDERS)],
+                             _viewer())
+    return latencies, counts
+
+async def wait_for_server(base: str):
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{base}/viewer/coordinates") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientConnectionError:
+                pass
+            await asyncio.sleep(0.1)
+
+if __name__ == "__main__":
+    for name, offload in [("everything on the event loop", False), ("slow handlers on the thread pool", True)]:
+        port = _free_port()
+        base = f"http://127.0.0.1:{port}"
+        process = multiprocessing.Process(target=_serve, args=(port, offload), daemon=True)
+        process.start()
+        asyncio.run(wait_for_server(base))
+        latencies, counts = asyncio.run(run_clients(base))
+        process.terminate()
+        process.join()
+        print(f"{name}: {len(latencies)/DURATION:.0f} reservations/s  p50={percentile(latencies, 50)*1000:.1f}ms  "
+              f"p99={percentile(latencies, 99)*1000:.1f}ms  max={max(latencies)*1000:.1f}ms  "
+              f"({counts['pathfind']} pathfinds, {counts['viewer']} viewer polls)")
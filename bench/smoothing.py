@@ -0,0 +1,79 @@
+"""
+mission time and requests per mission: flying a path block by block vs flying smoothed (any-angle) segments
+
+each hop is one goto_coordinates that starts and ends stopped (accelerating/braking at ACCEL), and every
+reservation is a round trip to the ground station the drone waits on before moving. for each set of missions this
+prints averages for
+
+    grid path, per block -- what drone/__init__.py does: reserve + goto for every block of the find_path path
+    smoothed, per block -- the same over every block the smoothed segments go through (there can be more of them
+                           than on the grid path, a straight line steps through faces where a path can go diagonal)
+    smoothed, per segment -- one goto per segment, stopping only at waypoints. this needs the blocks of a whole
+                             segment reserved in one request, which /drone/<id>/reserve can't do yet
+
+run from the repo root with `python -m bench.smoothing`
+"""
+
+import math
+import time
+
+from lib.util import *
+
+from bench.cooperative import NORTH_PADS, SOUTH_PADS
+from bench.pathfinding import ground_corridor_map, wide_corridor_map
+
+BLOCK_SIZE = 10 # meters
+CRUISE_SPEED = 5 # m/s
+ACCEL = 2.5 # m/s^2
+ROUND_TRIP = 0.05 # seconds per request to the ground station
+
+def hop_time(distance: float) -> float:
+    """
+    time to fly distance meters from a stop to a stop
+    """
+    if distance >= CRUISE_SPEED**2 / ACCEL:
+        return distance / CRUISE_SPEED + CRUISE_SPEED / ACCEL
+    # never gets up to cruise speed
+    return 2 * math.sqrt(distance / ACCEL)
+
+def fly(points, requests: int):
+    """
+    (mission time, requests) for flying through the block centers in points, one hop each
+    """
+    flight = sum(hop_time(math.dist(p, q) * BLOCK_SIZE) for p, q in zip(points, points[1:]))
+    return flight + requests * ROUND_TRIP, requests
+
+MAPS = [
+        ("ground corridor, pad to pad", ground_corridor_map,
+         [(a, b) for a in SOUTH_PADS for b in NORTH_PADS] + [(b, a) for a in SOUTH_PADS for b in NORTH_PADS]),
+        ("100x100x5 wall", wide_corridor_map,
+         [((x, 5, z), (95-x, 95, 4-z)) for x in range(5, 96, 15) for z in [0, 2, 4]]),
+        ]
+
+if __name__ == "__main__":
+    for name, make_map, missions in MAPS:
+        world_map = make_map()
+        totals = {}
+        t_smoothing = 0
+        n_waypoints = 0
+        for a, b in missions:
+            path = world_map.find_path(a, b, set())
+            t_start = time.perf_counter()
+            waypoints, segments = world_map.find_path(a, b, set(), smooth=True)
+            t_smoothing += time.perf_counter() - t_start
+            swept = [waypoints[0]] + [block for segment in segments for block in segment[1:]]
+            n_waypoints += len(waypoints)
+            # one pathfind request + a reservation per hop
+            for way, (mission_time, requests) in [
+                    ("grid path, per block", fly(path, len(path))),
+                    ("smoothed, per block", fly(swept, len(swept))),
+                    ("smoothed, per segment", fly(waypoints, len(waypoints))),
+                    ]:
+                total = totals.setdefault(way, [0, 0])
+                total[0] += mission_time
+                total[1] += requests
+        print(f"{name}: {len(missions)} missions, {n_waypoints/len(missions):.1f} waypoints each, smoothing took "
+              f"{t_smoothing/len(missions)*1000:.2f}ms/path (cached search included)")
+        for way, (mission_time, requests) in totals.items():
+            print(f"    {way:22} mission time={mission_time/len(missions):6.1f}s  "
+                  f"requests={requests/len(missions):6.1f}")
@@ -0,0 +1,182 @@
+"""
+stress test for WorldMap snapshots: concurrent readers and writers on one map
+
+writers (each on its own thread):
+    monitoring -- moves 12 drones around south of a wall, all of them in one batch, like ground.monitoring
+    map updates -- flips a 10x10 gap in the wall between BLOCKED and FREE, one strip per fill_map, all in one batch
+    reservations -- reserves and unreserves blocks next to the drones
+readers:
+    checks -- grab the latest snapshot over and over and check it (see below)
+    kml/viewer -- go through every block of a snapshot like /log/kml and /viewer/map do
+    pathfinding -- find_path in "astar" and "incremental" mode, across the flipping area and short hops around
+                   the drones
+
+snapshots the readers get are checked for being complete and consistent: the flipping area is all one thing
+(never half of a batch), the drone/reservation indexes match the drones and reservations in it, and versions
+only go forward. before snapshots, readers either copied the whole map per request or could see it change under
+them, so the time a copy of a site-sized map takes is printed at the end for comparison
+
+run from the repo root with `python -m bench.snapshots`
+"""
+
+import random
+import sys
+import threading
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap, _count_adjacent
+from lib.util import *
+
+DURATION = 10 # seconds
+SIZE = 60
+HEIGHT = 6
+N_DRONES = 12
+FLIP_LOW = (25, 20, 0)
+FLIP_HIGH = (34, 29, HEIGHT-1)
+
+def stress_map(size: int=SIZE, height: int=HEIGHT, storage: str="grid") -> WorldMap:
+    bounds = ((0, 0, 0), (size-1, size-1, height-1)) if storage == "grid" else None
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage=storage, bounds=bounds)
+    with world_map.batch():
+        world_map.fill_map((0, 0, 0), (size-1, size-1, height-1), Traversability.FREE)
+        # a wall across the map, the flipping area is a gap in it
+        world_map.fill_map((0, FLIP_LOW[1], 0), (size-1, FLIP_HIGH[1], height-1), Traversability.BLOCKED)
+    return world_map
+
+def check_snapshot(snapshot):
+    """
+    raise if a snapshot isn't complete/consistent
+    """
+    mask = snapshot.blocks.box_mask(FLIP_LOW, FLIP_HIGH, Traversability.FREE)
+    assert mask.all() or not mask.any(), f"version {snapshot.version} has half of a batch"
+
+    drone_counts = {}
+    for block in snapshot.drone_blocks.values():
+        _count_adjacent(drone_counts, block, 1)
+    assert drone_counts == snapshot.drone_adjacent_counts, f"version {snapshot.version} has stale drone counts"
+    reserved_counts = {}
+    for id, blocks in snapshot.drone_reservations.items():
+        for block in blocks:
+            assert snapshot.occupied_blocks[block] == id
+            _count_adjacent(reserved_counts, block, 1)
+    assert len(snapshot.occupied_blocks) == sum(len(blocks) for blocks in snapshot.drone_reservations.values())
+    assert reserved_counts == snapshot.reserved_adjacent_counts, f"version {snapshot.version} has stale reservations"
+
+class Worker(threading.Thread):
+    """
+    runs step() until told to stop, counting steps and keeping the first error
+    """
+
+    def __init__(self, name: str, step):
+        super().__init__(name=name, daemon=True)
+        self.step = step
+        self.count = 0
+        self.error = None
+        self.stop = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                self.step()
+                self.count += 1
+        except Exception as e:
+            self.error = e
+
+def make_workers(world_map: WorldMap):
+    rand = random.Random(0)
+    ids = [f"drone{i}" for i in range(N_DRONES)]
+    positions = {id: (4 + 4*i, 5, 2) for i, id in enumerate(ids)}
+
+    def _monitoring():
+        with world_map.batch():
+            for id in ids:
+                x, y, z = positions[id]
+                x = min(max(x + rand.randint(-1, 1), 0), SIZE-1)
+                y = min(max(y + rand.randint(-1, 1), 0), FLIP_LOW[1]-3)
+                positions[id] = (x, y, z)
+                world_map.update_drone(id, world_map.get_block_center((x, y, z)))
+
+    flip = [Traversability.BLOCKED]
+    def _map_updates():
+        flip[0] = Traversability.FREE if flip[0] == Traversability.BLOCKED else Traversability.BLOCKED
+        with world_map.batch():
+            for x in range(FLIP_LOW[0], FLIP_HIGH[0]+1):
+                world_map.fill_map((x, FLIP_LOW[1], FLIP_LOW[2]), (x, FLIP_HIGH[1], FLIP_HIGH[2]), flip[0])
+        time.sleep(0.001)
+
+    def _reservations():
+        id = rand.choice(ids)
+        reserved = world_map.reserved_block(id)
+        if reserved != None:
+            world_map.unreserve_block(id, reserved)
+        else:
+            x, y, z = world_map.drone_block(id)
+            world_map.reserve_block(id, (x, y+1, z))
+
+    latest = [0]
+    def _checks():
+        snapshot = world_map.snapshot()
+        assert snapshot.version >= latest[0], "versions went backwards"
+        latest[0] = snapshot.version
+        check_snapshot(snapshot)
+
+    def _kml_viewer():
+        snapshot = world_map.snapshot()
+        n_blocked = sum(1 for _, t in snapshot.blocks.items() if t == Traversability.BLOCKED)
+        assert n_blocked > 0
+        for id, location in snapshot.drone_locations.items():
+            world_map.coord_to_block(location)
+        # the snapshot can't have changed while going through it
+        check_snapshot(snapshot)
+
+    def _pathfinding():
+        start = (rand.randrange(15, 45), rand.randrange(FLIP_LOW[1]-10, FLIP_LOW[1]-2), 3)
+        if rand.random() < 0.2:
+            goal = (rand.randrange(15, 45), rand.randrange(FLIP_HIGH[1]+2, FLIP_HIGH[1]+10), 3)
+        else:
+            goal = (start[0] + rand.randint(-10, 10), start[1] - rand.randint(5, 20), rand.randint(0, HEIGHT-1))
+        world_map.find_path(start, goal, set(), mode="astar")
+        world_map.find_path(start, goal, {"me"}, mode="incremental")
+
+    return [Worker("monitoring", _monitoring), Worker("map updates", _map_updates),
+            Worker("reservations", _reservations), Worker("checks", _checks), Worker("kml/viewer", _kml_viewer),
+            Worker("pathfinding", _pathfinding)]
+
+if __name__ == "__main__":
+    # switch threads much more often than usual, to give races every chance to show up
+    sys.setswitchinterval(1e-5)
+    world_map = stress_map()
+    workers = make_workers(world_map)
+    for worker in workers:
+        worker.start()
+    time.sleep(DURATION)
+    for worker in workers:
+        worker.stop.set()
+    for worker in workers:
+        worker.join()
+    sys.setswitchinterval(0.005)
+
+    failed = False
+    for worker in workers:
+        status = "ok" if worker.error == None else f"FAILED: {worker.error!r}"
+        failed |= worker.error != None
+        print(f"{worker.name:13} {worker.count/DURATION:9.1f}/s  {status}")
+    check_snapshot(world_map.snapshot())
+    print(f"{world_map.snapshot().version} versions published in {DURATION}s")
+
+    for storage in ["grid", "dict"]:
+        # ~5km x 5km x 100m at 10m blocks
+        site = stress_map(500, 10, storage)
+        t_start = time.perf_counter()
+        for _ in range(10):
+            site.snapshot()
+        t_snapshot = (time.perf_counter() - t_start) / 10
+        t_start = time.perf_counter()
+        for _ in range(10):
+            site.snapshot().blocks.copy()
+        t_copy = (time.perf_counter() - t_start) / 10
+        print(f"per read on a 500x500x10 {storage:4} map: snapshot() {t_snapshot*1e6:.2f}us vs copying the map "
+              f"{t_copy*1e3:.1f}ms")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,51 @@
+"""
+compares the "dict" and "grid" WorldMap storage backends
+
+measures fill time and memory on a site-sized map. tests/test_storage.py checks that both backends give the same
+answers for the same fills (random_fills below)
+
+run from the repo root with `python -m bench.storage`
+"""
+
+import random
+import time
+import tracemalloc
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+CENTER = Coordinate(35.7274488, -78.6960209, 30)
+
+def random_fills(seed: int, n: int, extent: int=30, height: int=6):
+    rand = random.Random(seed)
+    fills = [((-extent, -extent, 0), (extent, extent, height-1), Traversability.FREE)]
+    for _ in range(n):
+        a = (rand.randint(-extent-2, extent), rand.randint(-extent-2, extent), rand.randint(-1, height-1))
+        b = tuple(i + rand.randint(0, 8) for i in a)
+        fills.append((a, b, rand.choice(list(Traversability))))
+    return fills
+
+def measure_fill(storage: str, extent: int, height: int):
+    tracemalloc.start()
+    t_start = time.perf_counter()
+    world_map = WorldMap(CENTER, 10, storage=storage)
+    # one batch, like a loader would, so the map isn't copied for every fill
+    with world_map.batch():
+        world_map.fill_map((-extent, -extent, 0), (extent-1, extent-1, height-1), Traversability.FREE)
+        # a few buildings/terrain features on top
+        for i in range(-extent, extent, 20):
+            world_map.fill_map((i, -extent, 0), (i+4, extent-1, 2), Traversability.BLOCKED)
+    elapsed = time.perf_counter() - t_start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, current, peak, len(world_map._map)
+
+if __name__ == "__main__":
+    # 3km x 3km x 120m at 10m resolution
+    extent, height = 150, 12
+    for storage in ["dict", "grid"]:
+        elapsed, current, peak, blocks = measure_fill(storage, extent, height)
+        print(f"{storage:5} blocks={blocks:8} fill={elapsed*1000:9.1f}ms "
+              f"mem={current/1e6:8.2f}MB peak={peak/1e6:8.2f}MB")
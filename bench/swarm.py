@@ -0,0 +1,432 @@
+"""
+load test for the ground server: hundreds of synthetic drones flying missions against it, no sitl needed
+
+the server (ground.server's app, the monitoring loop, the lease timer) runs in this process on a generated site: rows
+of pads at the south and north ends of a field with a wall across the middle that only has a few gaps in it. every
+drone talks to it over http the way drone/__init__.py does (register, takeoff, pathfind with smooth=1, lease the
+blocks ahead / unreserve) and flies missions between a pad at one end and a free pad at the other, over and over
+
+instead of dronekit, every drone has a SyntheticVehicle that flies in straight lines at SPEED. their positions get
+sent TELEMETRY_RATE times a second into the server's usual DroneListing.on_position, like dronekit's location
+listeners do, and from there onto WorldMap.update_drone
+
+at the end this prints requests/s and latency percentiles per endpoint, as seen by the drones, how often drones got
+in each other's way (refused takeoffs, leases that got nothing or only some of the blocks, paths not found or
+dropped) and how long positions took from arriving to being on the map
+
+settings come from the environment, ex: `DRONES=400 DURATION=120 python -m bench.swarm`
+    DRONES -- how many drones (default 200)
+    DURATION -- seconds to run for (default 60)
+    SPEED -- how fast drones fly, in m/s (default 10, so a block a second)
+    PROTOCOL -- "lease" for drone/__init__.py's leases (default), "reserve" to reserve one block at a time instead
+    BUDGET -- seconds the server gets per pathfind, like drone/__init__.py's PATHFIND_BUDGET (default 0.05, 0 for
+              optimal paths however long they take)
+    PATHFIND_WORKERS -- pathfinding processes like ground/__main__.py (default 0, search in the server process)
+    TELEMETRY_RATE -- positions per second from every drone (default ground.monitoring.TELEMETRY_RATE)
+    BATCH_INTERVAL -- seconds positions get collected for before being applied together (default
+                      ground.monitoring.BATCH_INTERVAL). TELEMETRY_RATE=1 BATCH_INTERVAL=1 is about what the old
+                      once a second polling of every drone did
+
+run from the repo root with `python -m bench.swarm`
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+from aerpawlib.util import Coordinate
+
+import ground.server as server
+from ground.ground_logger import Logger
+import ground.monitoring as monitoring
+from ground.monitoring import DroneListing
+from lib.mapping import MapBlockCoordSystem, WorldMap
+from lib.pathfinding import line_crossings
+from lib.pool import PathfindingPool
+from lib.util import *
+
+N_DRONES = int(os.environ.get("DRONES", 200))
+DURATION = float(os.environ.get("DURATION", 60)) # seconds
+SPEED = float(os.environ.get("SPEED", 10)) # m/s
+PROTOCOL = os.environ.get("PROTOCOL", "lease")
+BUDGET = float(os.environ.get("BUDGET", 0.05)) # seconds
+PATHFIND_WORKERS = int(os.environ.get("PATHFIND_WORKERS", 0))
+TELEMETRY_RATE = int(os.environ.get("TELEMETRY_RATE", monitoring.TELEMETRY_RATE)) # hz
+BATCH_INTERVAL = float(os.environ.get("BATCH_INTERVAL", monitoring.BATCH_INTERVAL)) # seconds
+
+LEASE_BLOCKS = 8 # same as drone/__init__.py
+RAMP = 5 # seconds over which drones start up
+PADS_PER_ROW = 20
+PAD_SPACING = 3 # blocks between pads, so that drones on neighboring pads don't touch
+FIELD_LENGTH = 40 # blocks between the rows of pads at each end
+FIELD_HEIGHT = 5 # blocks
+
+def swarm_site(n_drones: int):
+    """
+    get (map, south pads, north pads) with a pad per drone at each end, plus a spare row
+    """
+    rows = math.ceil(n_drones / PADS_PER_ROW) + 1
+    width = PADS_PER_ROW * PAD_SPACING
+    north_y = (rows - 1) * PAD_SPACING + FIELD_LENGTH
+    length = north_y + (rows - 1) * PAD_SPACING + 1
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid",
+                         bounds=((0, 0, 0), (width - 1, length - 1, FIELD_HEIGHT - 1)))
+    with world_map.batch():
+        world_map.fill_map((0, 0, 0), (width - 1, length - 1, FIELD_HEIGHT - 1), Traversability.FREE)
+        # a wall across the middle, with a 2 block gap every 10 blocks
+        wall_y = length // 2
+        world_map.fill_map((0, wall_y, 0), (width - 1, wall_y + 1, FIELD_HEIGHT - 1), Traversability.BLOCKED)
+        for x in range(4, width, 10):
+            world_map.fill_map((x, wall_y, 0), (x + 1, wall_y + 1, FIELD_HEIGHT - 1), Traversability.FREE)
+    south = [(x, row * PAD_SPACING, 0) for row in range(rows) for x in range(1, width, PAD_SPACING)]
+    north = [(x, north_y + row * PAD_SPACING, 0) for row in range(rows) for x in range(1, width, PAD_SPACING)]
+    return world_map, south, north
+
+class SyntheticVehicle:
+    """
+    stands in for a dronekit vehicle: flies straight lines at SPEED, always has a heartbeat
+
+    positions are in blocks (block centers are whole numbers), what location() gives is the coordinate
+    """
+
+    last_heartbeat = 0.0
+
+    def __init__(self, coord_system: MapBlockCoordSystem, position):
+        self._coord_system = coord_system
+        self._resolution = coord_system._resolution
+        # (start position, end position, start time, end time) of the current move
+        self._move = (position, position, 0.0, 0.0)
+
+    def position(self):
+        a, b, t_start, t_end = self._move
+        now = time.monotonic()
+        if now >= t_end:
+            return b
+        t = (now - t_start) / (t_end - t_start)
+        return tuple(p + (q-p)*t for p, q in zip(a, b))
+
+    def block(self) -> MapBlockCoord:
+        return tuple(math.floor(i + 0.5) for i in self.position())
+
+    def location(self) -> Coordinate:
+        return self._coord_system.get_block_center(self.position())
+
+    async def goto(self, position):
+        start = self.position()
+        duration = math.dist(start, position) * self._resolution / SPEED
+        now = time.monotonic()
+        self._move = (start, tuple(position), now, now + duration)
+        await asyncio.sleep(duration)
+
+class SyntheticConnection:
+    """
+    what DroneListing keeps per drone (see ground.monitoring.DroneConnection), for a SyntheticVehicle
+    """
+
+    def __init__(self, id: str, vehicle: SyntheticVehicle):
+        self._id = id
+        self._vehicle = vehicle
+
+    def vehicle_heartbeat_ok(self):
+        return True
+
+    def status(self) -> dict:
+        return {"state": monitoring.CONNECTED, "attempts": 0, "error": None, "retry_in": None, "heartbeat_age": 0.0}
+
+    def location(self) -> Coordinate:
+        return self._vehicle.location()
+
+class SyntheticDroneListing(DroneListing):
+    """
+    DroneListing whose /drone/add hooks up the SyntheticVehicle made for that id instead of connecting with
+    dronekit. get_telemetry_func sends their positions in, which dronekit's threads would do
+    """
+
+    def __init__(self, world_map: WorldMap, logger: Logger, vehicles: dict):
+        super().__init__(world_map, logger, BATCH_INTERVAL, TELEMETRY_RATE)
+        self._vehicles = vehicles
+
+    def add_drone(self, id: str, conn_str: str):
+        self._drones[id] = SyntheticConnection(id, self._vehicles[id])
+
+    def get_telemetry_func(self, stop_event: threading.Event):
+        # every drone's position TELEMETRY_RATE times a second, spread out evenly like separate drones would be
+        def _inner():
+            period = 1 / TELEMETRY_RATE
+            while not stop_event.is_set():
+                t_start = time.monotonic()
+                drones = list(self._drones.values())
+                for i, drone in enumerate(drones):
+                    delay = t_start + period * i / len(drones) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    location = drone.location()
+                    self.on_position(drone._id, location.lat, location.lon, location.alt)
+                stop_event.wait(max(t_start + period - time.monotonic(), 0))
+        return _inner
+
+class Missions:
+    """
+    hands out mission targets: a pad at the other end that nobody is on or headed to
+    """
+
+    def __init__(self, south, north, vehicles: dict, seed: int):
+        self._south = south
+        self._north = north
+        self._vehicles = vehicles
+        self._rand = random.Random(seed)
+        self.goals = {}
+        self.completed = 0
+
+    def new_goal(self, id: str) -> MapBlockCoord:
+        pads = self._north if self._vehicles[id].block()[1] < self._north[0][1] else self._south
+        taken = set(self.goals.values()) | {vehicle.block() for vehicle in self._vehicles.values()}
+        self.goals[id] = self._rand.choice([p for p in pads if p not in taken])
+        return self.goals[id]
+
+class Stats:
+    def __init__(self):
+        self.latencies = {} # maps endpoint -> [seconds]
+        self.errors = {} # maps endpoint -> requests that failed or got an unexpected status
+        self.contention = {
+                "takeoffs": 0, "takeoffs refused": 0,
+                "reservations": 0, "reservations refused": 0, "partial": 0,
+                "blocks asked": 0, "blocks granted": 0,
+                "pathfinds": 0, "no path": 0, "dropped": 0,
+                }
+
+    def count(self, key: str, n: int=1):
+        self.contention[key] += n
+
+class SyntheticDrone:
+    """
+    a drone's side of the protocol, following drone/__init__.py's PathingDrone state by state
+    """
+
+    def __init__(self, id: str, base: str, session: aiohttp.ClientSession, vehicle: SyntheticVehicle,
+                 missions: Missions, stats: Stats, rand: random.Random):
+        self._id = id
+        self._base = base
+        self._session = session
+        self._vehicle = vehicle
+        self._missions = missions
+        self._stats = stats
+        self._rand = rand
+        self._path = None
+        self._legs = None
+        self._target = None
+
+    async def _request(self, method: str, endpoint: str, ok=(200,), **kwargs):
+        # returns (status, json body or None). endpoint is the route, with {id} for the drone's id
+        url = self._base + endpoint.replace("{id}", self._id)
+        t_start = time.perf_counter()
+        try:
+            async with self._session.request(method, url, **kwargs) as resp:
+                status = resp.status
+                body = await resp.read()
+        except aiohttp.ClientError:
+            status, body = None, b""
+        key = f"{method} {endpoint}"
+        self._stats.latencies.setdefault(key, []).append(time.perf_counter() - t_start)
+        if status not in ok:
+            self._stats.errors[key] = self._stats.errors.get(key, 0) + 1
+        if status != 200 or len(body) == 0:
+            return status, None
+        return status, json.loads(body)
+
+    async def run(self):
+        state = "start"
+        while True:
+            state = await getattr(self, state)()
+
+    async def start(self):
+        await asyncio.sleep(self._rand.uniform(0, RAMP))
+        status, _ = await self._request("POST", "/drone/add", json={"id": self._id, "connection": "synthetic"})
+        if status != 200:
+            return "start"
+        _, j = await self._request("GET", "/drone/{id}/coordinates")
+        self._coord_system = MapBlockCoordSystem(deserialize_coordinate(j["center"]), j["resolution"])
+        # wait a bit to make sure that the server has our location
+        await asyncio.sleep(1 / TELEMETRY_RATE + 2 * BATCH_INTERVAL)
+        return "request_takeoff"
+
+    async def request_takeoff(self):
+        _, j = await self._request("POST", "/drone/{id}/takeoff")
+        self._stats.count("takeoffs")
+        if j == None or not j["clear"]:
+            self._stats.count("takeoffs refused")
+            await asyncio.sleep(self._rand.randint(2, 7))
+            return "request_takeoff"
+        self._target = self._missions.new_goal(self._id)
+        return "request_path"
+
+    async def request_path(self):
+        target = serialize_coordinate(self._coord_system.get_block_center(self._target))
+        params = {"smooth": 1} if BUDGET == 0 else {"smooth": 1, "budget": BUDGET}
+        status, j = await self._request("POST", "/drone/{id}/pathfind", ok=(200, 400, 409, 503), params=params,
+                                        json=target)
+        self._stats.count("pathfinds")
+        if status == 400:
+            self._stats.count("no path")
+            await asyncio.sleep(5)
+            return "request_path"
+        if status in [409, 503]:
+            self._stats.count("dropped")
+            await asyncio.sleep(self._rand.randint(1, 5))
+            return "request_path"
+        if status != 200:
+            await asyncio.sleep(self._rand.randint(3, 10))
+            return "request_path"
+        self._path = [deserialize_block(i) for i in j["path"]]
+        waypoints = [deserialize_block(i) for i in j["waypoints"]]
+        self._legs = []
+        start = 0
+        for a, b, segment in zip(waypoints, waypoints[1:], j["segments"]):
+            self._legs.append((start, start + len(segment) - 1, a, b))
+            start += len(segment) - 1
+        return "next_node"
+
+    async def _give_up(self):
+        # unreserve, wait ~5s and plan again
+        await self._request("POST", "/drone/{id}/unreserve", ok=(200, 400))
+        await asyncio.sleep(5)
+        return "request_path"
+
+    async def next_node(self):
+        current_node = self._vehicle.block()
+        if current_node not in self._path:
+            await self._request("POST", "/drone/{id}/unreserve", ok=(200, 400))
+            return "request_path"
+        node_index = self._path.index(current_node)
+        if node_index + 1 == len(self._path):
+            # instead of landing, start the next mission from here
+            self._missions.completed += 1
+            self._target = self._missions.new_goal(self._id)
+            return "request_path"
+        if PROTOCOL == "reserve":
+            return await self._reserve_next(node_index)
+        return await self._lease_ahead(node_index)
+
+    async def _reserve_next(self, node_index: int):
+        # the way drones flew before leases: reserve the next block, fly to its center, repeat
+        next_block = self._path[node_index+1]
+        _, j = await self._request("POST", "/drone/{id}/reserve", json=serialize_block(next_block))
+        self._stats.count("reservations")
+        self._stats.count("blocks asked")
+        if j == None or not j["success"]:
+            self._stats.count("reservations refused")
+            return await self._give_up()
+        self._stats.count("blocks granted")
+        await self._vehicle.goto(next_block)
+        return "next_node"
+
+    async def _lease_ahead(self, node_index: int):
+        _, leg_end, leg_a, leg_b = next(leg for leg in self._legs if leg[0] <= node_index < leg[1])
+        ahead = self._path[node_index+1:min(leg_end, node_index+LEASE_BLOCKS)+1]
+        _, j = await self._request("POST", "/drone/{id}/lease", json={"blocks": [serialize_block(i) for i in ahead]})
+        if j == None:
+            await asyncio.sleep(5)
+            return "next_node"
+        leased = [deserialize_block(i) for i in j["blocks"]]
+        self._stats.count("reservations")
+        self._stats.count("blocks asked", len(ahead))
+        self._stats.count("blocks granted", len(leased))
+        if len(leased) == 0:
+            self._stats.count("reservations refused")
+            return await self._give_up()
+        if len(leased) < len(ahead):
+            self._stats.count("partial")
+        last_block = leased[-1]
+        if last_block == leg_b:
+            target = last_block
+        else:
+            # stop halfway through the last leased block, which is still on the segment
+            crossings = line_crossings(leg_a, leg_b)
+            i = [block for block, _ in crossings].index(last_block)
+            t = (crossings[i][1] + crossings[i+1][1]) / 2
+            target = tuple(p + (q-p)*t for p, q in zip(leg_a, leg_b))
+        await self._vehicle.goto(target)
+        return "next_node"
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+async def run(seed: int=0):
+    world_map, south, north = swarm_site(N_DRONES)
+    rand = random.Random(seed)
+    ids = [f"drone{i}" for i in range(N_DRONES)]
+    vehicles = {id: SyntheticVehicle(world_map, pad) for id, pad in zip(ids, rand.sample(south, N_DRONES))}
+
+    server.world_map = world_map
+    server.logger = Logger(world_map)
+    server.drones = SyntheticDroneListing(world_map, server.logger, vehicles)
+    if PATHFIND_WORKERS > 0:
+        server.pool = PathfindingPool(PATHFIND_WORKERS)
+    stop = threading.Event()
+    monitoring_thread = threading.Thread(target=server.drones.get_daemon_func(stop))
+    monitoring_thread.start()
+    telemetry_thread = threading.Thread(target=server.drones.get_telemetry_func(stop))
+    telemetry_thread.start()
+
+    missions = Missions(south, north, vehicles, seed)
+    stats = Stats()
+    try:
+        async with TestServer(server.make_app()) as test_server:
+            base = str(test_server.make_url("")).rstrip("/")
+            # a connection per drone, like every drone being its own client
+            connector = aiohttp.TCPConnector(limit=0)
+            async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+                drones = [SyntheticDrone(id, base, session, vehicles[id], missions, stats, random.Random(rand.random()))
+                          for id in ids]
+                tasks = [asyncio.create_task(drone.run()) for drone in drones]
+                t_cpu = time.process_time()
+                await asyncio.sleep(DURATION)
+                cpu = time.process_time() - t_cpu
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        stop.set()
+        monitoring_thread.join()
+        telemetry_thread.join()
+        if server.pool != None:
+            server.pool.shutdown()
+            server.pool = None
+    return stats, missions.completed, cpu
+
+if __name__ == "__main__":
+    stats, completed, cpu = asyncio.run(run())
+    total = sum(len(i) for i in stats.latencies.values())
+    budget = "optimal paths" if BUDGET == 0 else f"{BUDGET*1000:.0f}ms pathfind budget"
+    print(f"{N_DRONES} drones for {DURATION:.0f}s ({PROTOCOL}, {SPEED:.0f}m/s, {budget}): {total} requests, "
+          f"{total/DURATION:.1f}/s, {completed} missions, cpu={cpu/DURATION*100:.0f}%")
+    print(f"    {'endpoint':28} {'requests':>8} {'/s':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'errors':>6}")
+    for endpoint, latencies in sorted(stats.latencies.items(), key=lambda i: -len(i[1])):
+        print(f"    {endpoint:28} {len(latencies):8} {len(latencies)/DURATION:7.1f} "
+              + " ".join(f"{percentile(latencies, p)*1000:7.1f}ms" for p in [50, 90, 99])
+              + f" {max(latencies)*1000:7.1f}ms {stats.errors.get(endpoint, 0):6}")
+    c = stats.contention
+    print("contention:")
+    print(f"    takeoffs refused     {c['takeoffs refused']} of {c['takeoffs']}")
+    print(f"    {PROTOCOL + 's refused':20} {c['reservations refused']} of {c['reservations']} "
+          f"({c['partial']} more got only some of the blocks)")
+    print(f"    blocks granted       {c['blocks granted']} of {c['blocks asked']} asked for "
+          f"({c['blocks granted']/max(c['blocks asked'], 1)*100:.0f}%)")
+    print(f"    no path              {c['no path']} of {c['pathfinds']} pathfinds ({c['dropped']} more dropped by "
+          f"the server, see ground.scheduler)")
+    lag = monitoring.INGEST_LAG.labels()
+    batches = monitoring.BATCH_SIZE.labels()
+    applied = monitoring.POSITIONS.labels("applied").value
+    replaced = monitoring.POSITIONS.labels("replaced").value
+    print(f"positions ({TELEMETRY_RATE}hz, {BATCH_INTERVAL*1000:.0f}ms batches):")
+    print(f"    applied              {applied:.0f} in {sum(batches.counts)} batches ({replaced:.0f} more replaced by a "
+          f"newer one first)")
+    print(f"    ingest lag           {lag.sum/max(sum(lag.counts), 1)*1000:.1f}ms mean")
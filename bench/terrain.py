@@ -0,0 +1,144 @@
+"""
+loading a large synthetic site from a heightmap + obstacle file with lib.terrain vs a fill_map per column
+
+the site is ~4.4 x 3.6 km of rolling hills sampled every ~2m (2000 x 2000 cells), with 300 buildings. a small version
+gets cross-checked against a plain python resampling first
+
+run from the repo root with `python -m bench.terrain`
+"""
+
+import json
+import math
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.terrain import Heightmap, fill_obstacles, fill_terrain, load_heightmap, load_obstacles
+from lib.util import *
+
+CENTER = Coordinate(35.7274488, -78.6960209, 30)
+CELL_SIZE = 2e-5 # degrees
+
+def synthetic_heightmap(rows: int, cols: int, seed: int=0) -> Heightmap:
+    rand = random.Random(seed)
+    lat_idx, lon_idx = np.meshgrid(np.arange(rows), np.arange(cols), indexing="ij")
+    heights = 120 + 15*np.sin(lat_idx / 97) * np.cos(lon_idx / 131)
+    for _ in range(6):
+        r, c, size = rand.randrange(rows), rand.randrange(cols), rand.uniform(50, 300)
+        heights += rand.uniform(10, 60) * np.exp(-((lat_idx-r)**2 + (lon_idx-c)**2) / size**2)
+    heights[:3, :3] = np.nan # a bit of missing data
+    south = CENTER.lat - rows/2 * CELL_SIZE
+    west = CENTER.lon - cols/2 * CELL_SIZE
+    return Heightmap(heights, south, west, CELL_SIZE)
+
+def synthetic_obstacles(heightmap: Heightmap, n: int, seed: int=0):
+    rand = random.Random(seed)
+    features = []
+    for _ in range(n):
+        lat = rand.uniform(heightmap.south, heightmap.north)
+        lon = rand.uniform(heightmap.west, heightmap.east)
+        w, h = rand.uniform(1e-4, 5e-4), rand.uniform(1e-4, 5e-4)
+        ring = [[lon, lat], [lon+w, lat], [lon+w, lat+h], [lon, lat+h], [lon, lat]]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {"height": rand.uniform(20, 80)},
+            })
+    return {"type": "FeatureCollection", "features": features}
+
+def save_ascii_grid(heightmap: Heightmap, path: str):
+    rows, cols = heightmap.heights.shape
+    with open(path, "w") as f:
+        f.write(f"ncols {cols}\nnrows {rows}\nxllcorner {heightmap.west}\nyllcorner {heightmap.south}\n"
+                f"cellsize {heightmap.cell_size}\nNODATA_value -9999\n")
+        np.savetxt(f, np.nan_to_num(heightmap.heights, nan=-9999), fmt="%.2f")
+
+def legacy_fill_terrain(world_map: WorldMap, heightmap: Heightmap, ceiling: float=120):
+    """
+    what loading terrain took before: sample each column and fill_map it, one at a time
+    """
+    base = float(heightmap.sample(np.array([CENTER.lat]), np.array([CENTER.lon]))[0])
+    low = world_map.coord_to_block(Coordinate(heightmap.south, heightmap.west, 0))
+    high = world_map.coord_to_block(Coordinate(heightmap.north, heightmap.east, 0))
+    z_high = math.floor((ceiling - CENTER.alt) / world_map._resolution)
+    # one batch, otherwise every fill_map would publish (and copy) the whole map
+    with world_map.batch():
+        for x in range(low[0], high[0]+1):
+            for y in range(low[1], high[1]+1):
+                c = world_map.get_block_center((x, y, 0))
+                height = float(heightmap.sample(np.array([c.lat]), np.array([c.lon]))[0])
+                if math.isnan(height):
+                    continue
+                top = math.floor((height - base - CENTER.alt) / world_map._resolution)
+                world_map.fill_map((x, y, top-20), (x, y, top), Traversability.BLOCKED)
+                world_map.fill_map((x, y, top+1), (x, y, z_high), Traversability.FREE)
+
+def cross_check():
+    """
+    compare fill_terrain on a small site against resampling it with plain python
+    """
+    heightmap = synthetic_heightmap(120, 150, seed=1)
+    base = float(heightmap.sample(np.array([CENTER.lat]), np.array([CENTER.lon]))[0])
+    for storage in ["dict", "grid"]:
+        world_map = WorldMap(CENTER, 10, storage=storage)
+        fill_terrain(world_map, heightmap)
+
+        surface = {}
+        lats, lons = heightmap.cell_centers()
+        for r, lat in enumerate(lats):
+            for c, lon in enumerate(lons):
+                if not math.isnan(heightmap.heights[r, c]):
+                    x, y, _ = world_map.coord_to_block(Coordinate(lat, lon, 0))
+                    surface[x, y] = max(surface.get((x, y), -math.inf), float(heightmap.heights[r, c]))
+        for (x, y), height in list(surface.items()):
+            c = world_map.get_block_center((x, y, 0))
+            center_height = float(heightmap.sample(np.array([c.lat]), np.array([c.lon]))[0])
+            if not math.isnan(center_height):
+                surface[x, y] = max(height, center_height)
+
+        for (x, y), height in surface.items():
+            top = math.floor((height - base - CENTER.alt) / 10)
+            column = dict(world_map._map.column(x, y))
+            assert column[top] == Traversability.BLOCKED, f"{(x, y, top)} should be terrain"
+            assert column.get(top+1, Traversability.FREE) == Traversability.FREE, f"{(x, y, top+1)} should be air"
+            assert all(t == Traversability.BLOCKED for z, t in column.items() if z <= top)
+    print("cross-check against python resampling ok")
+
+if __name__ == "__main__":
+    cross_check()
+
+    heightmap = synthetic_heightmap(2000, 2000)
+    obstacles = synthetic_obstacles(heightmap, 300)
+    with tempfile.TemporaryDirectory() as tmp:
+        npz_path = os.path.join(tmp, "site.npz")
+        asc_path = os.path.join(tmp, "site.asc")
+        obstacle_path = os.path.join(tmp, "obstacles.json")
+        np.savez(npz_path, heights=heightmap.heights, south=heightmap.south, west=heightmap.west,
+                 cell_size=heightmap.cell_size)
+        save_ascii_grid(heightmap, asc_path)
+        with open(obstacle_path, "w") as f:
+            json.dump(obstacles, f)
+
+        for path in [npz_path, asc_path]:
+            world_map = WorldMap(CENTER, 10, storage="grid")
+            t_start = time.perf_counter()
+            loaded = load_heightmap(path)
+            t_loaded = time.perf_counter()
+            fill_terrain(world_map, loaded)
+            t_filled = time.perf_counter()
+            fill_obstacles(world_map, load_obstacles(obstacle_path))
+            t_obstacles = time.perf_counter()
+            print(f"{os.path.basename(path):9} read {(t_loaded-t_start)*1000:7.0f}ms | "
+                  f"terrain {(t_filled-t_loaded)*1000:6.0f}ms | 300 obstacles {(t_obstacles-t_filled)*1000:6.0f}ms | "
+                  f"{len(world_map._map)} blocks")
+
+    world_map = WorldMap(CENTER, 10, storage="grid")
+    t_start = time.perf_counter()
+    legacy_fill_terrain(world_map, heightmap)
+    print(f"fill_map per column (terrain only, center samples): {(time.perf_counter()-t_start)*1000:.0f}ms")
@@ -0,0 +1,115 @@
+"""
+keeping a viewer up to date: polling /viewer/map every second vs following /viewer/stream
+
+8 drones wander around the map (a move every 0.1s between them, each one reserving its next block first, like the
+real ones do) while a viewer keeps up with the map for DURATION seconds. for both ways this prints the size of the
+first response, the bytes the viewer got per second after the stream's first snapshot (polling gets a whole map
+every time), and the cpu time the whole process (server, viewer and drones) used per second. the drones are the
+same both times, so the difference is what keeping the viewer updated costs
+
+the same thing runs on the ground corridor (~7k blocks) and the 100x100x5 wall (50k blocks). both get the map as
+lib.encoding's compressed grid, polling all of it every time and streaming once and then only what changes
+
+run from the repo root with `python -m bench.viewer`
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+import ground.server as server
+from lib.encoding import MAP_CONTENT_TYPE, decode_map
+from lib.util import *
+
+from bench.pathfinding import ground_corridor_map, wide_corridor_map
+
+DURATION = 10 # seconds
+N_DRONES = 8
+MOVE_INTERVAL = 0.1 # seconds
+
+def wander(world_map, stop: threading.Event, seed: int=0):
+    """
+    move drones to random free neighboring blocks until stop is set
+    """
+    rand = random.Random(seed)
+    free = [block for block, traversability in world_map.snapshot().blocks.items()
+            if traversability == Traversability.FREE]
+    ids = [f"drone{i}" for i in range(N_DRONES)]
+    for id in ids:
+        world_map.update_drone(id, world_map.get_block_center(rand.choice(free)))
+    while not stop.wait(MOVE_INTERVAL):
+        id = rand.choice(ids)
+        block = world_map.drone_block(id)
+        neighbors = [n for n in adjacent_blocks(block) if world_map.can_reserve_block(id, n)]
+        if len(neighbors) == 0:
+            continue
+        next_block = rand.choice(neighbors)
+        world_map.reserve_block(id, next_block)
+        world_map.update_drone(id, world_map.get_block_center(next_block))
+
+async def poll(session: aiohttp.ClientSession, base: str, deadline: float):
+    received = 0
+    first = None
+    while time.perf_counter() < deadline:
+        async with session.get(f"{base}/viewer/map", headers={"Accept": MAP_CONTENT_TYPE}) as resp:
+            body = await resp.read()
+        received += len(body)
+        if first == None:
+            first = len(body)
+        decode_map(body)
+        await asyncio.sleep(1)
+    return received, first
+
+async def stream(session: aiohttp.ClientSession, base: str, deadline: float):
+    # the snapshot that starts the stream is counted on its own, it's about the size of a poll (the same grid, in
+    # base64)
+    received = 0
+    snapshot = None
+    buffer = b""
+    async with session.get(f"{base}/viewer/stream") as resp:
+        while time.perf_counter() < deadline:
+            try:
+                chunk = await asyncio.wait_for(resp.content.readany(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                if snapshot == None:
+                    received += len(line) + 1
+                    if line.startswith(b"data:"):
+                        snapshot, received = received, 0
+                else:
+                    received += len(line) + 1
+                if line.startswith(b"data:"):
+                    json.loads(line[len(b"data:"):])
+    return received, snapshot
+
+async def run(make_map, follow):
+    server.world_map = make_map()
+    stop = threading.Event()
+    drones = threading.Thread(target=wander, args=(server.world_map, stop))
+    drones.start()
+    try:
+        async with TestServer(server.make_app()) as test_server:
+            base = str(test_server.make_url("")).rstrip("/")
+            async with aiohttp.ClientSession() as session:
+                t_cpu = time.process_time()
+                received, first = await follow(session, base, time.perf_counter() + DURATION)
+                cpu = time.process_time() - t_cpu
+    finally:
+        stop.set()
+        drones.join()
+    return received / DURATION, first, cpu / DURATION
+
+if __name__ == "__main__":
+    for name, make_map in [("ground corridor", ground_corridor_map), ("100x100x5 wall", wide_corridor_map)]:
+        print(f"{name}: {len(make_map().snapshot().blocks)} blocks")
+        for way, follow in [("polling /viewer/map", poll), ("/viewer/stream", stream)]:
+            bytes_per_second, first, cpu = asyncio.run(run(make_map, follow))
+            print(f"    {way:20} first response {first/1000:7.1f}kB, then {bytes_per_second/1000:8.1f}kB/s  "
+                  f"cpu={cpu*100:5.1f}%")
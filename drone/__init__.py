@@ -16,6 +16,7 @@ from aerpawlib.vehicle import Drone
 
 from lib.util import *
 from lib.mapping import *
+from lib.pathfinding import line_crossings
 
 # TODO load from config
 GROUND_HOST  = "http://ground-service:8080" if "GROUNDHOST" not in os.environ else os.environ["GROUNDHOST"]
@@ -24,6 +25,8 @@ MAV_HOST     = "127.0.0.1:5761" if "MAVHOST" not in os.environ else os.environ["
 # MAV_HOST = "127.0.0.1:5761"
 DRONE_ID     = "DRONE-A" if "DRONEID" not in os.environ else os.environ["DRONEID"]
 TARGET_COORD = Coordinate(*[float(i) for i in os.environ["TARGETCOORD"].split(",")], 0)
+LEASE_BLOCKS = 8 # how many blocks ahead to reserve at once
+PATHFIND_BUDGET = 0.05 # seconds the ground station gets to find a good enough path, instead of the best one
 
 class PathingDrone(StateMachine):
     _world_map: MapBlockCoordSystem
@@ -53,9 +56,16 @@ class PathingDrone(StateMachine):
         
         self._target_coordinate = Coordinate(TARGET_COORD.lat, TARGET_COORD.lon, self._world_map._center_coords.alt)
 
-        # wait a bit to make sure that the server grabs our location
+        # the server connects to us in the background, wait for that and then a bit for it to get our location
+        print("waiting for the server to connect to us...")
+        while True:
+            resp = requests.get(url=f"{GROUND_HOST}/drone/{DRONE_ID}/connection")
+            assert resp.status_code == 200
+            if resp.json()["state"] == "connected":
+                break
+            await asyncio.sleep(0.5)
         print("waiting to make sure server knows where we are...")
-        await asyncio.sleep(5)
+        await asyncio.sleep(1)
 
         return "requesting_takeoff"
 
@@ -82,6 +92,7 @@ class PathingDrone(StateMachine):
         return "get_path"
 
     _path=None
+    _legs=None
 
     @state(name="get_path")
     async def request_path(self, drone: Drone):
@@ -90,6 +101,7 @@ class PathingDrone(StateMachine):
         try:
             resp = requests.post(
                     url=f"{GROUND_HOST}/drone/{DRONE_ID}/pathfind",
+                    params={"smooth": 1, "budget": PATHFIND_BUDGET},
                     json=serialize_coordinate(self._target_coordinate),
                     timeout=None                         # pathfinding is hard :)
                     )
@@ -104,12 +116,27 @@ class PathingDrone(StateMachine):
             print("waiting 5s and asking again")
             await asyncio.sleep(5)
             return "get_path"
+        if resp.status_code in [409, 503]:
+            # the ground station dropped the request (too busy to plan it in time, or a newer one replaced it)
+            print("ground station couldn't plan in time")
+            print("using a random backoff")
+            await asyncio.sleep(random.randint(1, 5))
+            return "get_path"
         if resp.status_code != 200:
             print("request error. RTL")
             return "rtl"
-        self._path = [deserialize_block(i) for i in resp.json()["path"]]
-        print("path obtained:")
-        print(self._path)
+        j = resp.json()
+        # path is every block flying the straight segments between waypoints goes through, in order
+        self._path = [deserialize_block(i) for i in j["path"]]
+        waypoints = [deserialize_block(i) for i in j["waypoints"]]
+        # (index in path of the segment's first block, index of its last, first waypoint, last waypoint)
+        self._legs = []
+        start = 0
+        for a, b, segment in zip(waypoints, waypoints[1:], j["segments"]):
+            self._legs.append((start, start + len(segment) - 1, a, b))
+            start += len(segment) - 1
+        print(f"path obtained (at most {j['bound']:.2f}x longer than the best one):")
+        print(waypoints)
         return "next_node"
 
     @state(name="next_node")
@@ -131,21 +158,21 @@ class PathingDrone(StateMachine):
             print("path complete. landing here")
             return "land"
         
-        next_block = self._path[node_index+1]
-        next_block_coords = self._world_map.get_block_center(next_block)
-    
-        # request permission to enter block
+        # lease the blocks ahead up to the end of this segment, then fly straight along it as far as the lease goes
+        # the ground station gives blocks back as we fly through them, so the next lease picks up where this left
+        _, leg_end, leg_a, leg_b = next(leg for leg in self._legs if leg[0] <= node_index < leg[1])
+        ahead = self._path[node_index+1:min(leg_end, node_index+LEASE_BLOCKS)+1]
         resp = requests.post(
-                url=f"{GROUND_HOST}/drone/{DRONE_ID}/reserve",
-                json=serialize_block(next_block)
+                url=f"{GROUND_HOST}/drone/{DRONE_ID}/lease",
+                json={"blocks": [serialize_block(i) for i in ahead]}
                 )
         if resp.status_code != 200:
-            print("error requesting next block.")
+            print("error requesting next blocks.")
             print("backing off and trying again...")
             await asyncio.sleep(5)
             return "next_node"
-        j = resp.json()
-        if not j["success"]:
+        leased = [deserialize_block(i) for i in resp.json()["blocks"]]
+        if len(leased) == 0:
             print("reservation failed.")
             print("unreserving blocks, waiting 5s and requesting a new path...")
             resp = requests.post(
@@ -156,8 +183,17 @@ class PathingDrone(StateMachine):
             await asyncio.sleep(5)
             return "get_path"
 
-        print(f"going to next block {next_block} @ {next_block_coords.lat, next_block_coords.lon, next_block_coords.alt}")
-        await drone.goto_coordinates(next_block_coords)
+        last_block = leased[-1]
+        if last_block == leg_b:
+            target = self._world_map.get_block_center(last_block)
+        else:
+            # stop halfway through the last leased block, which is still on the segment
+            crossings = line_crossings(leg_a, leg_b)
+            i = [block for block, _ in crossings].index(last_block)
+            t = (crossings[i][1] + crossings[i+1][1]) / 2
+            target = self._world_map.get_block_center(tuple(p + (q-p)*t for p, q in zip(leg_a, leg_b)))
+        print(f"going through {len(leased)} blocks to {last_block} @ {target.lat, target.lon, target.alt}")
+        await drone.goto_coordinates(target)
 
         return "next_node"
 
@@ -175,5 +211,10 @@ class PathingDrone(StateMachine):
     async def land(self, drone: Drone):
         # land the drone, in place
         print("landing (not requesting permission)")
+        resp = requests.post(
+                url=f"{GROUND_HOST}/drone/{DRONE_ID}/land"
+                )
+        if resp.status_code != 200:
+            print("couldn't tell the server we're landing. continuing")
         await drone.land()
         print("done!")
@@ -9,9 +9,10 @@ supports:
     managing corridors
 """
 
+import os
 import threading
 
-from bottle import run
+from aiohttp import web
 
 from aerpawlib.util import Coordinate
 
@@ -20,23 +21,46 @@ import ground.monitoring as monitoring
 import ground.ground_logger as ground_logger
 
 import lib.mapping as mapping
+import lib.pool as pool
+import lib.terrain as terrain
 from lib.util import *
 
 if __name__ == "__main__":
-    server.world_map = mapping.WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10)
+    server.world_map = mapping.WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10, storage="grid")
     
-    server.world_map.fill_map((-10, -40, -2), (10, 30, 2), Traversability.FREE)
-    server.world_map.fill_map((-10, 0, -2), (10, 10, 2), Traversability.BLOCKED)
-    server.world_map.fill_map((0, 0, -2), (2, 10, 2), Traversability.FREE)
-    server.world_map.fill_map((-10, 0, -2), (10, 10, 0), Traversability.BLOCKED)
+    with server.world_map.batch():
+        if "TERRAINFILE" in os.environ:
+            # heightmap (.asc/.npy/.npz) for the whole site, see lib.terrain
+            terrain.fill_terrain(server.world_map, terrain.load_heightmap(os.environ["TERRAINFILE"]))
+        else:
+            server.world_map.fill_map((-10, -40, -2), (10, 30, 2), Traversability.FREE)
+            server.world_map.fill_map((-10, 0, -2), (10, 10, 2), Traversability.BLOCKED)
+            server.world_map.fill_map((0, 0, -2), (2, 10, 2), Traversability.FREE)
+            server.world_map.fill_map((-10, 0, -2), (10, 10, 0), Traversability.BLOCKED)
+        if "OBSTACLEFILE" in os.environ:
+            terrain.fill_obstacles(server.world_map, terrain.load_obstacles(os.environ["OBSTACLEFILE"]))
 
     server.logger = ground_logger.Logger(server.world_map)
-    server.drones = monitoring.DroneListing(server.world_map, server.logger)
+    # how long drone positions get collected for before they're applied together, and how often drones send them
+    batch_interval = float(os.environ.get("POSITION_BATCH_INTERVAL", monitoring.BATCH_INTERVAL))
+    telemetry_rate = int(os.environ.get("TELEMETRY_RATE", monitoring.TELEMETRY_RATE))
+    server.drones = monitoring.DroneListing(server.world_map, server.logger, batch_interval, telemetry_rate)
     
+    if "PATHFIND_WORKERS" in os.environ:
+        # number of pathfinding processes, 0 to search in the server process
+        workers = int(os.environ["PATHFIND_WORKERS"])
+        if workers > 0:
+            server.pool = pool.PathfindingPool(workers)
+
     stop = threading.Event()
-    monitoring_daemon = server.drones.get_daemon_func(stop, 1)
+    monitoring_daemon = server.drones.get_daemon_func(stop)
     monitoring_thread = threading.Thread(target=monitoring_daemon)
     monitoring_thread.start()
+    # connects to drones in the background and reconnects the ones whose link dropped
+    connection_thread = threading.Thread(target=server.drones.get_connection_func(stop))
+    connection_thread.start()
 
-    run(host='0.0.0.0', port=8080)
+    web.run_app(server.make_app(), host='0.0.0.0', port=8080)
     stop.set()
+    if server.pool != None:
+        server.pool.shutdown()
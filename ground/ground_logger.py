@@ -8,7 +8,7 @@ from pykml.factory import GX_ElementMaker as GX
 from quad_mesh_simplify import simplify_mesh
 import numpy as np
 
-from aerpawlib.util import Coordinate, VectorNED
+from aerpawlib.util import Coordinate
 
 from lib.util import *
 from lib.mapping import WorldMap
@@ -57,7 +57,7 @@ class Logger:
     def _serialize_kml_blocks(self):
         # calculate polys for each block
         # iterate over the entire airspace, find adjacencies, add faces
-        m = self._world_map._map.copy() # to avoid race conditions ugh
+        m = self._world_map.snapshot().blocks # never changes under us, no need to copy
         kml_polys = []
         
         def _get_bounds(idx):
@@ -165,30 +165,17 @@ class Logger:
         #         triangles.append([new_positions[i] for i in face])
         # print(triangles)
 
-        # convert triangles to world space
-        def _coord_to_world_raw(coord):
-            x, y, z = [i*self._world_map._resolution for i in coord]
-            delta_vec = VectorNED(y, x, -z)
-            return self._world_map._center_coords + delta_vec
-
-        # world_triangles = []
-        # for triangle in triangles:
-        #     c1, c2, c3 = [_coord_to_world_raw(c) for c in triangle]
-        #     world_triangles.append((c1, c2, c3))
-        
-        world_triangles = []
-        for triangle in faces:
-            c1, c2, c3 = [_coord_to_world_raw(positions[c]) for c in triangle]
-            world_triangles.append((c1, c2, c3))
+        # convert triangles to world space, all corners in one go. rows are lat, lon, alt
+        world_positions = self._world_map.blocks_to_coords(positions).tolist()
 
         # convert coordinates defining poly tris to lines to be rendered in KML
         adding = []
-        for tri in world_triangles:
-            cs = [*tri] + [tri[0]]
+        for triangle in faces:
+            cs = [world_positions[c] for c in triangle] + [world_positions[triangle[0]]]
             adding.append(KML.Placemark(
                     KML.LineString(
                         GX.altitudeMode("relativeToGround"),
-                        KML.coordinates("\n".join([f"{i.lon},{i.lat},{i.alt}" for i in cs]))
+                        KML.coordinates("\n".join([f"{lon},{lat},{alt}" for lat, lon, alt in cs]))
                         )
                     ))
         return adding
@@ -196,8 +183,8 @@ class Logger:
     def _serialize_kml_drones(self):
         # get kml w/ each drone's path, caring only about the blocks and time
         r = []
-        for drone in self._drone_log:
-            path = self._drone_log[drone]
+        # the monitoring thread adds drones to the log while this runs
+        for drone, path in list(self._drone_log.items()):
             unique_tiles = []
             for i in path:
                 if len(unique_tiles) != 0:
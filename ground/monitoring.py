@@ -1,5 +1,7 @@
+import random
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import dronekit
 
@@ -7,32 +9,139 @@ from aerpawlib.util import Coordinate
 
 from lib.mapping import WorldMap
 from lib.util import *
+from lib import metrics
 
 from ground.ground_logger import Logger
 
+# positions get applied to the map in batches: the ingest thread waits this long after the first new position
+# arrives for others to come in, and only the latest position of each drone in that time gets applied
+BATCH_INTERVAL = 0.05 # seconds
+# how often drones are asked to send their position (and everything else dronekit streams), see dronekit.connect
+TELEMETRY_RATE = 4 # hz
+
+# connecting happens in the background (see DroneListing.get_connection_func): a drone is CONNECTING, CONNECTED
+# (NO_HEARTBEAT if it's connected but hasn't sent a heartbeat in a bit), or WAITING to try again after it couldn't be
+# connected to or its link dropped
+CONNECTING = "connecting"
+CONNECTED = "connected"
+NO_HEARTBEAT = "no_heartbeat"
+WAITING = "waiting"
+STATES = [CONNECTING, CONNECTED, NO_HEARTBEAT, WAITING]
+
+CONNECT_WORKERS = 16 # connects that can be in progress at once, each one blocks a thread until the link is up
+CONNECTION_CHECK = 1 # seconds between looking for dropped links and connects that are due
+# a link counts as dropped (and gets reconnected) after this long without a heartbeat, which is also how long
+# connecting waits for the first one
+HEARTBEAT_TIMEOUT = 15 # seconds
+# failed connects get retried after RECONNECT_MIN seconds, doubling every time up to RECONNECT_MAX (randomly up to
+# half less, so that drones that all dropped at once don't all come back at once)
+RECONNECT_MIN = 1 # seconds
+RECONNECT_MAX = 30 # seconds
+
+UPDATE_SECONDS = metrics.histogram("ground_monitoring_update_seconds", "time to apply one batch of positions")
+BATCH_SIZE = metrics.histogram("ground_monitoring_batch_size", "drones moved per batch of positions",
+                               buckets=metrics.COUNT_BUCKETS)
+INGEST_LAG = metrics.histogram("ground_monitoring_ingest_lag_seconds", "time from a position arriving from a drone "
+                               "to it being on the map")
+POSITIONS = metrics.counter("ground_monitoring_positions_total", "positions received from drones, by whether they "
+                            "got applied or replaced by a newer one first", ["result"])
+UPDATE_AGE = metrics.gauge("ground_monitoring_update_age_seconds", "seconds since a drone's position last made it "
+                           "onto the map", ["drone"])
+HEARTBEAT_AGE = metrics.gauge("ground_drone_heartbeat_age_seconds", "seconds since a drone's last heartbeat",
+                              ["drone"])
+CONNECTIONS = metrics.gauge("ground_drone_connections", "drones by connection state", ["state"])
+CONNECTS = metrics.counter("ground_drone_connects_total", "attempts to connect to a drone, by whether they worked",
+                           ["result"])
+LINK_DROPS = metrics.counter("ground_drone_link_drops_total", "times a drone's link dropped and had to be reconnected")
 
 class DroneConnection:
-    def __init__(self, id: str, conn_str: str, world_map: WorldMap):
+    """
+    the mavlink link to one drone. making one doesn't connect, connect() does (DroneListing does that on its own
+    threads), until then the drone has no heartbeat and no location
+    """
+
+    def __init__(self, id: str, conn_str: str, world_map: WorldMap, on_position=None,
+                 telemetry_rate: int=TELEMETRY_RATE):
+        """
+        on_position(id, lat, lon, alt) gets called (from dronekit's thread) with every position the drone sends
+        while it has a heartbeat
+        """
         self._id = id
         self._conn_str = conn_str
         self._world_map = world_map
-        
-        self._vehicle = dronekit.connect(self._conn_str, wait_ready=False)
+        self._on_position = on_position
+        self._telemetry_rate = telemetry_rate
 
+        self._vehicle = None
         self._has_heartbeat = False
 
+        # managed by DroneListing
+        self.state = CONNECTING # CONNECTING, CONNECTED or WAITING
+        self.attempts = 0 # connects that failed since the link was last up
+        self.retry_at = 0.0 # time.monotonic() to try connecting again at when WAITING
+        self.error = None # why the last connect failed or the link dropped
+
+    def connect(self):
+        """
+        connect to the drone, blocking until the link is up. raises whatever dronekit does if it can't
+        """
+        # not initializing in dronekit.connect, so that the vehicle can be closed if that fails (else its socket
+        # stays open)
+        vehicle = dronekit.connect(self._conn_str, wait_ready=False, _initialize=False)
+        try:
+            vehicle.initialize(rate=self._telemetry_rate, heartbeat_timeout=HEARTBEAT_TIMEOUT)
+        except Exception:
+            vehicle.close()
+            raise
+
         def _heartbeat_listener(_, __, val):
             if val > 1 and self._has_heartbeat:
                 self._has_heartbeat = False
             elif val < 1 and not self._has_heartbeat:
                 self._has_heartbeat = True
-        self._vehicle.add_attribute_listener("last_heartbeat", _heartbeat_listener)
+        vehicle.add_attribute_listener("last_heartbeat", _heartbeat_listener)
+
+        if self._on_position != None:
+            def _location_listener(_, __, loc):
+                if self._has_heartbeat and loc.lat != None and loc.lon != None and loc.alt != None:
+                    self._on_position(self._id, loc.lat, loc.lon, loc.alt)
+            vehicle.add_attribute_listener("location.global_relative_frame", _location_listener)
+        self._vehicle = vehicle
+
+    def link_dropped(self) -> bool:
+        # dronekit stops the vehicle's threads for good once it goes HEARTBEAT_TIMEOUT without a heartbeat
+        return self._vehicle != None and not self._vehicle._handler._alive
+
+    def close(self):
+        """
+        disconnect, if connected. can block for a bit while dronekit's threads stop
+        """
+        vehicle, self._vehicle = self._vehicle, None
+        self._has_heartbeat = False
+        if vehicle != None:
+            vehicle.close()
+
+    def status(self) -> dict:
+        vehicle = self._vehicle
+        state = self.state
+        if state == CONNECTED and not self._has_heartbeat:
+            state = NO_HEARTBEAT
+        return {
+                "state": state,
+                "attempts": self.attempts,
+                "error": self.error,
+                "retry_in": max(self.retry_at - time.monotonic(), 0) if state == WAITING else None,
+                "heartbeat_age": vehicle.last_heartbeat if vehicle != None else None,
+                }
 
     def vehicle_heartbeat_ok(self):
-        return self._has_heartbeat
+        return self._vehicle != None and self._has_heartbeat
 
     def location(self) -> Coordinate:
-        loc = self._vehicle.location.global_relative_frame
+        vehicle = self._vehicle
+        if vehicle == None:
+            return None
+        loc = vehicle.location.global_relative_frame
         if loc.lat == None or loc.lon == None or loc.alt == None:
             return None
         return Coordinate(loc.lat, loc.lon, loc.alt)
@@ -44,24 +153,161 @@ class DroneConnection:
 
 
 class DroneListing:
-    def __init__(self, world_map: WorldMap, logger: Logger):
+    """
+    the drones the ground station is connected to, and getting their positions onto the map
+
+    positions come in from every connection's thread through on_position and wait in _pending (only the latest one
+    per drone), the ingest thread (see get_daemon_func) applies them in batches as they arrive
+
+    connecting to drones never happens on the caller's thread: add_drone starts it on a thread of _connector, and
+    the connection manager (see get_connection_func) reconnects drones whose connect failed or whose link dropped
+    """
+
+    def __init__(self, world_map: WorldMap, logger: Logger, batch_interval: float=BATCH_INTERVAL,
+                 telemetry_rate: int=TELEMETRY_RATE):
         self._world_map = world_map
         self._drones = {}
         self._logger = logger
-    
+        self._batch_interval = batch_interval
+        self._telemetry_rate = telemetry_rate
+        self._pending = {} # maps id -> (lat, lon, alt, time.monotonic() it arrived)
+        self._arrived = threading.Condition()
+        self._updated = {} # maps id -> time.monotonic() its position last went onto the map
+        self._connector = ThreadPoolExecutor(CONNECT_WORKERS, thread_name_prefix="connect")
+        UPDATE_AGE.set_function(self._update_ages)
+        HEARTBEAT_AGE.set_function(self._heartbeat_ages)
+        CONNECTIONS.set_function(self._connection_counts)
+
     def add_drone(self, id: str, conn_str: str):
-        new_drone = DroneConnection(id, conn_str, self._world_map)
+        """
+        start connecting to a drone in the background (see status for how that's going). adding a drone again with
+        the same connection string does nothing, with another one replaces its connection
+        """
+        old = self._drones.get(id, None)
+        if old != None and old._conn_str == conn_str:
+            return
+        new_drone = DroneConnection(id, conn_str, self._world_map, self.on_position, self._telemetry_rate)
         self._drones[id] = new_drone
+        if old != None:
+            self._connector.submit(old.close)
+        self._connector.submit(self._connect, new_drone)
+
+    def status(self, id: str) -> dict:
+        """
+        how the connection to a drone is doing (see DroneConnection.status), None if it was never added
+        """
+        drone = self._drones.get(id, None)
+        if drone == None:
+            return None
+        return drone.status()
+
+    def _connect(self, drone: DroneConnection):
+        # on a _connector thread
+        drone.close()
+        try:
+            drone.connect()
+        except Exception as e:
+            CONNECTS.labels("failed").inc()
+            drone.attempts += 1
+            delay = min(RECONNECT_MIN * 2 ** (drone.attempts - 1), RECONNECT_MAX) * random.uniform(0.5, 1)
+            drone.error = str(e) or type(e).__name__
+            drone.retry_at = time.monotonic() + delay
+            drone.state = WAITING
+            print(f"couldn't connect to drone {drone._id} ({drone.error}), trying again in {delay:.1f}s")
+            return
+        CONNECTS.labels("connected").inc()
+        if self._drones.get(drone._id, None) is not drone:
+            # it got added again with another connection while this one was connecting
+            drone.close()
+            return
+        drone.attempts = 0
+        drone.error = None
+        drone.state = CONNECTED
+        print(f"connected to drone {drone._id}")
+
+    def check_connections(self):
+        """
+        start reconnecting drones whose link dropped, and connecting ones that are done waiting to try again
+        """
+        now = time.monotonic()
+        for drone in list(self._drones.values()):
+            if drone.state == CONNECTED and drone.link_dropped():
+                LINK_DROPS.inc()
+                drone.error = f"no heartbeat in {HEARTBEAT_TIMEOUT}s"
+                drone.retry_at = now
+                drone.state = WAITING
+                print(f"lost the link to drone {drone._id}, reconnecting")
+            if drone.state == WAITING and now >= drone.retry_at:
+                drone.state = CONNECTING
+                self._connector.submit(self._connect, drone)
+
+    def get_connection_func(self, stop_event: threading.Event):
+        def _inner():
+            while not stop_event.wait(CONNECTION_CHECK):
+                self.check_connections()
+            # connects in progress can't be stopped, they time out on their own
+            self._connector.shutdown(wait=False)
+        return _inner
+
+    def on_position(self, id: str, lat: float, lon: float, alt: float):
+        """
+        queue a drone's position for the next batch, replacing the one it's already got waiting (if any)
+        """
+        with self._arrived:
+            if id in self._pending:
+                POSITIONS.labels("replaced").inc()
+            self._pending[id] = (lat, lon, alt, time.monotonic())
+            self._arrived.notify()
+
+    def _update_ages(self):
+        now = time.monotonic()
+        return {(id,): now - updated for id, updated in list(self._updated.items())}
+
+    def _heartbeat_ages(self):
+        ages = {(id,): drone.status()["heartbeat_age"] for id, drone in list(self._drones.items())}
+        return {labels: age for labels, age in ages.items() if age != None}
+
+    def _connection_counts(self):
+        counts = {(state,): 0 for state in STATES}
+        for drone in list(self._drones.values()):
+            counts[(drone.status()["state"],)] += 1
+        return counts
 
     def update_map(self):
-        for drone in self._drones.values():
-            if drone.vehicle_heartbeat_ok() and drone.location() != None and drone.block() != None:
-                self._world_map.update_drone(drone._id, drone.location())
-                self._logger.update_drone(drone._id, drone.block())
-    
-    def get_daemon_func(self, stop_event: threading.Event, update_delay: int=1):
+        """
+        apply every position that's waiting right now
+        """
+        with self._arrived:
+            pending, self._pending = self._pending, {}
+        if len(pending) == 0:
+            return
+        with UPDATE_SECONDS.time():
+            self._apply(pending)
+
+    def _apply(self, pending: dict):
+        ids = list(pending)
+        positions = [pending[id][:3] for id in ids]
+        blocks = self._world_map.coords_to_blocks(positions).tolist()
+        # one batch so that readers see every drone move at once
+        with self._world_map.batch():
+            for id, (lat, lon, alt), block in zip(ids, positions, blocks):
+                self._world_map.update_drone(id, Coordinate(lat, lon, alt))
+                self._logger.update_drone(id, tuple(block))
+        now = time.monotonic()
+        for id in ids:
+            self._updated[id] = now
+            INGEST_LAG.observe(now - pending[id][3])
+        POSITIONS.labels("applied").inc(len(ids))
+        BATCH_SIZE.observe(len(ids))
+
+    def get_daemon_func(self, stop_event: threading.Event):
         def _inner():
             while not stop_event.is_set():
+                with self._arrived:
+                    # wake up now and then to check stop_event
+                    if len(self._pending) == 0 and not self._arrived.wait(0.5):
+                        continue
+                # let the positions sent at about the same time catch up, then apply them together
+                stop_event.wait(self._batch_interval)
                 self.update_map()
-                time.sleep(update_delay)
         return _inner
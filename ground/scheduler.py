@@ -0,0 +1,201 @@
+"""
+scheduling of /pathfind requests, so that a replan storm (every drone asking for a path at once after an
+obstruction) can't make anyone wait forever
+
+every drone has at most one search queued or running. a new request from the same drone either joins it (same
+start, goal and options, ex: a retry after a dropped connection) or supersedes it (the drone moved on or changed its
+mind): a superseded search that hasn't started is cancelled, one that's running gets its result dropped. searches
+start in priority order (AIRBORNE drones, which are hovering until they get their path, before ones still on the
+ground), earliest deadline first within a priority. a request that isn't answered by its deadline gets
+DeadlineExceeded, and its search is cancelled too if it hasn't started and nobody else is waiting on it
+
+searches that are already running can't be stopped, but their paths still end up in WorldMap.path_cache, so asking
+again after a DeadlineExceeded is usually answered right away
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import metrics
+
+AIRBORNE = 0
+GROUND = 1
+
+QUEUE_WAIT = metrics.histogram("ground_pathfind_queue_seconds", "time pathfind requests spent waiting to start")
+OUTCOMES = metrics.counter("ground_pathfind_requests_total", "pathfind requests by what happened to them (done, "
+                           "coalesced, superseded, deadline, disconnected)", ["result"])
+QUEUED = metrics.gauge("ground_pathfind_queued", "pathfind searches waiting to start")
+
+class Superseded(Exception):
+    """
+    a newer request from the same drone replaced this one
+    """
+
+class DeadlineExceeded(Exception):
+    """
+    the request's search didn't finish by its deadline
+    """
+
+class _Search:
+    def __init__(self, drone_id: str, key, func, priority: int, deadline: float):
+        self.drone_id = drone_id
+        self.key = key
+        self.func = func
+        self.priority = priority
+        self.deadline = deadline
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 0
+        self.started = False
+        self.queued_at = time.monotonic()
+        self.entry = None # its current entry in the queue, the older ones are left behind and skipped
+
+    def cancel(self, exception: Exception):
+        # a queued search gets skipped, a running one's result gets dropped
+        if not self.future.done():
+            self.future.set_exception(exception)
+            # nobody has to be waiting on it
+            self.future.exception()
+
+class PathfindScheduler:
+    """
+    runs pathfinding searches for drones, up to workers at a time (on its own threads, so that searches never
+    hold up the thread pool the rest of the server uses)
+
+    everything but the searches themselves runs on the event loop, so it has to be made and used from it
+    """
+
+    def __init__(self, workers: int=1, offload: bool=True):
+        """
+        offload=False runs searches on the event loop, see ground.server.make_app
+        """
+        self._workers = workers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="pathfind") if offload else None
+        self._queue = [] # heap of (priority, deadline, n, _Search), see _push
+        self._counter = itertools.count()
+        self._searches = {} # maps drone id -> its queued/running _Search
+        self._priorities = {} # maps drone id -> priority, GROUND if it isn't in here
+        self._queued = asyncio.Event()
+        self._running = set()
+        QUEUED.set_function(lambda: sum(1 for entry in self._queue if self._waiting(entry)))
+
+    def set_priority(self, drone_id: str, priority: int):
+        """
+        set the priority of a drone's requests from now on (AIRBORNE or GROUND), including one it has queued
+        """
+        if priority == GROUND:
+            self._priorities.pop(drone_id, None)
+        else:
+            self._priorities[drone_id] = priority
+        search = self._searches.get(drone_id, None)
+        if search != None and not search.started and search.priority != priority:
+            search.priority = priority
+            self._push(search)
+
+    async def find_path(self, drone_id: str, key, func, timeout: float):
+        """
+        get func() (a search for drone_id) within timeout seconds
+
+        key identifies what's being searched for, so that requests with the same key share one search: only the
+        first one's func runs and every request gets what it returns, so anything else a caller wants to know about
+        the search (stats) has to be returned along with the path. raises
+        Superseded if a request from the same drone with a different key comes in first, DeadlineExceeded if the
+        search isn't done in time
+        """
+        deadline = time.monotonic() + timeout
+        search = self._searches.get(drone_id, None)
+        if search != None and not search.future.done() and search.key == key:
+            OUTCOMES.labels("coalesced").inc()
+            priority = self._priorities.get(drone_id, GROUND)
+            if deadline > search.deadline or priority != search.priority:
+                search.deadline = max(search.deadline, deadline)
+                search.priority = priority
+                if not search.started:
+                    self._push(search)
+        else:
+            if search != None:
+                search.cancel(Superseded())
+                OUTCOMES.labels("superseded").inc()
+            search = _Search(drone_id, key, func, self._priorities.get(drone_id, GROUND), deadline)
+            self._searches[drone_id] = search
+            search.future.add_done_callback(lambda _: self._forget(search))
+            self._push(search)
+
+        search.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(search.future), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            OUTCOMES.labels("deadline").inc()
+            raise DeadlineExceeded()
+        except asyncio.CancelledError:
+            # the client went away
+            OUTCOMES.labels("disconnected").inc()
+            raise
+        finally:
+            # a running search is left to finish, so that asking again can pick it back up
+            search.waiters -= 1
+            if search.waiters == 0 and not search.started:
+                search.cancel(DeadlineExceeded())
+
+    def _forget(self, search: _Search):
+        if self._searches.get(search.drone_id, None) is search:
+            del self._searches[search.drone_id]
+
+    def _push(self, search: _Search):
+        # (re)queue a search where its priority and deadline put it now
+        search.entry = (search.priority, search.deadline, next(self._counter), search)
+        heapq.heappush(self._queue, search.entry)
+        self._queued.set()
+
+    def _waiting(self, entry) -> bool:
+        search = entry[-1]
+        return search.entry is entry and not search.started and not search.future.done()
+
+    def _next(self):
+        # the most urgent search that still has someone waiting on it, None if there aren't any
+        while len(self._queue) > 0:
+            entry = heapq.heappop(self._queue)
+            if self._waiting(entry):
+                return entry[-1]
+        return None
+
+    async def _run(self, search: _Search):
+        search.started = True
+        QUEUE_WAIT.observe(time.monotonic() - search.queued_at)
+        try:
+            if self._executor == None:
+                result = search.func()
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, search.func)
+        except Exception as e:
+            if not search.future.done():
+                search.future.set_exception(e)
+            return
+        if not search.future.done():
+            OUTCOMES.labels("done").inc()
+            search.future.set_result(result)
+
+    async def run(self):
+        """
+        start searches as workers free up, until cancelled
+        """
+        slots = asyncio.Semaphore(self._workers)
+        try:
+            while True:
+                await slots.acquire()
+                search = self._next()
+                while search == None:
+                    self._queued.clear()
+                    await self._queued.wait()
+                    search = self._next()
+                task = asyncio.create_task(self._run(search))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            for search in list(self._searches.values()):
+                search.cancel(DeadlineExceeded())
+            if self._executor != None:
+                self._executor.shutdown(wait=False)
@@ -1,150 +1,645 @@
-from bottle import route, run, request, abort
+"""
+http api of the ground station, served with aiohttp
+
+every request is handled on one event loop. handlers that only look things up run right on it, they take
+microseconds and never wait on anything. anything that changes the map (reservations too, since they have to wait
+for whoever else is changing it, ex: a big map update) or can take a while (kml, the full map) runs on a thread pool
+instead, so that one slow request never holds up another drone's reservation. pathfinding goes through
+ground.scheduler, which runs searches on threads of its own in priority order with deadlines, and connecting to
+drones happens in the background in ground.monitoring
+"""
+
+import asyncio
+import base64
+import contextlib
+import functools
+import json
+import time
+
+from aiohttp import web
 
 from aerpawlib.util import Coordinate
 
-from lib.mapping import WorldMap
+from lib.costs import MIN_SPEED, MAX_SPEED
+from lib.encoding import MAP_CONTENT_TYPE, encode_map
+from lib import metrics
+from lib.mapping import MapSnapshot, WorldMap, LEASE_TTL, PATH_MODES
+from lib.pool import PathfindingPool, POOL_PATH_MODES
 from lib.util import *
 
 from ground.monitoring import DroneConnection, DroneListing
+from ground.scheduler import AIRBORNE, GROUND, DeadlineExceeded, PathfindScheduler, Superseded
 from ground.ground_logger import Logger
 
 world_map: WorldMap = None
 drones: DroneListing = None
 logger: Logger = None
+pool: PathfindingPool = None # if set, pathfinding runs in worker processes
+
+LEASE_CHECK_INTERVAL = 0.5 # seconds between looking for expired leases
+MAX_LEASE_TTL = 60 # seconds
+
+PATHFIND_DEADLINE = 30 # seconds a /pathfind can take unless it asks for something else with ?deadline=
+MAX_PATHFIND_DEADLINE = 120 # seconds
+
+STREAM_INTERVAL = 0.1 # seconds of map changes that get sent to viewers as one delta
+STREAM_PING = 5 # seconds between keepalives on a quiet /viewer/stream
+STREAM_BACKLOG = 256 # deltas a viewer can fall behind by before it gets disconnected (it can reconnect)
+STREAM_MAX_BOXES = 64 # changed boxes a delta can have before they get sent as one box around all of them
+
+routes = web.RouteTableDef()
+
+# what make_app keeps in the app, see there
+OFFLOAD_KEY = web.AppKey("offload", bool)
+SCHEDULER_KEY = web.AppKey("scheduler", PathfindScheduler)
+MAP_STREAM_KEY = web.AppKey("map_stream", "_MapStream")
+
+REQUEST_SECONDS = metrics.histogram("ground_http_request_seconds", "time to answer a request (for /viewer/stream, "
+                                    "how long the viewer stayed connected)", ["method", "route"])
+REQUESTS = metrics.counter("ground_http_requests_total", "requests answered, by status", ["method", "route", "status"])
+KML_SECONDS = metrics.histogram("ground_kml_render_seconds", "time to render /log/kml (not counting waiting for a "
+                                "thread to do it on)")
+PATH_CACHE = metrics.gauge("ground_path_cache", "path cache size and counters, see /stats/path_cache", ["stat"])
 
-@route('/drone/<id>/pathfind', method='POST')
-def pathfind(id):
-    if request.json == None:
-        abort(400, "plz gib json")
+async def _json(request: web.Request):
+    """
+    the request's json body, None if there isn't one (like bottle's request.json)
+    """
+    if request.content_type != "application/json" or not request.can_read_body:
+        return None
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="that's not json")
+
+async def _offload(request: web.Request, func, *args, **kwargs):
+    """
+    run a slow handler's work on the thread pool
+    """
+    if not request.app[OFFLOAD_KEY]:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+def _search(find_path, *args, **kwargs):
+    # the stats come back with the path (instead of going into a dict the request made), so that requests that
+    # joined someone else's search see the stats of the one that actually ran
+    stats = {}
+    return find_path(*args, stats=stats, **kwargs), stats
+
+@routes.post('/drone/{id}/pathfind')
+async def pathfind(request: web.Request):
+    id = request.match_info["id"]
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
     block_from = world_map.drone_block(id)
     if block_from == None:
-        abort(404, "drone not found")
-    target_coords = deserialize_coordinate(request.json)
+        raise web.HTTPNotFound(text="drone not found")
+    target_coords = deserialize_coordinate(j)
     block_to = world_map.coord_to_block(target_coords)
+    # ?smooth=1 shortens the path to straight segments (see WorldMap.find_path). "path" is then every block flying
+    # those segments goes through, and "waypoints"/"segments" are added
+    smooth = request.query.get("smooth", "0") not in ["", "0", "false"]
+    try:
+        timeout = float(request.query.get("deadline", PATHFIND_DEADLINE))
+    except ValueError:
+        raise web.HTTPBadRequest(text="deadline has to be a number of seconds")
+    if not 0 < timeout <= MAX_PATHFIND_DEADLINE:
+        raise web.HTTPBadRequest(text=f"deadline has to be between 0 and {MAX_PATHFIND_DEADLINE}s")
+    # ?budget=seconds and/or ?expansions=blocks ask for the best path that can be found within that instead of the
+    # optimal one ("anytime" mode). "bound" in the response is how many times longer than optimal it can be, and
+    # the search keeps improving the path for a while for the next time it's asked for
+    try:
+        budget = float(request.query["budget"]) if "budget" in request.query else None
+        max_expansions = int(request.query["expansions"]) if "expansions" in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text="budget has to be a number of seconds, expansions a number of blocks")
+    if budget != None and not 0 < budget <= timeout:
+        raise web.HTTPBadRequest(text="budget has to be more than 0 and no more than the deadline")
+    if max_expansions != None and max_expansions <= 0:
+        raise web.HTTPBadRequest(text="expansions has to be more than 0")
+    # ?mode= picks another search (see WorldMap.find_path). plain a* is the default since it's the fastest on the
+    # maps we fly, "incremental" only wins when the same drone replans a lot without the map changing much (see
+    # bench/replanning.py)
+    mode = request.query.get("mode", "anytime" if budget != None or max_expansions != None else "astar")
+    if mode not in PATH_MODES:
+        raise web.HTTPBadRequest(text=f"mode has to be one of {', '.join(PATH_MODES)}")
+    if (mode == "anytime") != (budget != None or max_expansions != None):
+        raise web.HTTPBadRequest(text="budget/expansions go with (and only with) the anytime mode")
     print(f"plotting path from {block_from} to {block_to} for drone {id}")
-    path = world_map.find_path(block_from, block_to, {id})
-    if path == None:
-        abort(400, "no path sadge :(")
-    return {"path": [serialize_block(i) for i in path]}
+    if mode == "anytime":
+        # anytime searches keep state in the map, so they don't go to the pool
+        search = functools.partial(_search, world_map.find_path, block_from, block_to, {id}, mode=mode,
+                                   smooth=smooth, budget=budget, max_expansions=max_expansions, background=True)
+    elif pool != None and mode in POOL_PATH_MODES:
+        search = functools.partial(_search, pool.find_path, world_map, block_from, block_to, {id}, mode=mode,
+                                   smooth=smooth)
+    else:
+        search = functools.partial(_search, world_map.find_path, block_from, block_to, {id}, mode=mode,
+                                   smooth=smooth)
+    # see ground.scheduler: asking again while a search is queued/running joins it, asking for something else
+    # replaces it
+    try:
+        result, stats = await request.app[SCHEDULER_KEY].find_path(id, (block_from, block_to, mode, smooth), search,
+                                                                 timeout)
+    except Superseded:
+        raise web.HTTPConflict(text="a newer pathfind request from this drone replaced this one")
+    except DeadlineExceeded:
+        raise web.HTTPServiceUnavailable(text="no path in time, try again", headers={"Retry-After": "1"})
+    if result == None and not stats.get("done", True):
+        raise web.HTTPServiceUnavailable(text="no path within the budget yet, ask again to keep searching",
+                                         headers={"Retry-After": "1"})
+    if result == None:
+        raise web.HTTPBadRequest(text="no path sadge :(")
+    bound = stats.get("bound", 1.0)
+    if not smooth:
+        return web.json_response({"path": [serialize_block(i) for i in result], "bound": bound})
+    waypoints, segments = result
+    path = [waypoints[0]] + [block for segment in segments for block in segment[1:]]
+    return web.json_response({
+        "path": [serialize_block(i) for i in path],
+        "waypoints": [serialize_block(i) for i in waypoints],
+        "segments": [[serialize_block(i) for i in segment] for segment in segments],
+        "bound": bound,
+        })
 
-@route('/drone/<id>/takeoff', method='POST')
-def request_takeoff(id):
+@routes.post('/plan/batch')
+async def plan_batch(request: web.Request):
+    # plan paths for several drones at once that keep them out of each other's way
+    # expects [{"id": ..., "target": coordinate}], earlier drones get priority
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    if not isinstance(j, list) or not all(isinstance(i, dict) and isinstance(i.get("id", None), str) and
+                                          _is_coordinate(i.get("target", None)) for i in j):
+        raise web.HTTPBadRequest(text="expected a list of drones, each with an id and a target coordinate")
+    goals = {}
+    for i in j:
+        goals[i["id"]] = world_map.coord_to_block(deserialize_coordinate(i["target"]))
+    print(f"planning paths for drones {list(goals)}")
+    paths = await _offload(request, world_map.plan_batch, goals)
+    return web.json_response({
+        "paths": {
+            id: None if path == None else [dict(serialize_block(block), t=t) for block, t in path]
+            for id, path in paths.items()
+            }
+        })
+
+def _takeoff(id: str):
+    # in one batch, so that nobody can take the block in between
+    with world_map.batch():
+        target_block = world_map.lowest_reservable_block(id)
+        return target_block, target_block != None and world_map.reserve_block(id, target_block, skip_adj=True)
+
+@routes.post('/drone/{id}/takeoff')
+async def request_takeoff(request: web.Request):
     # send alt to take off to and enter airspace, if safe
     # also request block as part of this
-    drone_block = world_map.drone_block(id)
-    heightslice = world_map.heightslice(drone_block)
-    # attempt to take off into lowest
-    target_block = heightslice[0]
-    success = world_map.reserve_block(id, target_block, skip_adj=True)
-    target_alt = world_map.block_to_coord(target_block).alt + world_map._resolution/2
-    return {
+    # attempt to take off into the lowest block that can be reserved
+    id = request.match_info["id"]
+    target_block, success = await _offload(request, _takeoff, id)
+    if success:
+        # its pathfinds go ahead of drones still on the ground from now on
+        request.app[SCHEDULER_KEY].set_priority(id, AIRBORNE)
+    target_alt = None if not success else world_map.block_to_coord(target_block).alt + world_map._resolution/2
+    return web.json_response({
         "clear": success,
-        "alt": None if not success else target_alt
-        }
+        "alt": target_alt
+        })
 
-@route('/viewer/coordinates', method='GET')
-def define_coord_system():
-    # get parameters defining coordinate system [center and resolution]
-    return {
-        "center": serialize_coordinate(world_map._center_coords),
-        "resolution": world_map._resolution
-        }
+@routes.post('/drone/{id}/land')
+async def land(request: web.Request):
+    # the drone is landing (it doesn't need permission): give back whatever it has reserved, and its pathfinds stop
+    # going ahead of other drones on the ground
+    id = request.match_info["id"]
+    request.app[SCHEDULER_KEY].set_priority(id, GROUND)
+    await _offload(request, world_map.release_reservations, id)
+    return web.Response()
 
-@route('/drone/<id>/coordinates', method='GET')
-def define_coord_system(id):
+@routes.get('/viewer/coordinates')
+@routes.get('/drone/{id}/coordinates')
+async def define_coord_system(request: web.Request):
     # get parameters defining coordinate system [center and resolution]
-    return {
+    return web.json_response({
         "center": serialize_coordinate(world_map._center_coords),
         "resolution": world_map._resolution
-        }
-
-@route('/drone/<id>/reserve', method='POST')
-def reserve_block(id):
-    if request.json == None:
-        abort(400, "plz gib json")
-    block_reserving = deserialize_block(request.json)
-    success = world_map.reserve_block(id, block_reserving)
-    return {"success": success}
-
-@route('/drone/<id>/unreserve', method='POST')
-def unreserve_block(id):
-    # given a block, attempt to reserve
-    if request.json != None:
-        block_removing = deserialize_block(request.json)
-    else:
-        block_removing = None
-        for b in world_map._occupied_blocks:
-            if world_map._occupied_blocks[b] == id:
-                block_removing = b
-                break
-    if block_removing == None:
-        abort(400, "no block to remove")
-    success = world_map.unreserve_block(id, block_removing)
-    return {"success": success}
+        })
+
+@routes.post('/drone/{id}/reserve')
+async def reserve_block(request: web.Request):
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    block_reserving = deserialize_block(j)
+    success = await _offload(request, world_map.reserve_block, request.match_info["id"], block_reserving)
+    return web.json_response({"success": success})
+
+@routes.post('/drone/{id}/lease')
+async def lease_blocks(request: web.Request):
+    # reserve the next blocks of a path at once: {"blocks": [block, ...], "ttl": seconds (optional)}
+    # replaces the drone's other reservations, see WorldMap.lease_blocks for which of the blocks it gets
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    if not isinstance(j, dict):
+        raise web.HTTPBadRequest(text="a lease has to be an object")
+    ttl = j.get("ttl", LEASE_TTL)
+    if not _is_number(ttl) or not 0 < ttl <= MAX_LEASE_TTL:
+        raise web.HTTPBadRequest(text=f"ttl has to be between 0 and {MAX_LEASE_TTL}s")
+    if not isinstance(j.get("blocks", None), list) or not all(_is_block(i) for i in j["blocks"]):
+        raise web.HTTPBadRequest(text="blocks has to be a list of blocks with whole number x, y and z")
+    blocks = [deserialize_block(i) for i in j["blocks"]]
+    leased = await _offload(request, world_map.lease_blocks, request.match_info["id"], blocks, ttl=ttl)
+    return web.json_response({
+        "blocks": [serialize_block(i) for i in leased],
+        "ttl": ttl,
+        })
+
+@routes.post('/drone/{id}/unreserve')
+async def unreserve_block(request: web.Request):
+    # given a block, unreserve it. without one, unreserve everything the drone has reserved
+    id = request.match_info["id"]
+    j = await _json(request)
+    if j == None:
+        if world_map.reserved_block(id) == None:
+            raise web.HTTPBadRequest(text="no block to remove")
+        return web.json_response({"success": await _offload(request, world_map.release_reservations, id)})
+    success = await _offload(request, world_map.unreserve_block, id, deserialize_block(j))
+    return web.json_response({"success": success})
 
-@route('drone/<id>/get_reserved')
-def get_reserved(id):
+@routes.get('/drone/{id}/get_reserved')
+async def get_reserved(request: web.Request):
     # get a drone's reserved block
-    b = None
-    for block in world_map._occupied_blocks:
-        if world_map._occupied_blocks[block] == id:
-            b = block
-            break
-    return serialize_block(b)
-
-@route('/drone/<id>/can_reserve', method='POST')
-def can_reserve(id):
+    b = world_map.reserved_block(request.match_info["id"])
+    return web.json_response(None if b == None else serialize_block(b))
+
+@routes.post('/drone/{id}/can_reserve')
+async def can_reserve(request: web.Request):
     # given a list of blocks, return ones that can be reserved/moved into
-    if request.json == None:
-        abort(400, "plz gib json")
-    blocks = [deserialize_block(i) for i in request.json]
-    possible = [world_map.can_reserve_block(id, block) for block in blocks]
-    return possible
-
-@route('/drone/add', method='POST')
-def add_drone():
-    if request.json == None:
-        abort(400, "plz gib json")
-    id = request.json["id"]
-    conn_str = request.json["connection"]
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    blocks = [deserialize_block(i) for i in j]
+    possible = [world_map.can_reserve_block(request.match_info["id"], block) for block in blocks]
+    return web.json_response(possible)
+
+@routes.post('/drone/add')
+async def add_drone(request: web.Request):
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    id = j["id"]
+    conn_str = j["connection"]
+    # this only starts connecting, see /drone/{id}/connection for when it's done
     drones.add_drone(id, conn_str)
+    # a drone (re)registering is on the ground, whatever it was doing before
+    request.app[SCHEDULER_KEY].set_priority(id, GROUND)
+    return web.Response()
+
+@routes.get('/drone/{id}/connection')
+async def get_connection(request: web.Request):
+    # "state" is one of connecting, connected, no_heartbeat or waiting (to try connecting again in "retry_in"
+    # seconds, after "attempts" failed ones, "error" says why)
+    status = drones.status(request.match_info["id"])
+    if status == None:
+        raise web.HTTPNotFound(text="drone not found")
+    return web.json_response(status)
+
+def _render_kml():
+    with KML_SECONDS.time():
+        return logger.serialize_kml()
+
+@routes.get('/log/kml')
+async def get_drone_paths(request: web.Request):
+    kml = await _offload(request, _render_kml)
+    return web.Response(body=kml, content_type="application/vnd.google-earth.kml+xml")
 
-@route('/log/kml', method='GET')
-def get_drone_paths():
-    kml = logger.serialize_kml()
-    return kml
+@routes.get('/stats/path_cache')
+async def get_path_cache_stats(request: web.Request):
+    return web.json_response(world_map.path_cache.stats())
 
-@route('/viewer/map', method='GET')
-def get_map():
+@routes.get('/metrics')
+async def get_metrics(request: web.Request):
+    # everything in lib.metrics, in the text format prometheus scrapes
+    return web.Response(text=metrics.REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+@web.middleware
+async def _measure(request: web.Request, handler):
+    # latency and status of every request, by the route it matched (so /drone/{id}/... counts as one route)
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource != None else "unmatched"
+    t_start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - t_start)
+        REQUESTS.labels(request.method, route, str(status)).inc()
+
+def _serialize_map(snapshot: MapSnapshot=None):
     map_blocks = []
-    map_occupied = []
+    # a snapshot never changes, so the monitoring thread can keep updating the map while this goes through it
+    if snapshot == None:
+        snapshot = world_map.snapshot()
 
-    for block in world_map._map:
+    for block, traversability in snapshot.blocks.items():
         map_blocks.append({
             "block": serialize_block(block),
-            "val": world_map._map[block].value,
+            "val": traversability.value,
             })
     
-    for drone_name in world_map._drone_locations:
-        drone = world_map._drone_locations[drone_name]
+    return {
+            "blocks": map_blocks,
+            "occupied": _serialize_occupied(snapshot),
+            }
+
+def _serialize_occupied(snapshot: MapSnapshot):
+    map_occupied = []
+    for drone_name in snapshot.drone_locations:
+        drone = snapshot.drone_locations[drone_name]
         map_occupied.append({
             "block": serialize_block(world_map.coord_to_block(drone)),
             "val": drone_name,
             })
+    return map_occupied
+
+def _encode_map():
+    snapshot = world_map.snapshot()
+    grid, origin = snapshot.blocks.dense()
+    return encode_map(grid, origin, {"occupied": _serialize_occupied(snapshot)})
 
+@routes.get('/viewer/map')
+async def get_map(request: web.Request):
+    # clients that accept lib.encoding's MAP_CONTENT_TYPE get the blocks as a compressed grid instead of json
+    if MAP_CONTENT_TYPE in request.headers.get("Accept", ""):
+        return web.Response(body=await _offload(request, _encode_map), content_type=MAP_CONTENT_TYPE)
+    return web.json_response(await _offload(request, _serialize_map))
+
+def _serialize_stream_snapshot(snapshot: MapSnapshot):
+    # the blocks go as lib.encoding's compressed grid (base64, since it's in json), a json object per block is
+    # megabytes for big maps
+    grid, origin = snapshot.blocks.dense()
     return {
-            "blocks": map_blocks,
-            "occupied": map_occupied,
+            "version": snapshot.version,
+            "map": base64.b64encode(encode_map(grid, origin)).decode(),
+            "drones": {id: serialize_block(block) for id, block in snapshot.drone_blocks.items()},
+            "reserved": {id: [serialize_block(i) for i in blocks]
+                         for id, blocks in snapshot.drone_reservations.items()},
+            }
+
+def _serialize_delta(old: MapSnapshot, new: MapSnapshot, boxes):
+    """
+    what changed from old to new, None for nothing a viewer would see. boxes are the ones fill_map/fill_columns
+    changed in between, so only they have to be looked at (and not the whole map)
+    """
+    boxes = {(tuple(min(i, j) for i, j in zip(a, b)), tuple(max(i, j) for i, j in zip(a, b))) for a, b in boxes}
+    if len(boxes) > STREAM_MAX_BOXES:
+        lows, highs = zip(*boxes)
+        boxes = {(tuple(min(i) for i in zip(*lows)), tuple(max(i) for i in zip(*highs)))}
+    # every box goes as its new contents in lib.encoding's grid (like the snapshot's "map"), which is a few bytes
+    # for a big fill of the same thing
+    changed = [base64.b64encode(encode_map(new.blocks.box(low, high), low)).decode() for low, high in boxes]
+    drones = {id: serialize_block(block) for id, block in new.drone_blocks.items()
+              if old.drone_blocks.get(id, None) != block}
+    drones.update({id: None for id in old.drone_blocks if id not in new.drone_blocks})
+    reserved = {id: [serialize_block(i) for i in blocks] for id, blocks in new.drone_reservations.items()
+                if old.drone_reservations.get(id, None) != blocks}
+    reserved.update({id: [] for id in old.drone_reservations if id not in new.drone_reservations})
+    if len(changed) == 0 and len(drones) == 0 and len(reserved) == 0:
+        return None
+    return {
+            "version": new.version,
+            "boxes": changed,
+            "drones": drones,
+            "reserved": reserved,
             }
 
-@route('/map/update', method='POST')
-def update_map():
-    if request.json == None:
-        abort(400, "plz gib json")
-    a = deserialize_block(request.json["a"])
-    b = deserialize_block(request.json["b"])
-    traversability = Traversability.FREE if request.json["empty"] else Traversability.BLOCKED
-    world_map.fill_map(a, b, traversability)
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+class _MapStream:
+    """
+    sends what changes on the map to every /viewer/stream client
+
+    the map tells on_publish about every snapshot it publishes (from whatever thread changed it). those get
+    collected for STREAM_INTERVAL and turned into one delta from the last snapshot that was sent out (last), which
+    every client gets the same copy of. a new client starts from a full copy of last, so the deltas after it line up
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._clients = set() # an asyncio.Queue of messages per client
+        self._pending = [] # (snapshot, changes) published since last, only touched on the loop
+        self._published = asyncio.Event()
+        self.last = None
+
+    def on_publish(self, snapshot: MapSnapshot, changes):
+        self._loop.call_soon_threadsafe(self._add_pending, snapshot, changes)
+
+    def _add_pending(self, snapshot: MapSnapshot, changes):
+        self._pending.append((snapshot, changes))
+        self._published.set()
+
+    def connect(self):
+        """
+        start following the stream, gives (snapshot to start from, queue that gets the deltas after it)
+
+        a None on the queue means the client fell too far behind and got dropped
+        """
+        queue = asyncio.Queue(maxsize=STREAM_BACKLOG)
+        self._clients.add(queue)
+        return self.last, queue
+
+    def disconnect(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def close(self):
+        """
+        end every client's stream, so that the server doesn't have to wait on them to shut down
+        """
+        for queue in list(self._clients):
+            self._drop(queue)
+
+    async def run(self):
+        while True:
+            await self._published.wait()
+            await asyncio.sleep(STREAM_INTERVAL)
+            self._published.clear()
+            pending, self._pending = self._pending, []
+            if len(pending) == 0:
+                continue
+            new = pending[-1][0]
+            if len(self._clients) == 0:
+                self.last = new
+                continue
+            boxes = [change[1:] for _, changes in pending for change in changes if change[0] == "box"]
+            delta = await asyncio.get_running_loop().run_in_executor(None, _serialize_delta, self.last, new, boxes)
+            self.last = new
+            if delta == None:
+                continue
+            message = _sse("delta", delta)
+            for queue in list(self._clients):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    self._drop(queue)
+
+@routes.get('/viewer/stream')
+async def stream_map(request: web.Request):
+    # server-sent events: a "snapshot" of the whole map ("map" is /viewer/map's compressed grid in base64, plus
+    # drones and reservations by id), then a "delta" with only what changed whenever something does ("boxes" of
+    # blocks, each a compressed grid like "map" that replaces that part of it)
+    stream = request.app[MAP_STREAM_KEY]
+    snapshot, queue = stream.connect()
+    try:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(_sse("snapshot", await _offload(request, _serialize_stream_snapshot, snapshot)))
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), STREAM_PING)
+            except asyncio.TimeoutError:
+                await response.write(b": ping\n\n")
+                continue
+            if message == None:
+                break
+            await response.write(message)
+    finally:
+        stream.disconnect(queue)
+    return response
+
+def _update_map(updates):
+    with world_map.batch():
+        for update in updates:
+            if "climb_penalty" in update:
+                world_map.set_climb_penalty(update["climb_penalty"])
+            if "a" not in update:
+                continue
+            a = deserialize_block(update["a"])
+            b = deserialize_block(update["b"])
+            if "empty" in update:
+                traversability = Traversability.FREE if update["empty"] else Traversability.BLOCKED
+                world_map.fill_map(a, b, traversability)
+            if "speed" in update:
+                world_map.set_speed(a, b, update["speed"])
+
+def _is_number(x) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+def _is_block(x) -> bool:
+    return isinstance(x, dict) and all(isinstance(x.get(i, None), int) and not isinstance(x[i], bool) for i in "xyz")
+
+def _is_coordinate(x) -> bool:
+    return isinstance(x, dict) and all(_is_number(x.get(i, None)) for i in ["lat", "lon", "alt"])
+
+def _check_update(update):
+    # raise HTTPBadRequest for anything _update_map can't apply, before any of them get applied
+    if not isinstance(update, dict):
+        raise web.HTTPBadRequest(text="an update has to be an object")
+    if ("a" in update) != ("b" in update):
+        raise web.HTTPBadRequest(text="a box needs both a and b")
+    if "a" not in update and ("empty" in update or "speed" in update):
+        raise web.HTTPBadRequest(text="empty and speed need a box (a and b)")
+    for corner in ["a", "b"]:
+        if corner in update:
+            if not _is_block(update[corner]):
+                raise web.HTTPBadRequest(text=f"{corner} has to be a block with whole number x, y and z")
+    if "empty" in update and not isinstance(update["empty"], bool):
+        raise web.HTTPBadRequest(text="empty has to be true or false")
+    speed = update.get("speed", None)
+    if speed != None and not (_is_number(speed) and MIN_SPEED <= speed <= MAX_SPEED):
+        raise web.HTTPBadRequest(text=f"speed has to be between {MIN_SPEED} and {MAX_SPEED}")
+    climb_penalty = update.get("climb_penalty", 0)
+    if not _is_number(climb_penalty) or climb_penalty < 0:
+        raise web.HTTPBadRequest(text="climb penalty has to be a number that isn't negative")
+
+@routes.post('/map/update')
+async def update_map(request: web.Request):
+    # one update or a list of them, which get applied all at once. an update is a box {"a": block, "b": block} with
+    #   "empty": true/false -- make the box free/blocked
+    #   "speed": relative to cruise speed (ex: 2 for a transit lane, 0.5 for a slow zone) or null to reset it
+    # or both, or {"climb_penalty": extra cost per block of altitude change} (see lib.costs)
+    j = await _json(request)
+    if j == None:
+        raise web.HTTPBadRequest(text="plz gib json")
+    updates = j if isinstance(j, list) else [j]
+    for update in updates:
+        _check_update(update)
+    await _offload(request, _update_map, updates)
+    return web.Response()
+
+def make_app(offload: bool=True) -> web.Application:
+    """
+    get the aiohttp app serving everything above
+
+    offload=False runs the slow handlers on the event loop too, which is how the old single threaded server behaved
+    (only useful for comparing against)
+    """
+    app = web.Application(middlewares=[_measure])
+    app[OFFLOAD_KEY] = offload
+    app.add_routes(routes)
+    app.cleanup_ctx.append(_lease_timer)
+    app.cleanup_ctx.append(_pathfind_scheduler)
+    app.cleanup_ctx.append(_map_stream)
+    app.on_shutdown.append(_close_stream)
+    PATH_CACHE.set_function(lambda: {(stat,): value for stat, value in world_map.path_cache.stats().items()})
+    return app
+
+async def _close_stream(app: web.Application):
+    app[MAP_STREAM_KEY].close()
+
+async def _map_stream(app: web.Application):
+    stream = _MapStream()
+    # listening first, so that nothing published in between gets missed (seeing a change twice is fine)
+    world_map.add_listener(stream.on_publish)
+    stream.last = world_map.snapshot()
+    app[MAP_STREAM_KEY] = stream
+    task = asyncio.create_task(stream.run())
+    yield
+    world_map.remove_listener(stream.on_publish)
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+async def _pathfind_scheduler(app: web.Application):
+    # a search at a time in-process (they'd only take turns on the gil/planner lock anyway), else one per worker
+    scheduler = PathfindScheduler(pool.workers if pool != None else 1, offload=app[OFFLOAD_KEY])
+    app[SCHEDULER_KEY] = scheduler
+    task = asyncio.create_task(scheduler.run())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+async def _lease_timer(app: web.Application):
+    # take back the blocks of drones that stopped renewing their leases (crashed, lost link, ...)
+    async def _expire_leases():
+        while True:
+            await asyncio.sleep(LEASE_CHECK_INTERVAL)
+            if app[OFFLOAD_KEY]:
+                expired = await asyncio.get_running_loop().run_in_executor(None, world_map.expire_leases)
+            else:
+                expired = world_map.expire_leases()
+            if len(expired) > 0:
+                print(f"leases of drones {expired} expired")
+
+    task = asyncio.create_task(_expire_leases())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
 
 if __name__ == "__main__":
     # for testing tehe :P
@@ -154,4 +649,4 @@ if __name__ == "__main__":
     world_map.fill_map((5, -50, 2), (5, 49, 2), Traversability.BLOCKED)
     world_map.update_drone("droneA", Coordinate(35.7274488, -78.6960209, 100))
 
-    run(host='localhost', port=8080)
+    web.run_app(make_app(), host='localhost', port=8080)
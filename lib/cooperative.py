@@ -0,0 +1,256 @@
+"""
+cooperative (multi-drone) planning over space and time
+
+drones get planned one after another. each planned path gets written into a ReservationTable as the blocks the
+drone takes up at every timestep, and drones planned later search over (block, timestep) so that they steer or wait
+around those paths. this is cooperative a* (silver, 2005), guided by true terrain distances to the goal like hca*
+
+every move (straight or diagonal) and every wait takes one timestep
+"""
+
+import heapq
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lib.util import *
+from lib.pathfinding import reconstruct_path
+
+TimedBlock = Tuple[MapBlockCoord, int] # (block, timestep)
+
+# a move costs 1 (its timestep) plus a little for the distance flown, so that arriving early matters most but
+# equally quick paths still prefer not to zig-zag. waiting costs just the timestep
+_DISTANCE_WEIGHT = 0.001
+
+class ReservationTable:
+    """
+    which drone takes up which block at which timestep
+
+    drones can't be in or next to each other's blocks (same rule as WorldMap.can_reserve_block), so a drone in
+    block b at timestep t takes up all 27 blocks around b at t
+
+    _zones:
+        maps (block, t) -> id of the drone taking it up
+    _latest:
+        maps block -> last timestep a drone (not counting parked ones) takes it up
+    _parked:
+        maps block -> {id: t} for drones that stay put around this block from timestep t onwards
+    """
+
+    def __init__(self):
+        self._zones = {}
+        self._latest = {}
+        self._parked = {}
+
+    def _around(self, block: MapBlockCoord):
+        x, y, z = block
+        return [(x+dx, y+dy, z+dz) for dx in [-1, 0, 1] for dy in [-1, 0, 1] for dz in [-1, 0, 1]]
+
+    def take(self, id: str, block: MapBlockCoord, t: int):
+        """
+        have a drone be in a block at timestep t
+        """
+        for b in self._around(block):
+            self._zones[b, t] = id
+            self._latest[b] = max(t, self._latest.get(b, t))
+
+    def add_path(self, id: str, path: List[TimedBlock]):
+        """
+        take up the blocks along a planned path, the drone stays parked at the end of it afterwards
+        """
+        for block, t in path[:-1]:
+            self.take(id, block, t)
+        self.park(id, *path[-1])
+
+    def park(self, id: str, block: MapBlockCoord, t: int):
+        """
+        have a drone stay in a block from timestep t onwards
+        """
+        for b in self._around(block):
+            self._parked.setdefault(b, {})[id] = t
+
+    def unpark(self, id: str, block: MapBlockCoord):
+        for b in self._around(block):
+            parked = self._parked.get(b, {})
+            parked.pop(id, None)
+            if len(parked) == 0:
+                self._parked.pop(b, None)
+
+    def is_free(self, id: str, block: MapBlockCoord, t: int) -> bool:
+        """
+        true if no other drone takes up a block at timestep t
+        """
+        other = self._zones.get((block, t), None)
+        if other != None and other != id:
+            return False
+        for other, t_parked in self._parked.get(block, {}).items():
+            if other != id and t_parked <= t:
+                return False
+        return True
+
+    def can_park(self, id: str, block: MapBlockCoord, t: int) -> bool:
+        """
+        true if a drone could stay in a block from timestep t onwards without any other drone coming by
+        """
+        if self._latest.get(block, -1) >= t:
+            return False
+        return all(other == id for other in self._parked.get(block, {}))
+
+class GoalDistance:
+    """
+    terrain distance (in search costs) from any block to a goal, found by a dijkstra out from the goal
+
+    the search only goes as far as lookups need it to and picks up where it left off on the next one
+    """
+
+    def __init__(self, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool]):
+        self._goal = goal
+        self._passable = passable
+        self._dists = {goal: 0.0}
+        self._closed = set()
+        self._queue = [(0.0, goal)]
+
+    def get(self, block: MapBlockCoord) -> float:
+        """
+        cost of the cheapest way from block to the goal, math.inf if there isn't one
+        """
+        while block not in self._closed and len(self._queue) > 0:
+            dist, curr = heapq.heappop(self._queue)
+            if curr in self._closed:
+                continue
+            self._closed.add(curr)
+            # blocks that can't be flown into still get a distance (a drone could start there), but moving from adj
+            # into curr needs curr to be passable
+            if curr != self._goal and not self._passable(curr):
+                continue
+            x, y, z = curr
+            for dx, dy, dz, d_metric in NEIGHBOR_OFFSETS:
+                adj = (x+dx, y+dy, z+dz)
+                if adj in self._closed:
+                    continue
+                adj_dist = dist + 1 + _DISTANCE_WEIGHT*d_metric
+                if adj_dist < self._dists.get(adj, math.inf):
+                    self._dists[adj] = adj_dist
+                    heapq.heappush(self._queue, (adj_dist, adj))
+        return self._dists[block] if block in self._closed else math.inf
+
+def cooperative_astar(id: str, start: MapBlockCoord, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+                      table: ReservationTable, max_steps: int, distance: GoalDistance=None,
+                      stats: dict=None) -> Optional[List[TimedBlock]]:
+    """
+    a* over (block, timestep) from start at timestep 0 to goal, going around what's in the reservation table
+
+    passable(block) is for static obstacles (terrain, drones that aren't being planned). a move from block a into
+    block b from timestep t to t+1 needs both a and b to be free in the table at both t and t+1, so that drones can't
+    cross each other mid-move. the goal only counts once the drone can stay parked there.
+
+    returns [(block, timestep)] including start and goal if possible within max_steps, else None
+    stats (if given) gets the number of expanded states added under "expansions"
+    """
+    if distance == None:
+        distance = GoalDistance(goal, passable)
+    h_start = distance.get(start)
+    if h_start == math.inf:
+        return None
+
+    start_state = (start, 0)
+    costs = {start_state: 0.0}
+    parents = {start_state: None}
+    closed = set()
+    queue = [(h_start, 0.0, start_state)]
+    expansions = 0
+    path = None
+
+    while len(queue) > 0:
+        _, cost, state = heapq.heappop(queue)
+        if state in closed:
+            continue
+        block, t = state
+        if block == goal and table.can_park(id, goal, t):
+            path = reconstruct_path(parents, state)
+            break
+        closed.add(state)
+        expansions += 1
+        if t >= max_steps or not table.is_free(id, block, t+1):
+            # out of time, or someone else gets close to this block next timestep no matter where we go
+            continue
+
+        moves = [(block, 1.0)]
+        x, y, z = block
+        for dx, dy, dz, d_metric in NEIGHBOR_OFFSETS:
+            adj = (x+dx, y+dy, z+dz)
+            if passable(adj) and table.is_free(id, adj, t):
+                moves.append((adj, 1 + _DISTANCE_WEIGHT*d_metric))
+        for adj, step_cost in moves:
+            adj_state = (adj, t+1)
+            if adj_state in closed or not table.is_free(id, adj, t+1):
+                continue
+            h = distance.get(adj)
+            if h == math.inf:
+                continue
+            adj_cost = cost + step_cost
+            if adj_cost < costs.get(adj_state, math.inf):
+                costs[adj_state] = adj_cost
+                parents[adj_state] = state
+                heapq.heappush(queue, (adj_cost + h, adj_cost, adj_state))
+
+    if stats != None:
+        stats["expansions"] = stats.get("expansions", 0) + expansions
+    return path
+
+def plan_cooperatively(starts: Dict[str, MapBlockCoord], goals: Dict[str, MapBlockCoord],
+                       passable: Callable[[MapBlockCoord], bool], max_steps: int=None,
+                       stats: dict=None) -> Dict[str, Optional[List[TimedBlock]]]:
+    """
+    plan conflict free paths for several drones at once, in the order of goals (earlier drones get priority)
+
+    drones are planned one at a time, each one around the paths of those before it. drones that haven't been planned
+    yet only hold on to their start at timestep 0 (later drones can dodge whatever comes their way), and if one of
+    them can't find a path it gets moved to the front and everyone is planned again. if that doesn't work out either,
+    drones are planned once more with every unplanned drone treated as staying at its start, where anyone left without
+    a path stays (and is safely out of everyone else's way)
+
+    max_steps limits how long any path can take, by default the drone's own distance to its goal plus some time to
+    wait for every other drone
+    returns {id: [(block, timestep)] or None}
+    """
+    distances = {id: GoalDistance(goal, passable) for id, goal in goals.items()}
+    # drones that can't get to their goal even without anyone else around just stay where they are
+    stuck = [id for id, goal in goals.items()
+             if distances[id].get(starts[id]) == math.inf or (starts[id] != goal and not passable(goal))]
+
+    def _steps(id):
+        if max_steps != None:
+            return max_steps
+        return int(distances[id].get(starts[id])) + 8*len(goals) + 16
+
+    def _plan(order, hold_starts):
+        table = ReservationTable()
+        for id in stuck:
+            table.park(id, starts[id], 0)
+        for id in order:
+            if hold_starts:
+                table.park(id, starts[id], 0)
+            else:
+                table.take(id, starts[id], 0)
+        paths = {id: None for id in stuck}
+        for id in order:
+            if hold_starts:
+                table.unpark(id, starts[id])
+            path = cooperative_astar(id, starts[id], goals[id], passable, table, _steps(id), distances[id], stats)
+            if path == None:
+                if not hold_starts:
+                    return paths, id
+                table.park(id, starts[id], 0)
+            else:
+                table.add_path(id, path)
+            paths[id] = path
+        return paths, None
+
+    order = [id for id in goals if id not in stuck]
+    for _ in range(len(order)):
+        paths, failed = _plan(order, False)
+        if failed == None:
+            return paths
+        order.remove(failed)
+        order.insert(0, failed)
+    return _plan(order, True)[0]
@@ -0,0 +1,147 @@
+"""
+per-block travel costs, so that pathfinding can minimise flight time instead of distance
+
+every block has a speed relative to normal cruise speed (ex: 2 in a fast transit lane, 0.5 in a slow zone next to a
+structure, 1 everywhere else). moving into a block takes (distance / its speed), plus climb_penalty for every block
+of altitude gained or lost on the way. costs are in the same units as distances: one block at cruise speed = 1
+
+speeds are kept in one byte per block, and only for 16x16x16 chunks that have a block that isn't at cruise speed,
+so a map with no lanes/zones costs nothing
+"""
+
+import math
+
+import numpy as np
+
+from lib.util import *
+from lib.pathfinding import octile_distance
+
+CHUNK_BITS = 4
+CHUNK_SIZE = 1 << CHUNK_BITS
+_CHUNK_MASK = CHUNK_SIZE - 1
+
+# speeds are stored as multiples of 1/SPEED_STEPS of cruise speed, code 0 is "not set" (cruise speed)
+SPEED_STEPS = 16
+MIN_SPEED = 1 / SPEED_STEPS
+MAX_SPEED = 255 / SPEED_STEPS
+_COST_BY_CODE = [1.0] + [SPEED_STEPS / code for code in range(1, 256)]
+
+def _speed_code(speed: float) -> int:
+    if speed == None:
+        return 0
+    if not MIN_SPEED <= speed <= MAX_SPEED:
+        raise ValueError(f"speed {speed} is outside of {MIN_SPEED} -> {MAX_SPEED}")
+    return round(speed * SPEED_STEPS)
+
+class CostLayer:
+    """
+    block speeds + climb penalty for a map (see the module docstring)
+
+    copy() shares chunks with the original, and a chunk only gets copied once fill() changes it, so copies are
+    cheap enough to make for every change like the snapshots they're part of
+
+    _chunks:
+        maps chunk coord -> bytearray of speed codes, indexed by ((x*CHUNK_SIZE) + y)*CHUNK_SIZE + z within the chunk
+    """
+
+    def __init__(self):
+        self._chunks = {}
+        self._owned = set() # chunks that aren't shared with a copy, and so can be changed in place
+        self._min_cost = 1.0
+        self.climb_penalty = 0.0
+
+    @property
+    def weighted(self) -> bool:
+        """
+        true if moving anywhere can cost something other than its distance
+        """
+        return len(self._chunks) > 0 or self.climb_penalty > 0
+
+    @property
+    def min_cost(self) -> float:
+        """
+        the lowest cost per block of distance anywhere on the map (1 / the highest speed)
+        """
+        return self._min_cost
+
+    def fill(self, a: MapBlockCoord, b: MapBlockCoord, speed: float):
+        """
+        set the speed of every block in the box a -> b (inclusive), None to go back to cruise speed
+        """
+        code = _speed_code(speed)
+        low = [min(i, j) for i, j in zip(a, b)]
+        high = [max(i, j) for i, j in zip(a, b)]
+        chunk_low = [i >> CHUNK_BITS for i in low]
+        chunk_high = [i >> CHUNK_BITS for i in high]
+        for cx in range(chunk_low[0], chunk_high[0]+1):
+            for cy in range(chunk_low[1], chunk_high[1]+1):
+                for cz in range(chunk_low[2], chunk_high[2]+1):
+                    chunk = (cx, cy, cz)
+                    cells = self._chunks.get(chunk, None)
+                    if cells == None:
+                        if code == 0:
+                            continue
+                        cells = bytearray(CHUNK_SIZE**3)
+                    elif chunk not in self._owned:
+                        cells = bytearray(cells)
+                    grid = np.frombuffer(cells, dtype=np.uint8).reshape((CHUNK_SIZE,)*3)
+                    grid[tuple(slice(max(l - (c << CHUNK_BITS), 0), min(h - (c << CHUNK_BITS), _CHUNK_MASK) + 1)
+                               for l, h, c in zip(low, high, chunk))] = code
+                    del grid
+                    if code == 0 and not any(cells):
+                        self._chunks.pop(chunk, None)
+                        self._owned.discard(chunk)
+                    else:
+                        self._chunks[chunk] = cells
+                        self._owned.add(chunk)
+        fastest = max([max(cells) for cells in self._chunks.values()] + [SPEED_STEPS])
+        self._min_cost = SPEED_STEPS / fastest
+
+    def speed(self, block: MapBlockCoord) -> float:
+        return 1 / self.cost(block)
+
+    def cost(self, block: MapBlockCoord) -> float:
+        """
+        cost per block of distance when moving into this block
+        """
+        cells = self._chunks.get((block[0] >> CHUNK_BITS, block[1] >> CHUNK_BITS, block[2] >> CHUNK_BITS), None)
+        if cells == None:
+            return 1.0
+        x, y, z = block[0] & _CHUNK_MASK, block[1] & _CHUNK_MASK, block[2] & _CHUNK_MASK
+        return _COST_BY_CODE[cells[(x*CHUNK_SIZE + y)*CHUNK_SIZE + z]]
+
+    def step_cost(self, block: MapBlockCoord, dz: int, distance: float) -> float:
+        """
+        cost of moving distance blocks into block, dz blocks up/down
+        """
+        return distance * self.cost(block) + self.climb_penalty * abs(dz)
+
+    def heuristic(self, a: MapBlockCoord, b: MapBlockCoord) -> float:
+        """
+        a lower bound on the cost of getting from a to b, for a*
+
+        a path has to cover at least the octile distance at no more than the highest speed, and climb/descend at
+        least the difference in altitude, so this never overestimates (and is consistent)
+        """
+        return self._min_cost * octile_distance(a, b) + self.climb_penalty * abs(a[2]-b[2])
+
+    def path_cost(self, path) -> float:
+        """
+        total cost of following a path, None for no path
+        """
+        if path == None:
+            return None
+        return sum(self.step_cost(q, q[2]-p[2], math.dist(p, q)) for p, q in zip(path, path[1:]))
+
+    def copy(self) -> "CostLayer":
+        r = CostLayer()
+        r._chunks = self._chunks.copy()
+        r._min_cost = self._min_cost
+        r.climb_penalty = self.climb_penalty
+        # the chunks are shared now, neither side can change them in place anymore
+        self._owned = set()
+        return r
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(cells) for cells in self._chunks.values())
@@ -0,0 +1,46 @@
+"""
+compact binary encoding of a map's blocks, an alternative to /viewer/map's one json object per block
+
+the blocks go out as the int8 grid of lib.storage (0 for undeclared, else Traversability.value) covering the
+declared blocks, zlib compressed. airspace is mostly big boxes of the same value, which compress down to almost
+nothing, so the size goes with how complicated the map is instead of how many blocks it has. layout, little
+endian:
+
+    magic b"DCM1"
+    origin x, y, z -- int32, the block at grid[0, 0, 0]
+    shape nx, ny, nz -- uint32
+    length of the compressed grid -- uint32
+    the compressed grid, c order (index [x, y, z])
+    everything else (ex: drones) as utf-8 json, until the end
+"""
+
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAP_CONTENT_TYPE = "application/x-drone-map"
+
+_MAGIC = b"DCM1"
+_HEADER = struct.Struct("<4s3i3II")
+
+def encode_map(grid: np.ndarray, origin, extra=None, level: int=6) -> bytes:
+    """
+    encode an int8 grid of cell values with the block coord of its [0, 0, 0] cell, and anything json in extra
+    """
+    compressed = zlib.compress(np.ascontiguousarray(grid, dtype=np.int8).tobytes(), level)
+    header = _HEADER.pack(_MAGIC, *origin, *grid.shape, len(compressed))
+    return header + compressed + json.dumps(extra).encode()
+
+def decode_map(payload: bytes):
+    """
+    get (grid, origin, extra) back out of encode_map's payload
+    """
+    magic, ox, oy, oz, nx, ny, nz, length = _HEADER.unpack_from(payload)
+    if magic != _MAGIC:
+        raise ValueError("not an encoded map")
+    start = _HEADER.size
+    grid = np.frombuffer(zlib.decompress(payload[start:start+length]), dtype=np.int8).reshape((nx, ny, nz))
+    extra = json.loads(payload[start+length:].decode())
+    return grid, (ox, oy, oz), extra
@@ -0,0 +1,325 @@
+"""
+hierarchical (hpa*-style) pathfinding for large maps
+
+the map gets split into cubic chunks. where two face-adjacent chunks share passable blocks across their common face
+we pick a few "entrance" blocks on each side, and inside each chunk we keep the distances between its entrances.
+a query first searches this much smaller graph of entrances, then refines each hop with a* restricted to a single
+chunk.
+
+everything here only looks at terrain (the map itself). drones and reservations change far too often to bake into
+chunk data, so they only come in during refinement, and if they make a hop impossible we fall back to a flat
+search.
+"""
+
+import heapq
+import math
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from lib.util import *
+from lib.pathfinding import astar, octile_distance, reconstruct_path
+
+_AXES = [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
+
+class _Chunk:
+    """
+    precomputed data for one chunk
+
+    free:
+        bytes, 1 where terrain is free, over the chunk padded by one layer of (never free) blocks on every side. see
+        HierarchicalPlanner._local for the layout
+    box:
+        true if the free blocks form a single box, in which case octile distances between them are exact
+    partners:
+        maps each entrance -> [blocks across a chunk face it can step into]
+    dists:
+        maps each entrance -> {other entrance: shortest terrain-only distance inside this chunk}
+    """
+
+    def __init__(self, free: bytes, box: bool):
+        self.free = free
+        self.box = box
+        self.partners = {}
+        self.dists = {}
+
+class HierarchicalPlanner:
+    """
+    keeps chunk/entrance data for a map and answers queries with it
+
+    terrain_mask(a, b) gives a bool ndarray over the box a -> b that's true where terrain allows moving into a block
+    (see box_mask in lib.storage). chunk data is built lazily as queries need it (or all at once with prepare) and
+    thrown out for chunks touched by invalidate_box
+    """
+
+    def __init__(self, terrain_mask: Callable[[MapBlockCoord, MapBlockCoord], np.ndarray], chunk_size: int=16,
+                 entrance_span: int=16):
+        """
+        chunk_size is the edge length of a chunk in blocks
+
+        entrance_span limits how far apart entrances along the same open stretch of a chunk face are. fewer entrances
+        keep the abstract graph small and chunks quick to build, but make paths bend towards the middle of openings
+        """
+        self._terrain_mask = terrain_mask
+        self._size = chunk_size
+        self._span = entrance_span
+        self._chunks = {} # chunk coord -> _Chunk
+        self._faces = {} # (chunk coord, axis) -> [(block in chunk, block in chunk + axis)]
+
+        # searches inside a chunk work on flat indexes into _Chunk.free
+        p = chunk_size + 2
+        self._offsets = [((dx*p + dy)*p + dz, d) for dx, dy, dz, d in NEIGHBOR_OFFSETS]
+
+    def chunk_of(self, block: MapBlockCoord) -> MapBlockCoord:
+        s = self._size
+        return (block[0] // s, block[1] // s, block[2] // s)
+
+    def _chunk_box(self, chunk: MapBlockCoord):
+        s = self._size
+        low = tuple(i*s for i in chunk)
+        return low, tuple(i+s-1 for i in low)
+
+    def _local(self, block: MapBlockCoord) -> int:
+        """
+        flat index of a block into its chunk's _Chunk.free
+        """
+        s = self._size
+        p = s + 2
+        return ((block[0] % s + 1)*p + block[1] % s + 1)*p + block[2] % s + 1
+
+    def invalidate_box(self, a: MapBlockCoord, b: MapBlockCoord):
+        """
+        throw out chunk data that depends on the blocks in the box a -> b
+        """
+        c_low, c_high = self.chunk_of(a), self.chunk_of(b)
+        for cx in range(c_low[0], c_high[0]+1):
+            for cy in range(c_low[1], c_high[1]+1):
+                for cz in range(c_low[2], c_high[2]+1):
+                    chunk = (cx, cy, cz)
+                    self._chunks.pop(chunk, None)
+                    for k, axis in enumerate(_AXES):
+                        before = (cx-axis[0], cy-axis[1], cz-axis[2])
+                        after = (cx+axis[0], cy+axis[1], cz+axis[2])
+                        self._faces.pop((chunk, k), None)
+                        self._faces.pop((before, k), None)
+                        # neighbors share a face with this chunk, so their entrances can change too
+                        self._chunks.pop(before, None)
+                        self._chunks.pop(after, None)
+
+    def prepare(self, a: MapBlockCoord, b: MapBlockCoord):
+        """
+        build chunk data for every chunk overlapping the box a -> b ahead of time
+        """
+        c_low, c_high = self.chunk_of(a), self.chunk_of(b)
+        for cx in range(c_low[0], c_high[0]+1):
+            for cy in range(c_low[1], c_high[1]+1):
+                for cz in range(c_low[2], c_high[2]+1):
+                    self._chunk((cx, cy, cz))
+
+    def _face(self, chunk: MapBlockCoord, k: int):
+        """
+        get [(u, v)] entrance pairs across the face between chunk and the next chunk along axis k
+        """
+        key = (chunk, k)
+        if key in self._faces:
+            return self._faces[key]
+
+        low, high = self._chunk_box(chunk)
+        i, j = [a for a in range(3) if a != k]
+        a, b = list(low), list(high)
+        a[k] = high[k]
+        b[k] = high[k] + 1
+        # both sides of the face have to be free
+        open_mask = self._terrain_mask(tuple(a), tuple(b)).all(axis=k)
+        open_cells = set((int(p), int(q)) for p, q in np.argwhere(open_mask))
+
+        def _blocks(p, q):
+            u = [0, 0, 0]
+            u[k], u[i], u[j] = high[k], low[i]+p, low[j]+q
+            v = list(u)
+            v[k] += 1
+            return tuple(u), tuple(v)
+
+        # split the open cells into connected openings, then each opening into span x span tiles. every tile gets
+        # one entrance, the cell closest to the middle of it
+        pairs = []
+        seen = set()
+        for cell in sorted(open_cells):
+            if cell in seen:
+                continue
+            component = []
+            stack = [cell]
+            seen.add(cell)
+            while len(stack) > 0:
+                p, q = stack.pop()
+                component.append((p, q))
+                for dp in [-1, 0, 1]:
+                    for dq in [-1, 0, 1]:
+                        adj = (p+dp, q+dq)
+                        if adj in open_cells and adj not in seen:
+                            seen.add(adj)
+                            stack.append(adj)
+            tiles = {}
+            for p, q in component:
+                tiles.setdefault((p // self._span, q // self._span), []).append((p, q))
+            for tile in sorted(tiles):
+                cells = tiles[tile]
+                mid_p = sum(c[0] for c in cells) / len(cells)
+                mid_q = sum(c[1] for c in cells) / len(cells)
+                best = min(cells, key=lambda c: ((c[0]-mid_p)**2 + (c[1]-mid_q)**2, c))
+                pairs.append(_blocks(*best))
+
+        self._faces[key] = pairs
+        return pairs
+
+    def _chunk(self, chunk: MapBlockCoord) -> _Chunk:
+        data = self._chunks.get(chunk, None)
+        if data != None:
+            return data
+
+        mask = self._terrain_mask(*self._chunk_box(chunk))
+        padded = np.zeros([n+2 for n in mask.shape], dtype=bool)
+        padded[1:-1, 1:-1, 1:-1] = mask
+        free_idxs = np.argwhere(mask)
+        box = len(free_idxs) > 0 and \
+                len(free_idxs) == np.prod(free_idxs.max(axis=0) - free_idxs.min(axis=0) + 1)
+        data = _Chunk(padded.tobytes(), box)
+
+        for k, axis in enumerate(_AXES):
+            for u, v in self._face(chunk, k):
+                data.partners.setdefault(u, []).append(v)
+            before = (chunk[0]-axis[0], chunk[1]-axis[1], chunk[2]-axis[2])
+            for u, v in self._face(before, k):
+                data.partners.setdefault(v, []).append(u)
+
+        # distances are symmetric, so each search only needs to look for the entrances after its own
+        entrances = list(data.partners)
+        for e in entrances:
+            data.dists[e] = {}
+        for n, e in enumerate(entrances):
+            for o, dist in self._distances(data, e, set(entrances[n+1:])).items():
+                data.dists[e][o] = dist
+                data.dists[o][e] = dist
+        self._chunks[chunk] = data
+        return data
+
+    def _distances(self, data: _Chunk, source: MapBlockCoord, targets) -> dict:
+        """
+        terrain-only distances from source to the targets (all in the same chunk), without leaving the chunk
+
+        returns {target: distance} for the reachable targets
+        """
+        free = data.free
+        local = self._local(source)
+        if data.box and free[local]:
+            # nothing in the way, so the octile distance is exact
+            return {t: octile_distance(source, t) for t in targets}
+
+        # dijkstra, stopping once every target has been reached
+        target_idxs = {self._local(t): t for t in targets}
+        dists = [math.inf] * len(free)
+        dists[local] = 0.0
+        found = {}
+        queue = [(0.0, local)]
+        while len(queue) > 0 and len(found) < len(target_idxs):
+            dist, i = heapq.heappop(queue)
+            if dist > dists[i]:
+                continue
+            if i in target_idxs:
+                found[target_idxs[i]] = dist
+            for offset, d_metric in self._offsets:
+                j = i + offset
+                adj_dist = dist + d_metric
+                # the padding around the chunk is never free, so this can't leave it
+                if free[j] and adj_dist < dists[j]:
+                    dists[j] = adj_dist
+                    heapq.heappush(queue, (adj_dist, j))
+        return found
+
+    def find_path(self, start: MapBlockCoord, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+                  stats: dict=None) -> Optional[List[MapBlockCoord]]:
+        """
+        find a (near optimal) path from start to goal, where passable(block) includes drones/reservations
+
+        returns [path] if possible, else None
+        stats (if given) gets "abstract_expansions", "expansions" (from refining) and "fallback" (if a flat search had
+        to be used instead)
+        """
+        if stats == None:
+            stats = {}
+        stats["fallback"] = False
+        if start == goal:
+            return [start]
+        if not passable(goal):
+            return None
+
+        start_chunk, goal_chunk = self.chunk_of(start), self.chunk_of(goal)
+        if blocks_touch(start_chunk, goal_chunk):
+            # short hops would mostly be detours through entrances, a flat search is cheap at this range anyway
+            return astar(start, goal, passable, stats)
+        start_data, goal_data = self._chunk(start_chunk), self._chunk(goal_chunk)
+        start_edges = self._distances(start_data, start, set(start_data.partners))
+        goal_edges = self._distances(goal_data, goal, set(goal_data.partners))
+
+        abstract_path = self._abstract_search(start, goal, start_edges, goal_edges, goal_chunk, stats)
+        if abstract_path == None:
+            # entrances only cover straight steps across chunk faces, so a route that squeezes diagonally past a
+            # chunk edge/corner won't show up here. check with a flat search before giving up
+            stats["fallback"] = True
+            return astar(start, goal, passable, stats)
+
+        path = [start]
+        for p, q in zip(abstract_path, abstract_path[1:]):
+            chunk = self.chunk_of(p)
+            if chunk == self.chunk_of(q):
+                s = self._size
+                piece = astar(p, q, lambda b: (b[0] // s, b[1] // s, b[2] // s) == chunk and passable(b), stats)
+            else:
+                piece = [p, q] if passable(q) else None
+            if piece == None:
+                # a drone or reservation is in the way somewhere, the abstract graph doesn't know about those
+                stats["fallback"] = True
+                return astar(start, goal, passable, stats)
+            path.extend(piece[1:])
+        return path
+
+    def _abstract_search(self, start, goal, start_edges: dict, goal_edges: dict, goal_chunk, stats: dict):
+        h = octile_distance
+        dists = {start: 0.0}
+        parents = {start: None}
+        closed = set()
+        queue = [(h(start, goal), -0.0, start)]
+        expansions = 0
+        path = None
+        while len(queue) > 0:
+            _, neg_dist, node = heapq.heappop(queue)
+            if node in closed:
+                continue
+            if node == goal:
+                path = reconstruct_path(parents, goal)
+                break
+            closed.add(node)
+            expansions += 1
+
+            if node == start:
+                edges = list(start_edges.items())
+            else:
+                chunk = self.chunk_of(node)
+                data = self._chunk(chunk)
+                edges = list(data.dists.get(node, {}).items())
+                edges += [(p, 1.0) for p in data.partners.get(node, [])]
+                if chunk == goal_chunk and node in goal_edges:
+                    edges.append((goal, goal_edges[node]))
+
+            dist = -neg_dist
+            for adj, cost in edges:
+                if adj in closed:
+                    continue
+                adj_dist = dist + cost
+                if adj_dist < dists.get(adj, math.inf):
+                    dists[adj] = adj_dist
+                    parents[adj] = node
+                    heapq.heappush(queue, (adj_dist + h(adj, goal), -adj_dist, adj))
+
+        stats["abstract_expansions"] = stats.get("abstract_expansions", 0) + expansions
+        return path
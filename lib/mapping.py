@@ -1,56 +1,467 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from typing import Tuple
 from enum import Enum
 
+import numpy as np
+
 from aerpawlib.util import Coordinate, VectorNED
 
 from lib.util import *
+from lib.pathfinding import astar, jps, smooth_path, AnytimeAstar, DStarLite, PathCache
+from lib.hierarchical import HierarchicalPlanner
+from lib.cooperative import plan_cooperatively
+from lib.storage import STORAGE_BACKENDS
+from lib.costs import CostLayer
+from lib import metrics
+
+# search modes supported by WorldMap.find_path
+PATH_MODES = ["astar", "incremental", "hierarchical", "jps", "anytime"]
+
+# "anytime" searches: how many are kept around to pick back up, how long one keeps improving in the background after
+# a query, and how many blocks the background thread expands in one before moving on to the next
+ANYTIME_KEEP = 64
+ANYTIME_BACKGROUND = 5 # seconds
+ANYTIME_SLICE = 1000
+
+# leases (see WorldMap.lease_blocks): how long one lasts unless asked otherwise, and how many blocks it can hold
+LEASE_TTL = 10 # seconds
+MAX_LEASE_BLOCKS = 16
+
+PATHFIND_SECONDS = metrics.histogram("ground_pathfind_seconds", "time spent in find_path, cache hits included",
+                                     ["mode"])
+PATHFIND_EXPANSIONS = metrics.histogram("ground_pathfind_expansions", "blocks expanded by find_paths that searched",
+                                        ["mode"], buckets=metrics.COUNT_BUCKETS)
+PATHFIND_RESULTS = metrics.counter("ground_pathfind_results_total", "find_paths by result (found, no_path, cached, "
+                                   "out_of_budget)", ["mode", "result"])
+RESERVATIONS = metrics.counter("ground_reservations_total", "reserve_blocks by result (ok, or why it was refused)",
+                               ["result"])
+LEASED_BLOCKS = metrics.counter("ground_lease_blocks_total", "blocks asked for in lease_blocks (granted or refused)",
+                                ["result"])
+EXPIRED_LEASES = metrics.counter("ground_leases_expired_total", "leases taken back by expire_leases")
+
+def record_pathfind(mode: str, stats: dict, expansions_before: int, seconds: float, path):
+    """
+    count a find_path in the metrics above, stats being what it filled in
+    """
+    PATHFIND_SECONDS.labels(mode).observe(seconds)
+    if stats.get("cached", False):
+        result = "cached"
+    else:
+        if path != None:
+            result = "found"
+        elif stats.get("done", True):
+            result = "no_path"
+        else:
+            result = "out_of_budget"
+        PATHFIND_EXPANSIONS.labels(mode).observe(stats.get("expansions", 0) - expansions_before)
+    PATHFIND_RESULTS.labels(mode, result).inc()
+
+# radius of the sphere aerpawlib uses when adding a VectorNED to a Coordinate, in meters
+EARTH_RADIUS = 6378137.0
+
+def _neighborhood(block: MapBlockCoord):
+    """
+    a block and all blocks adjacent to it
+    """
+    x, y, z = block
+    return [block] + [(x+dx, y+dy, z+dz) for dx, dy, dz, _ in NEIGHBOR_OFFSETS]
+
+def _count_adjacent(counts: dict, block: MapBlockCoord, delta: int):
+    """
+    add delta to the reference count of a block and everything adjacent to it, dropping counts that hit 0
+    """
+    for adj in _neighborhood(block):
+        count = counts.get(adj, 0) + delta
+        if count == 0:
+            del counts[adj]
+        else:
+            counts[adj] = count
 
 class MapBlockCoordSystem:
+    """
+    converts between coordinates and blocks
+
+    blocks are laid out on a local east/north/up tangent plane around center_coords. the projection is the same
+    spherical one aerpawlib uses to add a VectorNED to a Coordinate, but the scale factors are worked out once here
+    instead of on every call. the batch methods take/return ndarrays and share the math with the scalar ones
+    """
+
     def __init__(self, center_coords: Coordinate, resolution: float):
         self._center_coords = center_coords
         self._resolution = resolution
+        self._meters_per_lat = math.radians(1) * EARTH_RADIUS
+        self._meters_per_lon = self._meters_per_lat * math.cos(math.radians(center_coords.lat))
+
+    def _coord_to_local(self, lat, lon, alt):
+        """
+        (lat, lon, alt) -> (east, north, up) meters from the center, works on floats or ndarrays
+        """
+        c = self._center_coords
+        return (lon - c.lon) * self._meters_per_lon, (lat - c.lat) * self._meters_per_lat, alt - c.alt
+
+    def _local_to_coord(self, east, north, up):
+        """
+        (east, north, up) meters from the center -> (lat, lon, alt), works on floats or ndarrays
+        """
+        c = self._center_coords
+        return c.lat + north / self._meters_per_lat, c.lon + east / self._meters_per_lon, c.alt + up
 
     def coord_to_block(self, coord: Coordinate) -> MapBlockCoord:
-        delta_vec = coord - self._center_coords
-        x, y, z = [int(i // self._resolution) for i in [delta_vec.east, delta_vec.north, -delta_vec.down]]
-        return (x, y, z)
+        east, north, up = self._coord_to_local(coord.lat, coord.lon, coord.alt)
+        return (int(east // self._resolution), int(north // self._resolution), int(up // self._resolution))
 
     def block_to_coord(self, block: MapBlockCoord) -> Coordinate:
         """
         returns the coordinate representing the corner of the block
         """
-        x, y, z = [i*self._resolution for i in block]
-        delta_vec = VectorNED(y, x, -z)
-        return self._center_coords + delta_vec
+        return Coordinate(*self._local_to_coord(*[i*self._resolution for i in block]))
 
     def get_block_center(self, block: MapBlockCoord) -> Coordinate:
-        x, y, z = [i*self._resolution for i in block]
-        x, y, z = [i+(0.5 * self._resolution) for i in [x,y,z]]
-        delta_vec = VectorNED(y, x, -z)
-        return self._center_coords + delta_vec
+        return Coordinate(*self._local_to_coord(*[(i+0.5)*self._resolution for i in block]))
+
+    def coords_to_blocks(self, coords: np.ndarray) -> np.ndarray:
+        """
+        batch coord_to_block, coords is an (n, 3) array of lat/lon/alt rows
+
+        returns an (n, 3) int array of blocks
+        """
+        coords = np.asarray(coords, dtype=float)
+        local = self._coord_to_local(coords[:, 0], coords[:, 1], coords[:, 2])
+        return (np.stack(local, axis=-1) // self._resolution).astype(np.int64)
+
+    def blocks_to_coords(self, blocks: np.ndarray, centers: bool=False) -> np.ndarray:
+        """
+        batch block_to_coord (or get_block_center if centers), blocks is an (n, 3) array
+
+        blocks don't have to be whole, ex: corners of a block at (x +- 0.5, ...) work too
+        returns an (n, 3) array of lat/lon/alt rows
+        """
+        blocks = np.asarray(blocks, dtype=float)
+        if centers:
+            blocks = blocks + 0.5
+        local = blocks * self._resolution
+        return np.stack(self._local_to_coord(local[:, 0], local[:, 1], local[:, 2]), axis=-1)
+
+class MapSnapshot:
+    """
+    an immutable, versioned copy of everything in a WorldMap (see WorldMap.snapshot)
+
+    once a snapshot has been published it never changes, so readers can hold on to one (and look at it from any
+    thread) without copying or locking anything. writers change an unpublished snapshot made with thaw() instead,
+    which shares the block storage with the snapshot it came from until own_blocks() is called
+
+    version is bumped for every published snapshot, blocks is the map's storage (see lib.storage) and costs its
+    lib.costs.CostLayer, which is shared the same way
+    """
+
+    def __init__(self, blocks):
+        self.version = 0
+        self.blocks = blocks
+        self.costs = CostLayer()
+        self.drone_locations = {} # maps id -> position (Coordinate)
+        self.occupied_blocks = {} # maps reserved block -> id
+        self.lease_expiry = {} # maps id -> time.monotonic() its reservations run out at, if they do
+        self.lease_ttl = {} # maps id -> ttl of its lease, which lease_expiry gets pushed back by as the drone flies it
+
+        # indexes kept up to date by update_drone/reserve_block/unreserve_block so that checks don't have to scan
+        self.drone_blocks = {} # maps id -> block the drone is in
+        self.drone_reservations = {} # maps id -> tuple of reserved blocks, in the order the drone flies through them
+        self.drone_adjacent_counts = {} # maps block -> number of drones it's adjacent to (or occupied by)
+        self.reserved_adjacent_counts = {} # maps block -> number of reservations it's adjacent to (or is)
+
+        # bumped whenever something find_path looks at changes, used to key the path cache.
+        # the occupancy generation is the sum of the per-drone ones, so the part caused by a set of drones can be
+        # taken back out when those drones are being ignored. the terrain generation covers costs too
+        self.terrain_generation = 0
+        self.occupancy_generation = 0
+        self.drone_generations = {} # maps id -> changes to that drone's block/reservation
+        self._owns_blocks = True
+        self._owns_costs = True
+
+    def thaw(self) -> "MapSnapshot":
+        """
+        get an unpublished copy of this snapshot to make changes to
+
+        everything but the block storage and costs is copied right away (it's all small, about 27 entries per drone)
+        """
+        r = MapSnapshot(self.blocks)
+        r.costs = self.costs
+        r.version = self.version + 1
+        r.drone_locations = self.drone_locations.copy()
+        r.occupied_blocks = self.occupied_blocks.copy()
+        r.lease_expiry = self.lease_expiry.copy()
+        r.lease_ttl = self.lease_ttl.copy()
+        r.drone_blocks = self.drone_blocks.copy()
+        r.drone_reservations = self.drone_reservations.copy()
+        r.drone_adjacent_counts = self.drone_adjacent_counts.copy()
+        r.reserved_adjacent_counts = self.reserved_adjacent_counts.copy()
+        r.terrain_generation = self.terrain_generation
+        r.occupancy_generation = self.occupancy_generation
+        r.drone_generations = self.drone_generations.copy()
+        r._owns_blocks = False
+        r._owns_costs = False
+        return r
+
+    def own_blocks(self):
+        """
+        get block storage that can be changed, copying it the first time this is called on an unpublished snapshot
+        """
+        if not self._owns_blocks:
+            self.blocks = self.blocks.copy()
+            self._owns_blocks = True
+        return self.blocks
+
+    def own_costs(self) -> CostLayer:
+        """
+        same as own_blocks, for the cost layer
+        """
+        if not self._owns_costs:
+            self.costs = self.costs.copy()
+            self._owns_costs = True
+        return self.costs
+
+    def path_generations(self, drones_ignoring):
+        """
+        see WorldMap.path_generations
+        """
+        ignored = sum(self.drone_generations.get(i, 0) for i in drones_ignoring)
+        return (self.terrain_generation, self.occupancy_generation - ignored)
+
+    def path_blocked_func(self, drones_ignoring):
+        """
+        get a function telling if pathfinding has to avoid a block because of drones or reservations
+
+        drones in drones_ignoring (and their reservations) are not counted
+        """
+        drone_counts = self.drone_adjacent_counts
+        reserved_counts = self.reserved_adjacent_counts
+        ignored_drones = [self.drone_blocks[i] for i in drones_ignoring if i in self.drone_blocks]
+        ignored_reserved = [block for i in drones_ignoring for block in self.drone_reservations.get(i, ())]
+
+        def _blocked(block):
+            count = drone_counts.get(block, 0)
+            if count > 0:
+                for ignored in ignored_drones:
+                    if blocks_touch(ignored, block):
+                        count -= 1
+                if count > 0:
+                    return True
+            count = reserved_counts.get(block, 0)
+            if count > 0:
+                for ignored in ignored_reserved:
+                    if blocks_touch(ignored, block):
+                        count -= 1
+                if count > 0:
+                    return True
+            return False
+        return _blocked
+
+    def passable_func(self, drones_ignoring):
+        """
+        get a function telling if pathfinding can move into a block
+        """
+        blocked = self.path_blocked_func(drones_ignoring)
+        world = self.blocks
+
+        def _passable(block):
+            # undeclared space is considered illegal
+            return world.get(block) == Traversability.FREE and not blocked(block)
+        return _passable
+
+class _AnytimeSearch:
+    """
+    an AnytimeAstar kept between find_path calls, good for as long as the generations it started at are current
+    """
+
+    def __init__(self, search: AnytimeAstar, drones_ignoring: frozenset, generations):
+        self.search = search
+        self.drones_ignoring = drones_ignoring
+        self.generations = generations
+        self.lock = threading.Lock()
+        self.until = 0.0 # time.monotonic() the background thread stops improving it at
 
 class WorldMap(MapBlockCoordSystem):
     """
     keeps track of free space that can be traversed and does pathfinding as needed
 
+    everything the map knows is kept in MapSnapshots. readers (the http handlers, loggers, path searches) look at
+    the latest published one, which never changes under them. changes are made by one thread at a time to an
+    unpublished copy that gets swapped in when the change (or batch of changes) is done
+
     _map:
         n_d dict from a coordinate to an enum declaring traversability
+        this is one of the backends in lib.storage, either a real dict ("dict") or a dense int8 ndarray ("grid")
     
     NOTE: the blocks occupied by terrain should be filled in by some algorithm elsewhere
-          this likely will make use of fill_map at various altitudes
-          TODO maybe add a function to download/load in a heightmap?
+          lib.terrain can load heightmaps and obstacle footprints in with fill_columns
     """
 
-    def __init__(self, center_coords: Coordinate, resolution: float):
+    def __init__(self, center_coords: Coordinate, resolution: float, storage: str="dict", bounds=None,
+                 path_cache_size: int=256, chunk_size: int=16):
         """
         center_coords defines the coordinate that is at (0,0,0) in our block system
 
         resolution defines the size of a block, in meters
+
+        storage picks the backend for _map (see lib.storage.STORAGE_BACKENDS)
+        bounds can be used to preallocate the "grid" backend as an inclusive (min, max) pair of blocks
+
+        path_cache_size is the number of find_path results kept around (see lib.pathfinding.PathCache)
+
+        chunk_size is the edge length (in blocks) of the chunks used by find_path's "hierarchical" mode
         """
         super().__init__(center_coords, resolution)
-        self._map = {}
-        self._drone_locations = {} # maps id -> position (Coordinate)
-        self._occupied_blocks = {}
+        if storage not in STORAGE_BACKENDS:
+            raise ValueError(f"unknown map storage {storage}")
+        blocks = STORAGE_BACKENDS[storage](bounds) if bounds != None else STORAGE_BACKENDS[storage]()
+        self._snapshot = MapSnapshot(blocks) # latest published snapshot
+
+        # writers take _write_lock and change _working (an unpublished copy of _snapshot) until the outermost batch
+        # is done. _writer is the thread doing that, which sees its own changes before they're published
+        self._write_lock = threading.RLock()
+        self._working = None
+        self._writer = None
+        self._batch_depth = 0
+        self._dirty = False
+
+        # changes incremental/hierarchical planners haven't been told about yet. they're only queued once published
+        # so that a planner never hears about a change before the snapshot it searches has it
+        self._batch_changes = []
+        self._pending_changes = deque()
+        # the planners keep state between searches, so only one search can use them at a time
+        self._planner_lock = threading.Lock()
+
+        # called with every published snapshot, see add_listener
+        self._listeners = ()
+
+        # maps frozenset(drones_ignoring) -> DStarLite for find_path's "incremental" mode
+        self._incremental_planners = {}
+
+        # maps (start, goal, frozenset(drones_ignoring)) -> _AnytimeSearch for find_path's "anytime" mode, oldest
+        # first. _improving are the ones the background thread (_improver, while it's running) is working on
+        self._anytime_searches = OrderedDict()
+        self._anytime_lock = threading.Lock()
+        self._improving = deque()
+        self._improver = None
+
+        # chunk/entrance data for find_path's "hierarchical" mode, only depends on terrain
+        self.hierarchical_planner = HierarchicalPlanner(
+                lambda a, b: self._snapshot.blocks.box_mask(a, b, Traversability.FREE), chunk_size=chunk_size)
+
+        self.path_cache = PathCache(path_cache_size)
+
+    def snapshot(self) -> MapSnapshot:
+        """
+        get the latest published snapshot of the map, which is safe to hold on to and read from any thread
+        """
+        return self._snapshot
+
+    def _state(self) -> MapSnapshot:
+        """
+        get what the calling thread should see: its own unpublished changes while it's in a batch, else the latest
+        published snapshot
+        """
+        if self._writer == threading.get_ident():
+            return self._working
+        return self._snapshot
+
+    @contextmanager
+    def batch(self):
+        """
+        group changes so that readers see all of them at once
+
+        yields the unpublished MapSnapshot being changed, which gets published when the outermost batch ends. every
+        method that changes the map runs in a batch of its own, so this is only needed to group several of them.
+        only one thread can be in a batch at a time, others wait for it
+        """
+        published = False
+        with self._write_lock:
+            if self._batch_depth == 0:
+                self._working = self._snapshot.thaw()
+                self._writer = threading.get_ident()
+            self._batch_depth += 1
+            try:
+                yield self._working
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    published = self._publish()
+        # after letting go of the map, so that other writers don't wait on the planners (catching up on a big
+        # fill can take a while)
+        if published:
+            # let the planners catch up now unless a search is using them, in which case the next search will
+            if self._planner_lock.acquire(blocking=False):
+                try:
+                    self._catch_up_planners()
+                finally:
+                    self._planner_lock.release()
+
+    def _publish(self) -> bool:
+        """
+        swap in the writer's snapshot (if anything changed) and queue its changes for the planners, returns whether
+        it did
+        """
+        working, changes = self._working, self._batch_changes
+        self._working = None
+        self._writer = None
+        self._batch_changes = []
+        if not self._dirty:
+            # nothing changed, don't bother readers with a new version
+            return False
+        self._dirty = False
+        self._snapshot = working
+        for listener in self._listeners:
+            listener(working, changes)
+        self._pending_changes.extend(changes)
+        return True
+
+    def add_listener(self, listener):
+        """
+        call listener(snapshot, changes) every time a snapshot is published
+
+        changes are what the planners get told about: ("box", a, b) for blocks that fill_map/fill_columns might
+        have changed, ("costs", a, b) for set_speed and ("blocks", [blocks]) around drones/reservations that moved.
+        listeners run on the thread that made the change while it still holds the map, so they should be quick
+        (ex: hand the snapshot off to another thread)
+        """
+        with self._write_lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        with self._write_lock:
+            self._listeners = tuple(i for i in self._listeners if i != listener)
+
+    def _catch_up_planners(self):
+        """
+        tell incremental/hierarchical planners about published changes, needs _planner_lock
+        """
+        while len(self._pending_changes) > 0:
+            change = self._pending_changes.popleft()
+            if change[0] in ["box", "costs"]:
+                _, a, b = change
+                for planner in self._incremental_planners.values():
+                    planner.notify_changed_box(a, b)
+                if change[0] == "box":
+                    self.hierarchical_planner.invalidate_box(a, b)
+            else:
+                for planner in self._incremental_planners.values():
+                    planner.notify_changed(change[1])
+
+    @property
+    def _map(self):
+        return self._state().blocks
+
+    @property
+    def _drone_locations(self):
+        return self._state().drone_locations # maps id -> position (Coordinate)
+
+    @property
+    def _occupied_blocks(self):
+        return self._state().occupied_blocks # maps reserved block -> id
 
     def heightslice(self, a: MapBlockCoord):
         """
@@ -58,39 +469,137 @@ class WorldMap(MapBlockCoordSystem):
 
         the z (alt) component of the coord passed in is ignored
         """
-        r = []
-        for block in self._map:
-            if block[0] == a[0] and block[1] == a[1]:
-                r.append(block)
-        return sorted(r, key=lambda x: x[2])
+        return [(a[0], a[1], z) for z, _ in self._map.column(a[0], a[1])]
+
+    def lowest_reservable_block(self, drone_id: str) -> MapBlockCoord:
+        """
+        get the lowest block above a drone that it could take off into and reserve, None if there isn't one
+
+        only blocks at or above the drone are considered, and the climb can't pass through anything that isn't free
+        or that another drone has reserved. the drone's own block is the exception: a drone sitting on the ground
+        is in the block the ground is in, which lib.terrain.fill_terrain marks BLOCKED, and it can climb out of that
+        """
+        state = self._state()
+        drone_block = state.drone_blocks.get(drone_id, None)
+        if drone_block == None:
+            return None
+        x, y, drone_z = drone_block
+        for z, traversable in state.blocks.column(x, y):
+            if z < drone_z:
+                continue
+            if z == drone_z and traversable == Traversability.BLOCKED:
+                continue
+            if traversable != Traversability.FREE or (x, y, z) in state.occupied_blocks:
+                return None
+            if self.can_reserve_block(drone_id, (x, y, z), skip_adj=True):
+                return (x, y, z)
+        return None
 
     def fill_map(self, a: MapBlockCoord, b: MapBlockCoord, traversable: Traversability):
         """
         fill an area in this map ranging from a -> b with a specific traversability
         """
-        for x in range(a[0], b[0]+1):
-            for y in range(a[1], b[1]+1):
-                for z in range(a[2], b[2]+1):
-                    self._map[x, y, z] = traversable
+        with self.batch() as state:
+            state.own_blocks().fill(a, b, traversable)
+            self._map_changed(state, a, b)
+
+    def fill_columns(self, x0: int, y0: int, tops: np.ndarray, z_low: int, z_high: int, below: Traversability,
+                     above: Traversability=None):
+        """
+        fill whole columns of blocks at once, for loading terrain and the like
+
+        tops is a 2d array where tops[i, j] is the highest block (z) of column (x0+i, y0+j) that gets "below". blocks
+        of a column above that (up to z_high) get "above", unless it's None. columns where tops is nan are left alone
+        only blocks from z_low to z_high are touched
+        """
+        tops = np.asarray(tops, dtype=float)
+        if tops.size == 0 or z_low > z_high:
+            return
+        with self.batch() as state:
+            state.own_blocks().fill_columns(x0, y0, tops, z_low, z_high, below, above)
+            self._map_changed(state, (x0, y0, z_low), (x0+tops.shape[0]-1, y0+tops.shape[1]-1, z_high))
+
+    def set_speed(self, a: MapBlockCoord, b: MapBlockCoord, speed: float):
+        """
+        set how fast drones can fly through the blocks in the box a -> b, relative to cruise speed (see lib.costs)
+
+        ex: 2 for a transit lane, 0.5 for a slow zone around a structure, None to go back to cruise speed
+        """
+        with self.batch() as state:
+            state.own_costs().fill(a, b, speed)
+            self._map_changed(state, a, b, costs=True)
+
+    def set_climb_penalty(self, penalty: float):
+        """
+        set the extra cost (in blocks at cruise speed) of every block of altitude gained or lost
+        """
+        with self.batch() as state:
+            state.own_costs().climb_penalty = penalty
+            # every move up/down costs something different now, incremental planners notice that on their own
+            state.terrain_generation += 1
+            self._dirty = True
+
+    def _map_changed(self, state: MapSnapshot, a: MapBlockCoord, b: MapBlockCoord, costs: bool=False):
+        """
+        let pathfinding know that blocks in the box a -> b might have changed, or only their costs
+        """
+        state.terrain_generation += 1
+        self._dirty = True
+        self._batch_changes.append(("costs" if costs else "box", a, b))
+
+    def _bump_drone_generation(self, state: MapSnapshot, id: str):
+        state.drone_generations[id] = state.drone_generations.get(id, 0) + 1
+        state.occupancy_generation += 1
+        self._dirty = True
+
+    def path_generations(self, drones_ignoring):
+        """
+        get (terrain, occupancy) generations for pathfinding that ignores some drones
+
+        these change whenever fill_map or any drone/reservation not being ignored changes
+        """
+        return self._state().path_generations(drones_ignoring)
+
+    def _notify_planners(self, blocks):
+        """
+        tell incremental planners that pathfinding might treat these blocks differently now (once published)
+        """
+        self._batch_changes.append(("blocks", blocks))
 
     def update_drone(self, id: str, coordinate: Coordinate):
         """
         update a drone's internal position and unreserve blocks as needed
         """
-        self._drone_locations[id] = coordinate
-
         block = self.coord_to_block(coordinate)
-        if self._occupied_blocks.get(block, None) == id:
-            self.unreserve_block(id, block)
+        with self.batch() as state:
+            state.drone_locations[id] = coordinate
+            self._dirty = True
+
+            old_block = state.drone_blocks.get(id, None)
+            if old_block != block:
+                if old_block != None:
+                    _count_adjacent(state.drone_adjacent_counts, old_block, -1)
+                    self._notify_planners(_neighborhood(old_block))
+                _count_adjacent(state.drone_adjacent_counts, block, 1)
+                self._notify_planners(_neighborhood(block))
+                state.drone_blocks[id] = block
+                self._bump_drone_generation(state, id)
+
+            held = state.drone_reservations.get(id, ())
+            if block in held:
+                # the drone is in (and so blocking) this one itself now, and has flown through the ones before it.
+                # it's still making its way through the lease then, so the rest of it lasts another ttl from here
+                expiry = state.lease_expiry.get(id, None)
+                if expiry != None:
+                    expiry = time.monotonic() + state.lease_ttl[id]
+                self._set_reservations(state, id, held[held.index(block)+1:], expiry)
     
     def drone_adjacent_blocks(self):
         """
         get dict mapping each drone's position to all blocks adjacent to that drone
         """
         adjs = {}
-        for id in self._drone_locations:
-            pos = self._drone_locations[id]
-            drone_block = self.coord_to_block(pos)
+        for id, drone_block in self._state().drone_blocks.items():
             adjs[id] = adjacent_blocks(drone_block).keys() | {drone_block}
         return adjs
 
@@ -98,54 +607,58 @@ class WorldMap(MapBlockCoordSystem):
         """
         get block of a given drone
         """
-        if drone_id not in self._drone_locations:
-            return None
-        return self.coord_to_block(self._drone_locations[drone_id])
+        return self._state().drone_blocks.get(drone_id, None)
+
+    def reserved_block(self, drone_id: str) -> MapBlockCoord:
+        """
+        get the block a drone has reserved (the next one, if it has a lease), None if there isn't one
+        """
+        reserved = self._state().drone_reservations.get(drone_id, ())
+        return reserved[0] if len(reserved) > 0 else None
+
+    def reserved_blocks(self, drone_id: str) -> Tuple[MapBlockCoord, ...]:
+        """
+        get every block a drone has reserved, in the order it'll fly through them
+        """
+        return self._state().drone_reservations.get(drone_id, ())
 
     def can_reserve_block(self, drone_id: str, block: MapBlockCoord, skip_adj: bool=False) -> MapBlockCoord:
         """
         see if a drone can reserve a block
         
-        the block must be empty, adjacent, non-reserved, and not adjacent to any reserved blocks for a drone to do so
+        the block must be empty, adjacent, non-reserved, and not adjacent to any other drones for a drone to do so
         """
+        return self.reservation_problem(drone_id, block, skip_adj=skip_adj) == None
+
+    def reservation_problem(self, drone_id: str, block: MapBlockCoord, skip_adj: bool=False) -> str:
+        """
+        same as can_reserve_block, but says why not: "reserved", "not_free", "unknown_drone", "not_adjacent" or
+        "near_drone". None if the block can be reserved
+        """
+        state = self._state()
         # non-reserved
-        if block in self._occupied_blocks:
-            return False
+        if block in state.occupied_blocks:
+            return "reserved"
 
-        # empty/free
-        if block not in self._map:
-            return False
-        if self._map[block] != Traversability.FREE:
-            return False
+        # empty/free (undeclared blocks aren't)
+        if state.blocks.get(block) != Traversability.FREE:
+            return "not_free"
         
         # adjacent to this drone
+        drone_block = state.drone_blocks.get(drone_id, None)
         if not skip_adj:
-            drone_block = self.drone_block(drone_id)
             if drone_block == None:
-                return False # invalid drone
-            adjs = adjacent_blocks(drone_block).keys() | {drone_block}
-            if block not in adjs:
-                return False
+                return "unknown_drone"
+            if not blocks_touch(drone_block, block):
+                return "not_adjacent"
         
-        # free from drones/drone adjacencies
-        drone_adjs = self.drone_adjacent_blocks()
-        for id in drone_adjs:
-            if id == drone_id:
-                continue
-            if block in drone_adjs[id]:
-                return False
-
-        # not adjacent to any already reserved
-        reserved_adjs = set()
-        for reserved_block in self._occupied_blocks:
-            reserved_id = self._occupied_blocks[reserved_block]
-            if reserved_id == drone_id:
-                # technically a drone can't reserve a block if it has already reserved one, but the purpose of this
-                # function is more so to test the possiblity of reservation
-                continue
-            if reserved_block == block:
-                return False
-        return True
+        # free from drones/drone adjacencies (other than this drone's own)
+        adjacent_drones = state.drone_adjacent_counts.get(block, 0)
+        if drone_block != None and blocks_touch(drone_block, block):
+            adjacent_drones -= 1
+        if adjacent_drones > 0:
+            return "near_drone"
+        return None
 
     def reserve_block(self, drone_id: str, block: MapBlockCoord, skip_adj: bool=False) -> bool:
         """
@@ -154,93 +667,303 @@ class WorldMap(MapBlockCoordSystem):
 
         a drone must be adjacent to a block and not have any other reservations to do so
         """
-        if not self.can_reserve_block(drone_id, block, skip_adj=skip_adj):
-            return False
-
-        for block in self._occupied_blocks:
-            if self._occupied_blocks[block] == drone_id:
+        with self.batch() as state:
+            problem = self.reservation_problem(drone_id, block, skip_adj=skip_adj)
+            if problem == None and drone_id in state.drone_reservations:
+                problem = "already_reserved"
+            RESERVATIONS.labels("ok" if problem == None else problem).inc()
+            if problem != None:
                 return False
 
-        self._occupied_blocks[block] = drone_id
-        return True
+            self._set_reservations(state, drone_id, (block,), None)
+            return True
 
     def unreserve_block(self, drone_id: str, block: MapBlockCoord) -> bool:
-        if block not in self._occupied_blocks:
+        with self.batch() as state:
+            if block not in state.occupied_blocks:
+                return False
+            if state.occupied_blocks[block] != drone_id:
+                return False
+            held = state.drone_reservations[drone_id]
+            self._set_reservations(state, drone_id, tuple(i for i in held if i != block),
+                                   state.lease_expiry.get(drone_id, None))
+            return True
+
+    def release_reservations(self, drone_id: str) -> bool:
+        """
+        unreserve every block a drone has reserved, false if it didn't have any
+        """
+        with self.batch() as state:
+            if drone_id not in state.drone_reservations:
+                return False
+            self._set_reservations(state, drone_id, (), None)
+            return True
+
+    def lease_blocks(self, drone_id: str, blocks, ttl: float=LEASE_TTL):
+        """
+        reserve the next blocks of a drone's path all at once, for ttl seconds
+
+        this replaces whatever the drone had reserved before. blocks have to make a path of neighboring blocks
+        starting next to the drone, and as many of them as can be reserved from the start of that path get leased
+        (at most MAX_LEASE_BLOCKS). each one has to be reservable like in can_reserve_block, and since the drone
+        doesn't stop at every block on the way, it also can't touch any other drone's reservations
+
+        update_drone gives back the blocks as the drone flies through them, and expire_leases takes back whatever
+        is left once the ttl runs out. the clock restarts every time the drone makes it into one of the leased
+        blocks (and with a new lease), so ttl only has to cover flying from one block to the next
+
+        returns the blocks that were leased, [] if not even the first one could be
+        """
+        with self.batch() as state:
+            drone_block = state.drone_blocks.get(drone_id, None)
+            if drone_block == None:
+                return []
+            blocks = list(blocks)
+            if len(blocks) > 0 and blocks[0] == drone_block:
+                blocks = blocks[1:]
+            held = state.drone_reservations.get(drone_id, ())
+            leased = []
+            for block in blocks[:MAX_LEASE_BLOCKS]:
+                previous = leased[-1] if len(leased) > 0 else drone_block
+                if block in leased or block == drone_block or not blocks_touch(previous, block):
+                    break
+                if not self._can_lease_block(state, drone_id, block, held):
+                    break
+                leased.append(block)
+            expiry = time.monotonic() + ttl if len(leased) > 0 else None
+            self._set_reservations(state, drone_id, tuple(leased), expiry)
+            if expiry != None:
+                state.lease_ttl[drone_id] = ttl
+            LEASED_BLOCKS.labels("granted").inc(len(leased))
+            LEASED_BLOCKS.labels("refused").inc(min(len(blocks), MAX_LEASE_BLOCKS) - len(leased))
+            return leased
+
+    def _can_lease_block(self, state: MapSnapshot, drone_id: str, block: MapBlockCoord, held) -> bool:
+        if state.occupied_blocks.get(block, drone_id) != drone_id:
             return False
-        if self._occupied_blocks[block] != drone_id:
+        if state.blocks.get(block) != Traversability.FREE:
             return False
-        del self._occupied_blocks[block]
-        return True
+        adjacent_drones = state.drone_adjacent_counts.get(block, 0)
+        if blocks_touch(state.drone_blocks[drone_id], block):
+            adjacent_drones -= 1
+        if adjacent_drones > 0:
+            return False
+        # the drone's own reservations are counted too, take those back out
+        adjacent_reserved = state.reserved_adjacent_counts.get(block, 0)
+        adjacent_reserved -= sum(1 for i in held if blocks_touch(i, block))
+        return adjacent_reserved <= 0
+
+    def expire_leases(self, now: float=None):
+        """
+        unreserve the blocks of every lease whose ttl has run out, meant to be called every so often
 
-    def find_path(self, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring):
+        returns the ids of the drones that lost their leases
+        """
+        if now == None:
+            now = time.monotonic()
+        # checking the published snapshot first, so that there's no new version when nothing expired
+        if not any(expiry <= now for expiry in self._snapshot.lease_expiry.values()):
+            return []
+        with self.batch() as state:
+            expired = [id for id, expiry in state.lease_expiry.items() if expiry <= now]
+            for id in expired:
+                self._set_reservations(state, id, (), None)
+            EXPIRED_LEASES.inc(len(expired))
+            return expired
+
+    def _set_reservations(self, state: MapSnapshot, drone_id: str, blocks, expiry: float):
+        """
+        make blocks (a tuple) everything a drone has reserved, expiring at expiry (None for never)
+        """
+        old = state.drone_reservations.get(drone_id, ())
+        if old == blocks and state.lease_expiry.get(drone_id, None) == expiry:
+            return
+        for block in old:
+            if block not in blocks:
+                del state.occupied_blocks[block]
+                _count_adjacent(state.reserved_adjacent_counts, block, -1)
+                self._notify_planners(_neighborhood(block))
+        for block in blocks:
+            if block not in old:
+                state.occupied_blocks[block] = drone_id
+                _count_adjacent(state.reserved_adjacent_counts, block, 1)
+                self._notify_planners(_neighborhood(block))
+
+        if len(blocks) > 0:
+            state.drone_reservations[drone_id] = blocks
+        else:
+            state.drone_reservations.pop(drone_id, None)
+        if expiry != None and len(blocks) > 0:
+            state.lease_expiry[drone_id] = expiry
+        else:
+            state.lease_expiry.pop(drone_id, None)
+            state.lease_ttl.pop(drone_id, None)
+
+        if set(old) != set(blocks):
+            self._bump_drone_generation(state, drone_id)
+        else:
+            self._dirty = True
+
+    def find_path(self, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring, stats: dict=None,
+                  mode: str="astar", smooth: bool=False, budget: float=None, max_expansions: int=None,
+                  background: bool=False):
         """
         find an optimal path from block "a" to block "b" avoiding any obstacles/adjacent-to-drone blocks
 
-        this implements a version of dijkstra's algorithm so that we can easily add higher speed blocks later
+        mode picks the search (see PATH_MODES):
+            "astar" -- plain a* (see lib.pathfinding) from scratch every call
+            "incremental" -- d* lite, keeping a search per set of drones_ignoring (so, per drone) that gets
+                             repaired when fill_map/drones/reservations change instead of searching again
+            "hierarchical" -- search between chunk entrances first, then a* inside the chunks on that route (see
+                              lib.hierarchical). much faster over long distances, but paths can be slightly longer
+            "jps" -- jump point search, same paths as a* and far fewer expansions, but the blocks it looks at while
+                     jumping make it slower than "astar" on most of our maps (see bench/jps.py). opt-in only, it
+                     only pays off on big open maps with walls in the way
+            "anytime" -- ara* (see lib.pathfinding.AnytimeAstar), the best path it finds in budget seconds and/or
+                         max_expansions blocks (optimal without either). stats["bound"] says how far from optimal
+                         it can be, stats["done"] if it's optimal. asking again for the same path (same a, b and
+                         drones_ignoring, on the same map) picks the search back up from where it stopped, and with
+                         background it keeps improving for ANYTIME_BACKGROUND seconds after returning
+
+        paths are the fastest ones given the map's speeds and climb penalty (see set_speed/set_climb_penalty), which
+        is the shortest one until those are set. "hierarchical" and "jps" only work on distances, so they do an
+        "astar" search instead once they are
         
-        returns [path] if possible, else None
+        the search runs on the latest snapshot, so it doesn't hold anyone else up. "incremental" and "hierarchical"
+        keep state between searches though, so only one search in those modes runs at a time
+        results are cached in path_cache until the map or a drone that isn't being ignored changes
 
-        TODO this should probably be d* and/or something with caching
-        """
-        dists = {a: 0}
-        paths = {a: None}
-        blocks_to_traverse = [a]
+        returns [path] if possible, else None (in "anytime" mode, also if it ran out of budget before finding one)
+        stats (if given) is filled in with search statistics (ex: "expansions", "cached")
 
-        drone_occupied = set()
-        drone_adj = self.drone_adjacent_blocks()
-        for id in drone_adj:
-            blocks = drone_adj[id]
-            if id in drones_ignoring: 
+        with smooth, the path gets shortened to straight segments between blocks that can see each other, and
+        (waypoints, segments) is returned instead (see lib.pathfinding.smooth_path)
+        """
+        if mode not in PATH_MODES:
+            raise ValueError(f"unknown pathfinding mode {mode}")
+        t_start = time.perf_counter()
+        if stats == None:
+            stats = {}
+        expansions_before = stats.get("expansions", 0)
+        if mode == "anytime":
+            state = self._state()
+            path = self._find_path_anytime(state, a, b, drones_ignoring, stats, budget, max_expansions, background)
+        elif mode in ["incremental", "hierarchical"]:
+            with self._planner_lock:
+                self._catch_up_planners()
+                state = self._state()
+                path = self._find_path(state, a, b, drones_ignoring, stats, mode)
+        else:
+            state = self._state()
+            path = self._find_path(state, a, b, drones_ignoring, stats, mode)
+        record_pathfind(mode, stats, expansions_before, time.perf_counter() - t_start, path)
+        if not smooth:
+            return path
+        return smooth_path(path, state.passable_func(drones_ignoring), state.costs)
+
+    def _find_path(self, state: MapSnapshot, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring, stats: dict,
+                   mode: str):
+        generations = state.path_generations(drones_ignoring)
+        cached, path = self.path_cache.get(a, b, drones_ignoring, mode, generations)
+        if stats != None:
+            stats["cached"] = cached
+        if cached:
+            return path
+        path = self._search_path(state, a, b, drones_ignoring, stats, mode)
+        self.path_cache.put(a, b, drones_ignoring, mode, generations, path)
+        return path
+
+    def _find_path_anytime(self, state: MapSnapshot, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring,
+                           stats: dict, budget: float, max_expansions: int, background: bool):
+        # the path cache is skipped, the path can get better every time this is asked
+        deadline = None if budget == None else time.perf_counter() + budget
+        key = (a, b, frozenset(drones_ignoring))
+        generations = state.path_generations(drones_ignoring)
+        with self._anytime_lock:
+            entry = self._anytime_searches.get(key, None)
+            if entry == None or entry.generations != generations:
+                costs = state.costs if state.costs.weighted else None
+                search = AnytimeAstar(a, b, state.passable_func(drones_ignoring), costs=costs)
+                entry = _AnytimeSearch(search, key[2], generations)
+                self._anytime_searches[key] = entry
+            self._anytime_searches.move_to_end(key)
+            while len(self._anytime_searches) > ANYTIME_KEEP:
+                self._anytime_searches.popitem(last=False)
+        with entry.lock:
+            path = entry.search.improve(max_expansions, deadline, stats)
+            stats["bound"] = entry.search.bound
+            stats["done"] = entry.search.done
+        if background and not entry.search.done:
+            self._improve_later(entry)
+        return None if path == None else list(path)
+
+    def _improve_later(self, entry):
+        entry.until = time.monotonic() + ANYTIME_BACKGROUND
+        with self._anytime_lock:
+            if entry not in self._improving:
+                self._improving.append(entry)
+            if self._improver == None:
+                self._improver = threading.Thread(target=self._improve_in_background, daemon=True)
+                self._improver.start()
+
+    def _improve_in_background(self):
+        # a slice of every search in _improving in turn, until they're all optimal, out of time or out of date
+        while True:
+            with self._anytime_lock:
+                if len(self._improving) == 0:
+                    self._improver = None
+                    return
+                entry = self._improving.popleft()
+            if time.monotonic() > entry.until:
                 continue
-            drone_occupied |= blocks
-
-        reserved = set()
-        for block in self._occupied_blocks:
-            if self._occupied_blocks[block] in drones_ignoring:
+            if self._snapshot.path_generations(entry.drones_ignoring) != entry.generations:
                 continue
-            reserved |= adjacent_blocks(block).keys() | {block}
-
-        while len(blocks_to_traverse) > 0:
-            # treat as priority queue for dijk
-            # blocks_to_traverse = sorted(blocks_to_traverse, key=lambda x: dists[x]) # dijk
-            blocks_to_traverse = sorted(blocks_to_traverse, key=lambda x: math.hypot(b[0]-x[0], b[1]-x[1], b[2]-x[2])) # a*
-
-            block = blocks_to_traverse[0]
-            adj_block_dist = adjacent_blocks(block)
-            for adj in adj_block_dist:
-                if adj not in self._map:
-                    # undeclared space, considered illegal
-                    continue
-                if self._map[adj] != Traversability.FREE:
-                    # unavailable block
-                    continue
-                if adj in drone_occupied or adj in reserved:
-                    continue
-                
-                d_metric = adj_block_dist[adj]
-                dist = dists[block] + d_metric # TODO update when introducing speed!
-                if adj in dists and dist < dists[adj]:
-                    paths[adj] = block
-                    dists[adj] = dist
-                if adj not in dists:
-                    paths[adj] = block
-                    dists[adj] = dist
-                    blocks_to_traverse.append(adj)
-    
-            if block == b:
-                break
-            blocks_to_traverse.pop(0)
-        
-        if b not in paths:
-            # impossible to get to, rip
-            return None
+            with entry.lock:
+                entry.search.improve(max_expansions=ANYTIME_SLICE)
+            if not entry.search.done:
+                with self._anytime_lock:
+                    self._improving.append(entry)
+
+    def _search_path(self, state: MapSnapshot, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring, stats: dict,
+                     mode: str):
+        _passable = state.passable_func(drones_ignoring)
+        costs = state.costs if state.costs.weighted else None
+        if costs != None and mode in ["hierarchical", "jps"]:
+            mode = "astar"
+
+        if mode == "astar":
+            return astar(a, b, _passable, stats=stats, costs=costs)
+        if mode == "incremental":
+            key = frozenset(drones_ignoring)
+            planner = self._incremental_planners.get(key, None)
+            if planner == None or planner.goal != b:
+                planner = DStarLite(b)
+                self._incremental_planners[key] = planner
+            return planner.plan(a, _passable, stats=stats, costs=costs)
+        if mode == "hierarchical":
+            return self.hierarchical_planner.find_path(a, b, _passable, stats=stats)
+        if mode == "jps":
+            return jps(a, b, _passable, stats=stats)
+
+    def plan_batch(self, goals, max_steps: int=None, stats: dict=None):
+        """
+        plan paths for several drones at once so that they never get in each other's way (see lib.cooperative)
 
-        path = []
-        curr = b
-        while curr != a:
-            path = [curr] + path
-            curr = paths[curr]
-        return [a] + path
+        goals maps drone id -> target block, in priority order. drones in the batch are planned against each
+        other's paths over time, drones not in the batch (and their reservations) are avoided like in find_path.
+        a path is [(block, timestep)], where a drone moves by at most one block (or waits) per timestep
+
+        returns {id: [path] or None}
+        stats (if given) gets the total number of expanded (block, timestep) states under "expansions"
+        """
+        state = self._state()
+        _passable = state.passable_func(goals.keys())
+
+        paths = {id: None for id in goals if state.drone_blocks.get(id, None) == None}
+        starts = {id: state.drone_blocks[id] for id in goals if id not in paths}
+        paths.update(plan_cooperatively(starts, {id: goals[id] for id in starts}, _passable, max_steps=max_steps,
+                                        stats=stats))
+        return paths
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+"""
+counters, gauges and histograms for seeing where the ground station spends its time, served as text on /metrics
+(the prometheus text format, so a prometheus server can scrape it, but it's readable as is too)
+
+metrics are made once at import time and kept in REGISTRY, ex:
+
+    PATHFIND_SECONDS = histogram("ground_pathfind_seconds", "time spent in find_path", ["mode"])
+    PATHFIND_SECONDS.labels("astar").observe(elapsed)
+
+updating one is a dict lookup and a short lock, so they can stay on all the time. set enabled = False to skip all
+of it (ex: to measure what it costs)
+"""
+
+import bisect
+import math
+import threading
+import time
+
+enabled = True
+
+# seconds, for things from a reservation (~10us) to a big pathfind/kml render (~10s)
+TIME_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30]
+# for counts that grow by orders of magnitude, ex: search expansions
+COUNT_BUCKETS = [10, 100, 1000, 10000, 100000, 1000000]
+
+class _Metric:
+    """
+    a metric and its values for every combination of label values seen so far
+
+    new_child() makes the value kept for a new combination of label values (ex: _Value for counters)
+    """
+
+    kind = None
+
+    def __init__(self, name: str, help: str, labels, new_child):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._new_child = new_child
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        get the metric for these label values (in the order the label names were given)
+        """
+        child = self._children.get(values, None)
+        if child == None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} has labels {self.label_names}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _label_str(self, values, extra: str="") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra != "":
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+    def samples(self):
+        """
+        get [(name with labels, value)] for the text format
+        """
+        return [(self.name + self._label_str(values), child.value) for values, child in list(self._children.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name} {_format(value)}" for name, value in self.samples()]
+        return "\n".join(lines)
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float=1):
+        if not enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        if not enabled:
+            return
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels, _Value)
+
+    def inc(self, amount: float=1):
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    """
+    a value that goes up and down. set_function() makes it get its values when it's read instead
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels, _Value)
+        self._func = None
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, func):
+        """
+        func() gives {(label values): value} (or just a number if there are no labels) every time this is read
+        """
+        self._func = func
+
+    def samples(self):
+        if self._func == None:
+            return super().samples()
+        values = self._func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name + self._label_str(labels), value) for labels, value in values.items()]
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if not enabled:
+            return
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """
+        observe how long a with block takes
+        """
+        return _Timer(self)
+
+class _Timer:
+    def __init__(self, histogram: _HistogramValue):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=TIME_BUCKETS):
+        self.buckets = list(buckets)
+        super().__init__(name, help, labels, lambda: _HistogramValue(self.buckets))
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        samples = []
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format(bound)
+                samples.append((f"{self.name}_bucket" + self._label_str(values, f'le="{le}"'), cumulative))
+            samples.append((f"{self.name}_sum" + self._label_str(values), total))
+            samples.append((f"{self.name}_count" + self._label_str(values), cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"there's already a metric called {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        every metric in the text format
+        """
+        return "\n".join(metric.render() for metric in list(self._metrics.values())) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labels=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+def gauge(name: str, help: str, labels=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labels))
+
+def histogram(name: str, help: str, labels=(), buckets=TIME_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,787 @@
+"""
+search engines used by WorldMap for pathfinding
+
+everything in here works on plain block coords and a `passable` callback so that it doesn't care how the map is
+stored or which drones/reservations are being avoided
+"""
+
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from lib.util import *
+
+SQRT2 = math.sqrt(2)
+SQRT3 = math.sqrt(3)
+
+# DStarLite keeps its costs as integers in these units (1 block = COST_SCALE) so that keys compare exactly. with
+# floats, sums of sqrt distances that should tie don't always, and that leaves stale blocks on the path
+COST_SCALE = 1000000
+_SCALED_NEIGHBOR_OFFSETS = [(dx, dy, dz, round(d * COST_SCALE)) for dx, dy, dz, d in NEIGHBOR_OFFSETS]
+_SCALED_1, _SCALED_2, _SCALED_3 = [round(i * COST_SCALE) for i in (1, SQRT2, SQRT3)]
+
+def octile_distance(a: MapBlockCoord, b: MapBlockCoord) -> float:
+    """
+    length of the shortest 26-connected path between two blocks if nothing is in the way
+
+    this never overestimates, so it's an admissible (and consistent) heuristic for a*
+    """
+    d_low, d_mid, d_high = sorted((abs(a[0]-b[0]), abs(a[1]-b[1]), abs(a[2]-b[2])))
+    return (SQRT3 - SQRT2) * d_low + (SQRT2 - 1) * d_mid + d_high
+
+def scaled_octile_distance(a: MapBlockCoord, b: MapBlockCoord) -> int:
+    """
+    octile_distance in COST_SCALE units, using the same rounded step costs as the search
+    """
+    d_low, d_mid, d_high = sorted((abs(a[0]-b[0]), abs(a[1]-b[1]), abs(a[2]-b[2])))
+    return (_SCALED_3 - _SCALED_2) * d_low + (_SCALED_2 - _SCALED_1) * d_mid + _SCALED_1 * d_high
+
+def reconstruct_path(parents: dict, goal: MapBlockCoord) -> List[MapBlockCoord]:
+    path = []
+    curr = goal
+    while curr != None:
+        path.append(curr)
+        curr = parents[curr]
+    path.reverse()
+    return path
+
+def astar(start: MapBlockCoord, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+          stats: dict=None, costs=None) -> Optional[List[MapBlockCoord]]:
+    """
+    a* over the 26-connected block grid using a binary heap and a closed set
+
+    blocks are ordered by f = g + h with h being the octile distance to the goal.
+    passable(block) decides if a block can be moved into, the start block is always allowed.
+    costs (a lib.costs.CostLayer) makes moves cost flight time instead of distance, using its heuristic
+
+    returns [path] (including start and goal) if possible, else None
+    stats (if given) gets the number of expanded blocks added under "expansions"
+    """
+    h = octile_distance
+    step_cost = None
+    if costs != None and costs.weighted:
+        h = costs.heuristic
+        step_cost = costs.step_cost
+    dists = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+    # (f, -g, block) -- ties go to the deeper block, which cuts expansions a lot on open maps
+    blocks_to_traverse = [(h(start, goal), -0.0, start)]
+    expansions = 0
+    path = None
+
+    while len(blocks_to_traverse) > 0:
+        _, neg_dist, block = heapq.heappop(blocks_to_traverse)
+        if block in closed:
+            # stale heap entry, a shorter route was found after this was pushed
+            continue
+        if block == goal:
+            path = reconstruct_path(parents, goal)
+            break
+        closed.add(block)
+        expansions += 1
+
+        dist = -neg_dist
+        x, y, z = block
+        for dx, dy, dz, d_metric in NEIGHBOR_OFFSETS:
+            adj = (x+dx, y+dy, z+dz)
+            if adj in closed:
+                continue
+            adj_dist = dist + (d_metric if step_cost == None else step_cost(adj, dz, d_metric))
+            if adj_dist >= dists.get(adj, math.inf):
+                continue
+            if not passable(adj):
+                continue
+            dists[adj] = adj_dist
+            parents[adj] = block
+            heapq.heappush(blocks_to_traverse, (adj_dist + h(adj, goal), -adj_dist, adj))
+
+    if stats != None:
+        stats["expansions"] = stats.get("expansions", 0) + expansions
+    return path
+
+# ara* (see AnytimeAstar): how much the heuristic gets inflated by at first, and by how much less every repair
+ANYTIME_EPSILON = 2.0
+ANYTIME_EPSILON_STEP = 0.5
+
+class AnytimeAstar:
+    """
+    ara* (anytime repairing a*): weighted a* with the heuristic inflated by epsilon finds a path quickly, then the
+    search gets repaired with smaller and smaller epsilons (reusing everything it already expanded) until epsilon
+    is 1 and the path is optimal
+
+    every path comes with a bound on how suboptimal it is: it costs at most bound times the optimal path. the bound
+    is usually well under epsilon
+
+    improve() searches until it runs out of budget and can be called again to keep going. moves are the same as
+    astar's, passable/costs have to stay the same for as long as the search is used
+    """
+
+    def __init__(self, start: MapBlockCoord, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+                 costs=None, epsilon: float=ANYTIME_EPSILON):
+        self.start = start
+        self.goal = goal
+        self._passable = passable
+        self._h = octile_distance
+        self._step_cost = None
+        if costs != None and costs.weighted:
+            self._h = costs.heuristic
+            self._step_cost = costs.step_cost
+        self.epsilon = max(epsilon, 1.0)
+        self._dists = {start: 0.0}
+        self._parents = {start: None}
+        self._open = {start: 0.0} # maps block -> dist it was queued with
+        self._incons = {} # closed blocks that got cheaper during this repair, queued again for the next one
+        self._closed = set()
+        # (dist + epsilon * h, -dist, block), entries that don't match _open are stale
+        self._queue = [(self.epsilon * self._h(start, goal), -0.0, start)]
+        self._repairing = True
+        self.path = None # best path found so far
+        self.bound = math.inf # its suboptimality bound
+        self.done = False # path is optimal, or there isn't one
+
+    def _repair(self, max_expansions: int, deadline: float):
+        """
+        expand blocks until none in the queue could lead to a cheaper path to the goal (with this epsilon)
+
+        returns (finished, expansions)
+        """
+        queue = self._queue
+        open = self._open
+        dists = self._dists
+        parents = self._parents
+        closed = self._closed
+        incons = self._incons
+        passable = self._passable
+        step_cost = self._step_cost
+        h = self._h
+        goal = self.goal
+        epsilon = self.epsilon
+        expansions = 0
+        while True:
+            while len(queue) > 0 and open.get(queue[0][2], None) != -queue[0][1]:
+                heapq.heappop(queue)
+            if len(queue) == 0 or dists.get(goal, math.inf) <= queue[0][0]:
+                return True, expansions
+            if max_expansions != None and expansions >= max_expansions:
+                return False, expansions
+            # the clock is slow to read compared to an expansion
+            if deadline != None and expansions % 32 == 0 and time.perf_counter() >= deadline:
+                return False, expansions
+
+            _, neg_dist, block = heapq.heappop(queue)
+            del open[block]
+            closed.add(block)
+            expansions += 1
+
+            dist = -neg_dist
+            x, y, z = block
+            for dx, dy, dz, d_metric in NEIGHBOR_OFFSETS:
+                adj = (x+dx, y+dy, z+dz)
+                adj_dist = dist + (d_metric if step_cost == None else step_cost(adj, dz, d_metric))
+                if adj_dist >= dists.get(adj, math.inf):
+                    continue
+                if not passable(adj):
+                    continue
+                dists[adj] = adj_dist
+                parents[adj] = block
+                if adj in closed:
+                    incons[adj] = adj_dist
+                else:
+                    open[adj] = adj_dist
+                    heapq.heappush(queue, (adj_dist + epsilon * h(adj, goal), -adj_dist, adj))
+
+    def _publish(self):
+        # the path this repair found, and how far from optimal it can be: the goal's cost over the lowest cost any
+        # path through a block still waiting to be expanded could have
+        goal_dist = self._dists.get(self.goal, math.inf)
+        if goal_dist == math.inf:
+            return
+        self.path = reconstruct_path(self._parents, self.goal)
+        lowest = min([dist + self._h(block, self.goal) for block, dist in self._open.items()]
+                     + [dist + self._h(block, self.goal) for block, dist in self._incons.items()], default=math.inf)
+        if goal_dist <= lowest:
+            self.bound = 1.0
+        else:
+            self.bound = min(self.epsilon, goal_dist / lowest) if lowest > 0 else self.epsilon
+
+    def improve(self, max_expansions: int=None, deadline: float=None, stats: dict=None):
+        """
+        keep searching until the path is optimal, max_expansions blocks have been expanded or time.perf_counter()
+        reaches deadline
+
+        returns the best path so far (None if there isn't one yet or at all, see done)
+        stats (if given) gets the number of expanded blocks added under "expansions"
+        """
+        expansions = 0
+        while not self.done:
+            if self._repairing:
+                budget = None if max_expansions == None else max_expansions - expansions
+                finished, n = self._repair(budget, deadline)
+                expansions += n
+                if not finished:
+                    break
+                self._repairing = False
+                self._publish()
+                if self.path == None or self.epsilon == 1.0 or self.bound <= 1.0:
+                    self.done = True
+                    if self.path != None:
+                        self.bound = 1.0
+                    break
+            # lower epsilon and start the next repair from everything still queued plus the blocks that got cheaper
+            self.epsilon = max(self.epsilon - ANYTIME_EPSILON_STEP, 1.0)
+            self._open.update(self._incons)
+            self._incons = {}
+            self._closed = set()
+            self._queue = [(dist + self.epsilon * self._h(block, self.goal), -dist, block)
+                           for block, dist in self._open.items()]
+            heapq.heapify(self._queue)
+            self._repairing = True
+        if stats != None:
+            stats["expansions"] = stats.get("expansions", 0) + expansions
+        return self.path
+
+def _sign(i: int) -> int:
+    return (i > 0) - (i < 0)
+
+def _jps_tables():
+    """
+    for every direction d a block can be entered from, get
+        natural -- [d'] directions that stay worth searching with nothing in the way (d and its sub-directions, ex:
+                   (1, 1, 0) -> (1, 1, 0), (1, 0, 0), (0, 1, 0))
+        forced -- [(s, [m])] the other directions m, which are only worth searching if block s (relative to the
+                  current block) is in the way. s is the first step of the path from the previous block towards
+                  block + m that doesn't go through the current block
+    """
+    natural = {}
+    forced = {}
+    for dx, dy, dz, _ in NEIGHBOR_OFFSETS:
+        d = (dx, dy, dz)
+        subs = [(sx, sy, sz) for sx in {0, dx} for sy in {0, dy} for sz in {0, dz}
+                if (sx, sy, sz) not in [(0, 0, 0), d]]
+        natural[d] = [d] + subs
+        by_side = {}
+        for mx, my, mz, _ in NEIGHBOR_OFFSETS:
+            m = (mx, my, mz)
+            if m in natural[d]:
+                continue
+            s = tuple(_sign(mi + di) - di for mi, di in zip(m, d))
+            if s != (0, 0, 0):
+                by_side.setdefault(s, []).append(m)
+        forced[d] = list(by_side.items())
+    return natural, forced
+
+_JPS_NATURAL, _JPS_FORCED = _jps_tables()
+
+# how far a single jump goes before stopping anyway. in 3d, unbounded jumps out of the start sweep most of the open
+# space around it before anything gets expanded. stopping early is always safe (any block can be a jump point), and
+# jump points heading away from the goal then just sit in the queue
+JPS_MAX_JUMP = 8
+
+def jps(start: MapBlockCoord, goal: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+        stats: dict=None, max_jump: int=JPS_MAX_JUMP) -> Optional[List[MapBlockCoord]]:
+    """
+    jump point search over the 26-connected block grid, for maps where every move costs its length
+
+    instead of pushing every neighbor, the search "jumps" along straight and diagonal lines and only stops at blocks
+    where something in the way forces a turn (or at the goal). the paths are as short as astar's, but far fewer
+    blocks get expanded in open space. in 3d every step of a diagonal jump also jumps along the lines it's made of,
+    so far more blocks get looked at than expanded, and it's usually slower than astar (ex: the ground corridor).
+    nothing uses it unless asked to
+
+    max_jump caps how many blocks a jump goes before stopping anyway (see JPS_MAX_JUMP)
+
+    returns [path] like astar (every block, not just the jump points) if possible, else None
+    stats (if given) gets the number of expanded jump points added under "expansions" and blocks looked at while
+    jumping under "jump_steps"
+    """
+    h = octile_distance
+    dists = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+    jump_points = [(h(start, goal), -0.0, start)]
+    expansions = 0
+    steps = [0]
+    path = None
+    # jumps keep looking at the same blocks beside them, so remember what passable said
+    known = {}
+
+    def _free(block):
+        free = known.get(block, None)
+        if free == None:
+            free = known[block] = passable(block)
+        return free
+
+    def _forced(block, d):
+        x, y, z = block
+        for (sx, sy, sz), ms in _JPS_FORCED[d]:
+            if not _free((x+sx, y+sy, z+sz)):
+                for mx, my, mz in ms:
+                    if _free((x+mx, y+my, z+mz)):
+                        return True
+        return False
+
+    def _jump(block, d):
+        """
+        follow direction d from block, returning the next jump point (None if there isn't one)
+        """
+        dx, dy, dz = d
+        subs = _JPS_NATURAL[d][1:]
+        x, y, z = block
+        for i in range(max_jump):
+            x, y, z = x+dx, y+dy, z+dz
+            block = (x, y, z)
+            steps[0] += 1
+            if not _free(block):
+                return None
+            if block == goal or _forced(block, d) or i == max_jump-1:
+                return block
+            # diagonal moves also stop wherever one of the lines they're made of finds something
+            for sub in subs:
+                if _jump(block, sub) != None:
+                    return block
+
+    while len(jump_points) > 0:
+        _, neg_dist, block = heapq.heappop(jump_points)
+        if block in closed:
+            continue
+        if block == goal:
+            path = reconstruct_path(parents, goal)
+            break
+        closed.add(block)
+        expansions += 1
+
+        parent = parents[block]
+        if parent == None:
+            directions = [(dx, dy, dz) for dx, dy, dz, _ in NEIGHBOR_OFFSETS]
+        else:
+            d = tuple(_sign(i - j) for i, j in zip(block, parent))
+            directions = list(_JPS_NATURAL[d])
+            x, y, z = block
+            for (sx, sy, sz), ms in _JPS_FORCED[d]:
+                if not _free((x+sx, y+sy, z+sz)):
+                    directions.extend(ms)
+
+        dist = -neg_dist
+        for d in directions:
+            adj = _jump(block, d)
+            if adj == None or adj in closed:
+                continue
+            adj_dist = dist + octile_distance(block, adj)
+            if adj_dist >= dists.get(adj, math.inf):
+                continue
+            dists[adj] = adj_dist
+            parents[adj] = block
+            heapq.heappush(jump_points, (adj_dist + h(adj, goal), -adj_dist, adj))
+
+    if stats != None:
+        stats["expansions"] = stats.get("expansions", 0) + expansions
+        stats["jump_steps"] = stats.get("jump_steps", 0) + steps[0]
+    if path == None:
+        return None
+    # fill in the straight/diagonal runs between jump points
+    full_path = [path[0]]
+    for a, b in zip(path, path[1:]):
+        d = tuple(_sign(j - i) for i, j in zip(a, b))
+        while full_path[-1] != b:
+            full_path.append(tuple(i + di for i, di in zip(full_path[-1], d)))
+    return full_path
+
+def line_crossings(a: MapBlockCoord, b: MapBlockCoord):
+    """
+    blocks that the straight line between the centers of a and b goes through, in order (a and b included), as
+    [(block, t)] where t is how far along the line (0 -> 1) it enters the block
+
+    where the line crosses an edge or corner of a block exactly, it steps diagonally like a move between neighbors
+    does, so the blocks always make a path of neighboring blocks. crossings are compared as exact fractions
+    """
+    n = [abs(j - i) for i, j in zip(a, b)]
+    d = [_sign(j - i) for i, j in zip(a, b)]
+    crossed = [0, 0, 0]
+    block = list(a)
+    blocks = [(a, 0.0)]
+    while crossed != n:
+        # the line crosses its k-th boundary along axis i at t = (2k+1) / (2 n[i])
+        nearest = None
+        axes = []
+        for i in range(3):
+            if crossed[i] == n[i]:
+                continue
+            t = (2*crossed[i] + 1, 2*n[i])
+            if nearest == None or t[0] * nearest[1] < nearest[0] * t[1]:
+                nearest = t
+                axes = [i]
+            elif t[0] * nearest[1] == nearest[0] * t[1]:
+                axes.append(i)
+        for i in axes:
+            crossed[i] += 1
+            block[i] += d[i]
+        blocks.append((tuple(block), nearest[0] / nearest[1]))
+    return blocks
+
+def line_blocks(a: MapBlockCoord, b: MapBlockCoord) -> List[MapBlockCoord]:
+    """
+    see line_crossings, just the blocks
+    """
+    return [block for block, _ in line_crossings(a, b)]
+
+def line_cost(a: MapBlockCoord, b: MapBlockCoord, costs) -> float:
+    """
+    cost of flying straight from a to b with a lib.costs.CostLayer, going by how much of the line is in each block
+    """
+    crossings = line_crossings(a, b)
+    length = math.dist(a, b)
+    total = costs.climb_penalty * abs(b[2] - a[2])
+    for (block, t), (_, t_next) in zip(crossings, crossings[1:] + [(None, 1.0)]):
+        total += (t_next - t) * length * costs.cost(block)
+    return total
+
+def smooth_path(path: List[MapBlockCoord], passable: Callable[[MapBlockCoord], bool], costs=None):
+    """
+    shorten a path by flying straight between blocks that can see each other (line of sight shortcutting)
+
+    starting from the first block, the path is followed for as long as the straight line from there only goes
+    through passable blocks, and the last block that worked becomes the next waypoint. with a lib.costs.CostLayer,
+    a shortcut also can't cost more than the part of the path it replaces (see line_cost)
+
+    returns (waypoints, segments), where segments[i] is line_blocks(waypoints[i], waypoints[i+1]): every block
+    flying that segment goes through. None if path is None
+    """
+    if path == None:
+        return None
+    if costs != None and not costs.weighted:
+        costs = None
+    waypoints = [path[0]]
+    segments = []
+    anchor = 0
+    while anchor < len(path) - 1:
+        end = anchor + 1
+        segment = path[anchor:anchor+2]
+        for j in range(anchor + 2, len(path)):
+            line = line_blocks(path[anchor], path[j])
+            if not all(passable(block) for block in line[1:]):
+                break
+            if costs != None and line_cost(path[anchor], path[j], costs) > costs.path_cost(path[anchor:j+1]) + 1e-9:
+                break
+            end, segment = j, line
+        waypoints.append(path[end])
+        segments.append(segment)
+        anchor = end
+    return waypoints, segments
+
+class PathCache:
+    """
+    lru cache of found paths keyed on (start, goal, ignored drones, mode, generations)
+
+    generations should change whenever anything the search looked at does, so stale entries just stop getting hit
+    and fall out the back. "no path" results are cached too.
+
+    a query that misses on its exact key can still hit when its start block is somewhere along a cached path with
+    the same goal/ignored drones/mode/generations, since the rest of an optimal path is optimal from there too
+
+    searches run on several threads at once, so everything goes through a lock
+    """
+
+    def __init__(self, capacity: int=256):
+        self._capacity = capacity
+        self._entries = OrderedDict() # key -> path (or None)
+        self._routes = {} # (goal, ignored, mode, generations) -> set of keys with a path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, start: MapBlockCoord, goal: MapBlockCoord, drones_ignoring, mode: str, generations):
+        """
+        returns (True, path) on a hit, where path can be None for cached failures, else (False, None)
+        """
+        route = (goal, frozenset(drones_ignoring), mode, generations)
+        key = (start,) + route
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                path = self._entries[key]
+                return True, None if path == None else list(path)
+
+            for cached_key in self._routes.get(route, ()):
+                path = self._entries[cached_key]
+                if start in path:
+                    self._entries.move_to_end(cached_key)
+                    self.suffix_hits += 1
+                    return True, path[path.index(start):]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, start: MapBlockCoord, goal: MapBlockCoord, drones_ignoring, mode: str, generations, path):
+        route = (goal, frozenset(drones_ignoring), mode, generations)
+        key = (start,) + route
+        with self._lock:
+            self._entries[key] = None if path == None else list(path)
+            self._entries.move_to_end(key)
+            if path != None:
+                self._routes.setdefault(route, set()).add(key)
+            while len(self._entries) > self._capacity:
+                old_key, _ = self._entries.popitem(last=False)
+                old_route = old_key[1:]
+                if old_route in self._routes:
+                    self._routes[old_route].discard(old_key)
+                    if len(self._routes[old_route]) == 0:
+                        del self._routes[old_route]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._routes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                    "size": len(self._entries),
+                    "capacity": self._capacity,
+                    "hits": self.hits,
+                    "suffix_hits": self.suffix_hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    }
+
+class DStarLite:
+    """
+    incremental planner (d* lite) that keeps its search state between calls
+
+    the search runs backwards from the goal, so the start block can move along the path between calls. when blocks
+    change passability (or cost) the planner gets told about them (notify_changed/notify_changed_box) and only
+    repairs the part of the search those blocks affect on the next plan()
+
+    moving into a block costs the octile distance to it if it is passable, else it can't be done. like astar, the
+    block being left never has to be passable. with a lib.costs.CostLayer the cost of moving into a block is its
+    step_cost instead. costs are kept in COST_SCALE units
+    """
+
+    def __init__(self, goal: MapBlockCoord):
+        self.goal = goal
+        self._g = {}
+        self._rhs = {goal: 0}
+        self._queue = [] # heap of (key, block), entries not matching _queued are stale
+        self._queued = {}
+        self._km = 0
+        self._last_start = None
+        self._changed_blocks = set()
+        self._changed_boxes = []
+        # the CostLayer of the last plan() (None if it wasn't weighted), and the (min cost, scaled climb penalty)
+        # the heuristic is using
+        self._costs = None
+        self._weights = None
+
+    def notify_changed(self, blocks):
+        """
+        mark blocks whose passability might have changed since the last plan()
+        """
+        self._changed_blocks.update(blocks)
+
+    def notify_changed_box(self, a: MapBlockCoord, b: MapBlockCoord):
+        """
+        mark the box a -> b (inclusive) as possibly changed
+        """
+        self._changed_boxes.append((a, b))
+
+    def _h(self, a: MapBlockCoord, b: MapBlockCoord) -> int:
+        h = scaled_octile_distance(a, b)
+        if self._weights == None:
+            return h
+        min_cost, climb = self._weights
+        return int(h * min_cost) + climb * abs(a[2]-b[2])
+
+    def _step_cost(self, costs, block: MapBlockCoord, dz: int, d_metric: int) -> int:
+        """
+        cost of moving d_metric (scaled) into block with a CostLayer, rounded up so the heuristic stays a lower bound
+        """
+        if costs == None:
+            return d_metric
+        return math.ceil(d_metric * costs.cost(block)) + self._weights[1] * abs(dz)
+
+    def _key(self, block: MapBlockCoord, start: MapBlockCoord):
+        best = min(self._g.get(block, math.inf), self._rhs.get(block, math.inf))
+        return (best + self._h(start, block) + self._km, best)
+
+    def _update_block(self, block: MapBlockCoord, start: MapBlockCoord):
+        if self._g.get(block, math.inf) != self._rhs.get(block, math.inf):
+            key = self._key(block, start)
+            self._queued[block] = key
+            heapq.heappush(self._queue, (key, block))
+        elif block in self._queued:
+            del self._queued[block]
+
+    def _best_successor_cost(self, block: MapBlockCoord, passable) -> float:
+        x, y, z = block
+        g_get = self._g.get
+        inf = math.inf
+        costs = self._costs
+        best = inf
+        for dx, dy, dz, d_metric in _SCALED_NEIGHBOR_OFFSETS:
+            adj = (x+dx, y+dy, z+dz)
+            cost = g_get(adj, inf)
+            if cost == inf:
+                continue
+            cost += d_metric if costs == None else self._step_cost(costs, adj, dz, d_metric)
+            if cost < best and passable(adj):
+                best = cost
+        return best
+
+    def _top(self):
+        while len(self._queue) > 0:
+            key, block = self._queue[0]
+            if self._queued.get(block, None) == key:
+                return key, block
+            heapq.heappop(self._queue)
+        return None, None
+
+    def _repair_changes(self, start: MapBlockCoord, passable, old_costs):
+        changed = self._changed_blocks
+        volume = sum((b[0]-a[0]+1) * (b[1]-a[1]+1) * (b[2]-a[2]+1) for a, b in self._changed_boxes)
+        if volume > 4 * len(self._rhs) + 1000:
+            # big edits (ex: a whole new corridor) are cheaper to plan from scratch
+            self.__init__(self.goal)
+            return
+        for a, b in self._changed_boxes:
+            for x in range(a[0], b[0]+1):
+                for y in range(a[1], b[1]+1):
+                    for z in range(a[2], b[2]+1):
+                        changed.add((x, y, z))
+
+        # moving into a changed block might cost something different now, which matters for every block next to it.
+        # that's only for blocks the search has reached (finite g), for anything else the move was useless before
+        # and still is. old_costs is the CostLayer the search so far was done with
+        g, rhs = self._g, self._rhs
+        costs = self._costs
+        for block in changed:
+            block_g = g.get(block, math.inf)
+            if block_g == math.inf:
+                continue
+            block_passable = passable(block)
+            x, y, z = block
+            for dx, dy, dz, d_metric in _SCALED_NEIGHBOR_OFFSETS:
+                pred = (x+dx, y+dy, z+dz)
+                if pred == self.goal:
+                    continue
+                pred_rhs = rhs.get(pred, math.inf)
+                cost = self._step_cost(costs, block, dz, d_metric)
+                old_cost = self._step_cost(old_costs, block, dz, d_metric)
+                if block_passable and block_g + cost < pred_rhs:
+                    rhs[pred] = block_g + cost
+                    self._update_block(pred, start)
+                elif pred_rhs == block_g + old_cost and (not block_passable or cost > old_cost):
+                    # pred's best move might have been into this block
+                    rhs[pred] = self._best_successor_cost(pred, passable)
+                    self._update_block(pred, start)
+
+        self._changed_blocks = set()
+        self._changed_boxes = []
+
+    def plan(self, start: MapBlockCoord, passable: Callable[[MapBlockCoord], bool],
+             stats: dict=None, costs=None) -> Optional[List[MapBlockCoord]]:
+        """
+        get the best path from start to the goal given the current passable() and costs, reusing the previous search
+
+        returns [path] (including start and goal) if possible, else None
+        """
+        weights = None
+        if costs != None and costs.weighted:
+            weights = (costs.min_cost, round(costs.climb_penalty * COST_SCALE))
+        else:
+            costs = None
+        if weights != self._weights:
+            # the keys of everything queued depend on the heuristic, start over
+            self.__init__(self.goal)
+        old_costs = self._costs
+        self._costs, self._weights = costs, weights
+
+        if len(self._queue) == 0 and len(self._g) == 0:
+            self._queued[self.goal] = self._key(self.goal, start)
+            heapq.heappush(self._queue, (self._queued[self.goal], self.goal))
+        elif self._last_start != None and self._last_start != start:
+            self._km += self._h(self._last_start, start)
+        self._last_start = start
+        if len(self._changed_blocks) > 0 or len(self._changed_boxes) > 0:
+            self._repair_changes(start, passable, old_costs)
+            if len(self._g) == 0 and len(self._queue) == 0:
+                # got reset
+                return self.plan(start, passable, stats, costs)
+
+        expansions = 0
+        g, rhs = self._g, self._rhs
+        while True:
+            top_key, block = self._top()
+            start_key = self._key(start, start)
+            if block == None or (top_key >= start_key and rhs.get(start, math.inf) <= g.get(start, math.inf)):
+                break
+            expansions += 1
+            new_key = self._key(block, start)
+            if top_key < new_key:
+                self._queued[block] = new_key
+                heapq.heappush(self._queue, (new_key, block))
+                continue
+
+            del self._queued[block]
+            heapq.heappop(self._queue)
+            x, y, z = block
+            block_g = g.get(block, math.inf)
+            block_rhs = rhs.get(block, math.inf)
+            if block_g > block_rhs:
+                g[block] = block_rhs
+                if not passable(block):
+                    # nothing can move into this block, so there's nothing to propagate
+                    continue
+                for dx, dy, dz, d_metric in _SCALED_NEIGHBOR_OFFSETS:
+                    pred = (x+dx, y+dy, z+dz)
+                    cost = block_rhs + (d_metric if costs == None else self._step_cost(costs, block, dz, d_metric))
+                    if pred != self.goal and cost < rhs.get(pred, math.inf):
+                        rhs[pred] = cost
+                        self._update_block(pred, start)
+            else:
+                g[block] = math.inf
+                block_passable = passable(block)
+                for dx, dy, dz, d_metric in _SCALED_NEIGHBOR_OFFSETS:
+                    pred = (x+dx, y+dy, z+dz)
+                    if pred == self.goal or not block_passable:
+                        continue
+                    cost = block_g + (d_metric if costs == None else self._step_cost(costs, block, dz, d_metric))
+                    if rhs.get(pred, math.inf) == cost:
+                        rhs[pred] = self._best_successor_cost(pred, passable)
+                        self._update_block(pred, start)
+                if block != self.goal:
+                    rhs[block] = self._best_successor_cost(block, passable)
+                self._update_block(block, start)
+
+        if stats != None:
+            stats["expansions"] = stats.get("expansions", 0) + expansions
+
+        if g.get(start, math.inf) == math.inf and rhs.get(start, math.inf) == math.inf:
+            return None
+        # follow the cheapest successors down to the goal
+        path = [start]
+        curr = start
+        seen = {start}
+        while curr != self.goal:
+            x, y, z = curr
+            best, best_cost = None, math.inf
+            for dx, dy, dz, d_metric in _SCALED_NEIGHBOR_OFFSETS:
+                adj = (x+dx, y+dy, z+dz)
+                cost = g.get(adj, math.inf)
+                if cost == math.inf:
+                    continue
+                cost += d_metric if costs == None else self._step_cost(costs, adj, dz, d_metric)
+                if cost < best_cost and passable(adj):
+                    best, best_cost = adj, cost
+            if best == None or best in seen:
+                return None
+            seen.add(best)
+            path.append(best)
+            curr = best
+        return path
@@ -0,0 +1,222 @@
+"""
+pathfinding in worker processes, so that searches don't hold each other (or the server) up on the gil
+
+the map and who's blocking what are exported from a WorldMap snapshot into shared memory: the int8 grid of the
+"grid" storage backend, plus a grid of how many drones/reservations each block is next to. worker processes attach
+to that and search it without anything getting copied, only the request and the path go through pickling. a new
+export is made the first time a search needs a snapshot with different generations (see
+WorldMap.path_generations), and old ones are unlinked once no search is using them
+"""
+
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from lib.util import *
+from lib.mapping import WorldMap, MapSnapshot, _count_adjacent, record_pathfind
+from lib.pathfinding import astar, jps, smooth_path
+from lib.storage import GridBlockStorage
+
+# search modes that can run in a worker. "incremental" and "hierarchical" keep state in the WorldMap between
+# searches, so they stay in-process. "astar" is the default, "jps" is only there for callers that ask for it
+POOL_PATH_MODES = ["astar", "jps"]
+
+class SharedMapExport:
+    """
+    a snapshot's blocks and drone/reservation counts in one shared memory segment
+
+    the segment holds the int8 grid followed by a uint16 grid of the same shape, where each cell is the number of
+    drones + reservations that block is in or next to. blocks outside the grid aren't declared, so they're never
+    passable anyway and their counts don't matter. if the map has costs (see lib.costs), the pickled CostLayer
+    comes after that, costs_nbytes long
+    """
+
+    def __init__(self, snapshot: MapSnapshot):
+        grid, origin = snapshot.blocks.array()
+        self.shape = grid.shape
+        self.origin = origin
+        counts = np.zeros(grid.shape, dtype=np.uint16)
+        for adjacent_counts in [snapshot.drone_adjacent_counts, snapshot.reserved_adjacent_counts]:
+            if len(adjacent_counts) == 0:
+                continue
+            blocks = np.array(list(adjacent_counts.keys())) - origin
+            inside = np.all((blocks >= 0) & (blocks < grid.shape), axis=1)
+            np.add.at(counts, tuple(blocks[inside].T), np.array(list(adjacent_counts.values()))[inside])
+
+        costs = pickle.dumps(snapshot.costs) if snapshot.costs.weighted else b""
+        self.costs_nbytes = len(costs)
+
+        # SharedMemory can't be 0 bytes
+        size = grid.nbytes + counts.nbytes
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size + len(costs), 1))
+        self.name = self._shm.name
+        _arrays(self._shm.buf, self.shape)[0][...] = grid
+        _arrays(self._shm.buf, self.shape)[1][...] = counts
+        self._shm.buf[size:size+len(costs)] = costs
+        self.users = 0 # searches currently using this export
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+def _arrays(buf, shape):
+    """
+    get (blocks, counts) ndarrays over a segment's buffer
+    """
+    n = int(np.prod(shape))
+    blocks = np.ndarray(shape, dtype=np.int8, buffer=buf)
+    counts = np.ndarray(shape, dtype=np.uint16, buffer=buf, offset=n)
+    return blocks, counts
+
+# segments a worker process has attached to, maps name -> (SharedMemory, storage, counts, CostLayer or None)
+_attached = {}
+_ATTACHED_KEEP = 4
+
+def _attach(name: str, shape, origin, costs_nbytes: int):
+    if name in _attached:
+        return _attached[name]
+    shm = shared_memory.SharedMemory(name=name)
+    blocks, counts = _arrays(shm.buf, shape)
+    costs = None
+    if costs_nbytes > 0:
+        size = blocks.nbytes + counts.nbytes
+        costs = pickle.loads(shm.buf[size:size+costs_nbytes])
+    # native format memoryview, indexing it is a lot faster than indexing the ndarray
+    _attached[name] = (shm, GridBlockStorage.wrap(blocks, origin), counts.reshape(-1).data.cast("B").cast("H"), costs)
+    # segments get replaced as the map changes, forget about the oldest ones. nothing else in this process can be
+    # using them, a worker only runs one search at a time
+    while len(_attached) > _ATTACHED_KEEP:
+        old_name = next(iter(_attached))
+        old_shm, old_storage, old_counts, _ = _attached.pop(old_name)
+        del old_storage, old_counts
+        old_shm.close()
+    return _attached[name]
+
+def _search(name: str, shape, origin, costs_nbytes: int, start: MapBlockCoord, goal: MapBlockCoord, ignored_blocks,
+            mode: str):
+    """
+    run a search in a worker process
+
+    ignored_blocks are the blocks and reserved blocks of the drones being ignored, whose share of the counts gets
+    taken back out
+    """
+    _, storage, counts, costs = _attach(name, shape, origin, costs_nbytes)
+    ignored = {}
+    for block in ignored_blocks:
+        _count_adjacent(ignored, block, 1)
+
+    def _passable(block):
+        i = storage._index(block)
+        if i < 0 or storage._cells[i] != Traversability.FREE.value:
+            return False
+        return counts[i] - ignored.get(block, 0) <= 0
+
+    stats = {}
+    # like WorldMap.find_path, jps only works on distances
+    if mode == "astar" or costs != None:
+        return astar(start, goal, _passable, stats=stats, costs=costs), stats
+    return jps(start, goal, _passable, stats=stats), stats
+
+class PathfindingPool:
+    """
+    a pool of worker processes running find_path searches on shared memory exports of a WorldMap
+
+    find_path can be called from several threads at once (ex: by a threaded http server), each call blocks until
+    its search is done but the searches themselves run in parallel
+    """
+
+    def __init__(self, workers: int=None):
+        """
+        workers is the number of processes, the number of cpus by default
+        """
+        # workers get started on demand, by which point the server has threads running (monitoring, requests).
+        # forking a process with threads can deadlock it, so start them fresh
+        self.workers = workers if workers != None else os.cpu_count()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._exports = {} # maps (id(world_map), generations) -> SharedMapExport
+        self._latest = {} # maps id(world_map) -> key of its newest export
+
+    def _checkout(self, world_map: WorldMap, snapshot: MapSnapshot):
+        """
+        get an export of the snapshot, making one if needed, and mark it as in use
+        """
+        key = (id(world_map), snapshot.terrain_generation, snapshot.occupancy_generation)
+        with self._lock:
+            export = self._exports.get(key, None)
+            if export == None:
+                export = SharedMapExport(snapshot)
+                self._exports[key] = export
+                old_key = self._latest.get(id(world_map), None)
+                self._latest[id(world_map)] = key
+                if old_key != None and self._exports[old_key].users == 0:
+                    self._exports.pop(old_key).close()
+            export.users += 1
+            return key, export
+
+    def _checkin(self, key):
+        with self._lock:
+            export = self._exports[key]
+            export.users -= 1
+            if export.users == 0 and key not in self._latest.values():
+                self._exports.pop(key).close()
+
+    def find_path(self, world_map: WorldMap, a: MapBlockCoord, b: MapBlockCoord, drones_ignoring,
+                  stats: dict=None, mode: str="astar", smooth: bool=False):
+        """
+        same as WorldMap.find_path, but the search runs in a worker process (smoothing doesn't, it's cheap)
+
+        the map has to use the "grid" storage backend and mode has to be one of POOL_PATH_MODES. results go through
+        the map's path_cache like in-process searches
+        """
+        if mode not in POOL_PATH_MODES:
+            raise ValueError(f"pathfinding mode {mode} can't run in a worker process")
+        snapshot = world_map.snapshot()
+        if not isinstance(snapshot.blocks, GridBlockStorage):
+            raise ValueError("pathfinding in worker processes needs the grid storage backend")
+
+        t_start = time.perf_counter()
+        if stats == None:
+            stats = {}
+        expansions_before = stats.get("expansions", 0)
+        generations = snapshot.path_generations(drones_ignoring)
+        cached, path = world_map.path_cache.get(a, b, drones_ignoring, mode, generations)
+        stats["cached"] = cached
+        if not cached:
+            path = self._search(world_map, snapshot, a, b, drones_ignoring, stats, mode)
+            world_map.path_cache.put(a, b, drones_ignoring, mode, generations, path)
+        record_pathfind(f"pool/{mode}", stats, expansions_before, time.perf_counter() - t_start, path)
+        if not smooth:
+            return path
+        return smooth_path(path, snapshot.passable_func(drones_ignoring), snapshot.costs)
+
+    def _search(self, world_map: WorldMap, snapshot: MapSnapshot, a: MapBlockCoord, b: MapBlockCoord,
+                drones_ignoring, stats: dict, mode: str):
+        ignored_blocks = [snapshot.drone_blocks[i] for i in drones_ignoring if i in snapshot.drone_blocks]
+        ignored_blocks += [block for i in drones_ignoring for block in snapshot.drone_reservations.get(i, ())]
+        key, export = self._checkout(world_map, snapshot)
+        try:
+            future = self._executor.submit(_search, export.name, export.shape, export.origin, export.costs_nbytes,
+                                           a, b, ignored_blocks, mode)
+            path, search_stats = future.result()
+        finally:
+            self._checkin(key)
+        if stats != None:
+            # adding up like the in-process searches do
+            for key, value in search_stats.items():
+                stats[key] = stats.get(key, 0) + value
+        return path
+
+    def shutdown(self):
+        self._executor.shutdown()
+        with self._lock:
+            for export in self._exports.values():
+                export.close()
+            self._exports.clear()
+            self._latest.clear()
@@ -0,0 +1,349 @@
+"""
+storage backends for WorldMap._map
+
+both backends act like a read-only dict from MapBlockCoord -> Traversability (get, [], in, iteration, items, len,
+copy) and add fill()/fill_columns() for writing boxes/columns of blocks. undeclared blocks are simply missing.
+dense() gets the declared blocks as an int8 grid either way (see lib.encoding).
+"""
+
+import bisect
+from typing import Tuple
+
+import numpy as np
+
+from lib.util import *
+
+# int8 cell values used by GridBlockStorage, 0 is undeclared
+UNDECLARED = 0
+_TRAVERSABILITY_BY_VALUE = [None] + [Traversability(i) for i in range(1, len(Traversability)+1)]
+
+def dense_grid(blocks):
+    """
+    get (int8 grid of cell values like GridBlockStorage's, block coord of its [0, 0, 0] cell) for anything that
+    acts like a dict of block -> traversability, just big enough to fit every block in it
+    """
+    if len(blocks) == 0:
+        return np.zeros((0, 0, 0), dtype=np.int8), (0, 0, 0)
+    coords = np.array(list(blocks.keys()), dtype=np.int64)
+    vals = np.array([t.value for t in blocks.values()], dtype=np.int8)
+    low = coords.min(axis=0)
+    grid = np.zeros(coords.max(axis=0) - low + 1, dtype=np.int8)
+    grid[tuple((coords - low).T)] = vals
+    return grid, tuple(low.tolist())
+
+class DictBlockStorage(dict):
+    """
+    the original backend: one dict entry per declared block
+
+    cheap for small/sparse maps and easy to cross-check against
+
+    _columns:
+        maps (x, y) -> ([sorted z], {z: traversability}) for every declared block, so looking at a column doesn't
+        need to scan the whole map
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._columns = {}
+        for block, traversable in self.items():
+            self._index_block(block, traversable)
+
+    def _index_block(self, block: MapBlockCoord, traversable: Traversability):
+        column = self._columns.get((block[0], block[1]), None)
+        if column == None:
+            column = ([], {})
+            self._columns[block[0], block[1]] = column
+        zs, levels = column
+        if block[2] not in levels:
+            bisect.insort(zs, block[2])
+        levels[block[2]] = traversable
+
+    def __setitem__(self, block: MapBlockCoord, traversable: Traversability):
+        super().__setitem__(block, traversable)
+        self._index_block(block, traversable)
+
+    def fill(self, a: MapBlockCoord, b: MapBlockCoord, traversable: Traversability):
+        for x in range(a[0], b[0]+1):
+            for y in range(a[1], b[1]+1):
+                for z in range(a[2], b[2]+1):
+                    self[x, y, z] = traversable
+
+    def fill_columns(self, x0: int, y0: int, tops: np.ndarray, z_low: int, z_high: int, below: Traversability,
+                     above: Traversability=None):
+        """
+        see WorldMap.fill_columns
+        """
+        for i, j in np.argwhere(~np.isnan(tops)).tolist():
+            top = tops[i, j]
+            for z in range(z_low, z_high+1):
+                if z <= top:
+                    self[x0+i, y0+j, z] = below
+                elif above != None:
+                    self[x0+i, y0+j, z] = above
+
+    def copy(self) -> "DictBlockStorage":
+        # copy the column index as is instead of building it again block by block
+        r = DictBlockStorage()
+        dict.update(r, self)
+        r._columns = {xy: (zs.copy(), levels.copy()) for xy, (zs, levels) in self._columns.items()}
+        return r
+
+    def box_mask(self, a: MapBlockCoord, b: MapBlockCoord, traversable: Traversability) -> np.ndarray:
+        """
+        get a bool ndarray over the box a -> b (inclusive), true where a block is declared with this traversability
+        """
+        mask = np.zeros([max(j-i+1, 0) for i, j in zip(a, b)], dtype=bool)
+        for x in range(a[0], b[0]+1):
+            for y in range(a[1], b[1]+1):
+                for z in range(a[2], b[2]+1):
+                    if self.get((x, y, z)) == traversable:
+                        mask[x-a[0], y-a[1], z-a[2]] = True
+        return mask
+
+    def box(self, a: MapBlockCoord, b: MapBlockCoord) -> np.ndarray:
+        """
+        get an int8 grid of cell values (like GridBlockStorage's) over the box a -> b (inclusive)
+        """
+        grid = np.zeros([max(j-i+1, 0) for i, j in zip(a, b)], dtype=np.int8)
+        for x in range(a[0], b[0]+1):
+            for y in range(a[1], b[1]+1):
+                for z in range(a[2], b[2]+1):
+                    v = self.get((x, y, z))
+                    if v != None:
+                        grid[x-a[0], y-a[1], z-a[2]] = v.value
+        return grid
+
+    def bounds(self) -> Tuple[MapBlockCoord, MapBlockCoord]:
+        """
+        inclusive (min, max) corners of the declared blocks, None if empty
+        """
+        if len(self) == 0:
+            return None
+        lows = tuple(min(b[i] for b in self) for i in range(3))
+        highs = tuple(max(b[i] for b in self) for i in range(3))
+        return lows, highs
+
+    def dense(self):
+        """
+        see dense_grid
+        """
+        return dense_grid(self)
+
+    def column(self, x: int, y: int):
+        """
+        get [(z, traversability)] of all declared blocks at x, y sorted by z
+        """
+        column = self._columns.get((x, y), None)
+        if column == None:
+            return []
+        zs, levels = column
+        return [(z, levels[z]) for z in zs]
+
+class GridBlockStorage:
+    """
+    dense backend: a bounded int8 ndarray plus the block coord of its [0, 0, 0] cell (the origin offset)
+
+    the grid grows to fit whatever gets filled in. fills are done as numpy slice assignments, and single block
+    lookups go through a flat memoryview so they stay cheap from python
+    """
+
+    def __init__(self, bounds: Tuple[MapBlockCoord, MapBlockCoord]=None):
+        """
+        bounds optionally preallocates the grid for an inclusive (min, max) box of blocks
+        """
+        self._origin = (0, 0, 0)
+        self._set_grid(np.zeros((0, 0, 0), dtype=np.int8))
+        if bounds != None:
+            self._ensure_bounds(*bounds)
+
+    @classmethod
+    def wrap(cls, grid: np.ndarray, origin: MapBlockCoord) -> "GridBlockStorage":
+        """
+        storage around an existing int8 array (ex: one in shared memory) without copying it, for reading only
+        """
+        r = cls()
+        r._origin = tuple(origin)
+        r._set_grid(grid)
+        return r
+
+    def array(self):
+        """
+        get (the int8 grid, block coord of its [0, 0, 0] cell)
+        """
+        return self._grid, self._origin
+
+    def _set_grid(self, grid: np.ndarray):
+        self._grid = grid
+        self._shape = grid.shape
+        self._cells = grid.reshape(-1).data
+
+    def _ensure_bounds(self, a: MapBlockCoord, b: MapBlockCoord):
+        """
+        grow the grid (if needed) so that it covers the box a -> b
+        """
+        if self._grid.size == 0:
+            new_low = tuple(a)
+            new_high = tuple(b)
+        else:
+            old_high = [o+s-1 for o, s in zip(self._origin, self._shape)]
+            new_low = tuple(min(i, j) for i, j in zip(a, self._origin))
+            new_high = tuple(max(i, j) for i, j in zip(b, old_high))
+            if new_low == self._origin and new_high == tuple(old_high):
+                return
+        grid = np.zeros([h-l+1 for l, h in zip(new_low, new_high)], dtype=np.int8)
+        if self._grid.size != 0:
+            offset = [o-l for o, l in zip(self._origin, new_low)]
+            grid[tuple(slice(o, o+s) for o, s in zip(offset, self._shape))] = self._grid
+        self._origin = new_low
+        self._set_grid(grid)
+
+    def _index(self, block: MapBlockCoord) -> int:
+        """
+        flat index of a block in the grid, -1 if it's outside
+        """
+        nx, ny, nz = self._shape
+        x = block[0] - self._origin[0]
+        y = block[1] - self._origin[1]
+        z = block[2] - self._origin[2]
+        if x < 0 or y < 0 or z < 0 or x >= nx or y >= ny or z >= nz:
+            return -1
+        return (x*ny + y)*nz + z
+
+    def _slices(self, a: MapBlockCoord, b: MapBlockCoord):
+        return tuple(slice(i-o, j-o+1) for i, j, o in zip(a, b, self._origin))
+
+    def fill(self, a: MapBlockCoord, b: MapBlockCoord, traversable: Traversability):
+        if any(i > j for i, j in zip(a, b)):
+            return
+        self._ensure_bounds(a, b)
+        self._grid[self._slices(a, b)] = traversable.value
+
+    def paste(self, a: MapBlockCoord, grid: np.ndarray):
+        """
+        overwrite the box starting at a with an int8 grid of cell values (UNDECLARED cells undeclare their blocks)
+        """
+        if grid.size == 0:
+            return
+        b = tuple(i+n-1 for i, n in zip(a, grid.shape))
+        self._ensure_bounds(a, b)
+        self._grid[self._slices(a, b)] = grid
+
+    def fill_columns(self, x0: int, y0: int, tops: np.ndarray, z_low: int, z_high: int, below: Traversability,
+                     above: Traversability=None):
+        """
+        see WorldMap.fill_columns
+        """
+        a = (x0, y0, z_low)
+        b = (x0+tops.shape[0]-1, y0+tops.shape[1]-1, z_high)
+        self._ensure_bounds(a, b)
+        zs = np.arange(z_low, z_high+1)[None, None, :]
+        slab = self._grid[self._slices(a, b)]
+        # comparisons with nan are always false, so those columns don't change
+        slab[zs <= tops[:, :, None]] = below.value
+        if above != None:
+            slab[zs > tops[:, :, None]] = above.value
+
+    def box_mask(self, a: MapBlockCoord, b: MapBlockCoord, traversable: Traversability) -> np.ndarray:
+        """
+        get a bool ndarray over the box a -> b (inclusive), true where a block is declared with this traversability
+        """
+        mask = np.zeros([max(j-i+1, 0) for i, j in zip(a, b)], dtype=bool)
+        # only the part of the box that overlaps the grid can be declared
+        low = [max(i, o) for i, o in zip(a, self._origin)]
+        high = [min(j, o+n-1) for j, o, n in zip(b, self._origin, self._shape)]
+        if any(l > h for l, h in zip(low, high)):
+            return mask
+        mask[tuple(slice(l-i, h-i+1) for l, h, i in zip(low, high, a))] = \
+                self._grid[self._slices(low, high)] == traversable.value
+        return mask
+
+    def box(self, a: MapBlockCoord, b: MapBlockCoord) -> np.ndarray:
+        """
+        get an int8 grid of cell values over the box a -> b (inclusive), a copy
+        """
+        grid = np.zeros([max(j-i+1, 0) for i, j in zip(a, b)], dtype=np.int8)
+        low = [max(i, o) for i, o in zip(a, self._origin)]
+        high = [min(j, o+n-1) for j, o, n in zip(b, self._origin, self._shape)]
+        if any(l > h for l, h in zip(low, high)):
+            return grid
+        grid[tuple(slice(l-i, h-i+1) for l, h, i in zip(low, high, a))] = self._grid[self._slices(low, high)]
+        return grid
+
+    def get(self, block: MapBlockCoord, default=None):
+        i = self._index(block)
+        if i < 0:
+            return default
+        v = self._cells[i]
+        if v == UNDECLARED:
+            return default
+        return _TRAVERSABILITY_BY_VALUE[v]
+
+    def __getitem__(self, block: MapBlockCoord) -> Traversability:
+        v = self.get(block)
+        if v == None:
+            raise KeyError(block)
+        return v
+
+    def __contains__(self, block: MapBlockCoord) -> bool:
+        return self.get(block) != None
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._grid))
+
+    def __iter__(self):
+        for block, _ in self.items():
+            yield block
+
+    def items(self):
+        idxs = np.argwhere(self._grid != UNDECLARED)
+        vals = self._grid[tuple(idxs.T)]
+        ox, oy, oz = self._origin
+        for (x, y, z), v in zip(idxs.tolist(), vals.tolist()):
+            yield (x+ox, y+oy, z+oz), _TRAVERSABILITY_BY_VALUE[v]
+
+    def copy(self) -> "GridBlockStorage":
+        r = GridBlockStorage()
+        r._origin = self._origin
+        r._set_grid(self._grid.copy())
+        return r
+
+    def bounds(self) -> Tuple[MapBlockCoord, MapBlockCoord]:
+        """
+        inclusive (min, max) corners of the declared blocks, None if empty
+        """
+        idxs = np.argwhere(self._grid != UNDECLARED)
+        if len(idxs) == 0:
+            return None
+        lows = idxs.min(axis=0) + self._origin
+        highs = idxs.max(axis=0) + self._origin
+        return tuple(lows.tolist()), tuple(highs.tolist())
+
+    def dense(self):
+        """
+        get (int8 grid, block coord of its [0, 0, 0] cell) cut down to bounds(), the grid can be a view of the
+        storage's own
+        """
+        bounds = self.bounds()
+        if bounds == None:
+            return np.zeros((0, 0, 0), dtype=np.int8), (0, 0, 0)
+        return self._grid[self._slices(*bounds)], bounds[0]
+
+    def column(self, x: int, y: int):
+        """
+        get [(z, traversability)] of all declared blocks at x, y sorted by z
+        """
+        gx = x - self._origin[0]
+        gy = y - self._origin[1]
+        if gx < 0 or gy < 0 or gx >= self._shape[0] or gy >= self._shape[1]:
+            return []
+        col = self._grid[gx, gy]
+        zs = np.flatnonzero(col)
+        return [(int(z) + self._origin[2], _TRAVERSABILITY_BY_VALUE[col[z]]) for z in zs]
+
+    def nbytes(self) -> int:
+        return self._grid.nbytes
+
+STORAGE_BACKENDS = {
+        "dict": DictBlockStorage,
+        "grid": GridBlockStorage,
+        }
@@ -0,0 +1,227 @@
+"""
+loading terrain and obstacles into a WorldMap
+
+heightmaps (esri ascii grids, or numpy .npy/.npz arrays) get resampled onto the map's block columns, and everything
+at or below the surface is marked BLOCKED with free air above it. obstacle footprints come from geojson-like files
+(polygons in lon/lat with a height). both go through WorldMap.fill_columns, so a whole site is one numpy pass instead
+of a fill_map per block
+"""
+
+import json
+import math
+
+import numpy as np
+
+from lib.util import *
+from lib.mapping import WorldMap
+
+class Heightmap:
+    """
+    terrain elevations (meters) on a regular lat/lon grid
+
+    heights:
+        2d array where row 0 is the northernmost row and column 0 the westernmost (same as ascii grids). nan where
+        there's no data
+    south, west:
+        lat/lon of the south-west corner of the grid
+    cell_size:
+        width/height of a cell in degrees
+    """
+
+    def __init__(self, heights: np.ndarray, south: float, west: float, cell_size: float):
+        self.heights = np.asarray(heights, dtype=np.float32)
+        self.south = south
+        self.west = west
+        self.cell_size = cell_size
+
+    @property
+    def north(self) -> float:
+        return self.south + self.heights.shape[0] * self.cell_size
+
+    @property
+    def east(self) -> float:
+        return self.west + self.heights.shape[1] * self.cell_size
+
+    def cell_centers(self):
+        """
+        get (lats of each row, lons of each column)
+        """
+        rows, cols = self.heights.shape
+        lats = self.north - (np.arange(rows) + 0.5) * self.cell_size
+        lons = self.west + (np.arange(cols) + 0.5) * self.cell_size
+        return lats, lons
+
+    def sample(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        elevation of the cells containing each lat/lon, nan outside the grid
+        """
+        rows = np.floor((self.north - np.asarray(lats)) / self.cell_size).astype(np.int64)
+        cols = np.floor((np.asarray(lons) - self.west) / self.cell_size).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.heights.shape[0]) & (cols >= 0) & (cols < self.heights.shape[1])
+        heights = np.full(rows.shape, np.nan, dtype=np.float32)
+        heights[inside] = self.heights[rows[inside], cols[inside]]
+        return heights
+
+def load_ascii_grid(path: str) -> Heightmap:
+    """
+    load an esri ascii grid (.asc) with cells in degrees (ex: a geographic srtm export)
+    """
+    header = {}
+    with open(path) as f:
+        while True:
+            pos = f.tell()
+            line = f.readline()
+            parts = line.split()
+            if len(parts) != 2 or not parts[0][0].isalpha():
+                f.seek(pos)
+                break
+            header[parts[0].lower()] = float(parts[1])
+        # much faster than np.loadtxt for big grids
+        values = np.array(f.read().split(), dtype=np.float32)
+
+    rows, cols = int(header["nrows"]), int(header["ncols"])
+    cell_size = header["cellsize"]
+    heights = values.reshape(rows, cols)
+    if "nodata_value" in header:
+        heights[heights == header["nodata_value"]] = np.nan
+    # corners can be given for the corner of the grid or the center of its south-west cell
+    west = header["xllcorner"] if "xllcorner" in header else header["xllcenter"] - cell_size/2
+    south = header["yllcorner"] if "yllcorner" in header else header["yllcenter"] - cell_size/2
+    return Heightmap(heights, south, west, cell_size)
+
+def load_numpy(path: str, south: float=None, west: float=None, cell_size: float=None) -> Heightmap:
+    """
+    load a heightmap saved with numpy
+
+    .npz files can carry "heights" along with "south", "west" and "cell_size", otherwise (and for .npy files) those
+    have to be passed in. the layout of the array is the same as Heightmap.heights
+    """
+    loaded = np.load(path)
+    if isinstance(loaded, np.ndarray):
+        heights = loaded
+    else:
+        heights = loaded["heights"]
+        south = float(loaded["south"]) if "south" in loaded else south
+        west = float(loaded["west"]) if "west" in loaded else west
+        cell_size = float(loaded["cell_size"]) if "cell_size" in loaded else cell_size
+    if south == None or west == None or cell_size == None:
+        raise ValueError(f"{path} needs south, west and cell_size to be placed on the map")
+    return Heightmap(heights, south, west, cell_size)
+
+def load_heightmap(path: str, **kwargs) -> Heightmap:
+    """
+    load an ascii grid or numpy heightmap, depending on the file extension
+    """
+    if path.endswith(".npy") or path.endswith(".npz"):
+        return load_numpy(path, **kwargs)
+    return load_ascii_grid(path)
+
+def _column_grid(world_map: WorldMap, south: float, west: float, north: float, east: float):
+    """
+    get (x0, y0, lats, lons) for the block columns covering a lat/lon box, lats/lons are 2d arrays of each column's
+    center indexed [x-x0, y-y0]
+    """
+    corners = world_map.coords_to_blocks([(south, west, 0), (north, east, 0)])
+    (x0, y0, _), (x1, y1, _) = corners.tolist()
+    xs, ys = np.meshgrid(np.arange(x0, x1+1), np.arange(y0, y1+1), indexing="ij")
+    blocks = np.stack([xs.ravel(), ys.ravel(), np.zeros(xs.size)], axis=-1)
+    coords = world_map.blocks_to_coords(blocks, centers=True)
+    return x0, y0, coords[:, 0].reshape(xs.shape), coords[:, 1].reshape(xs.shape)
+
+def fill_terrain(world_map: WorldMap, heightmap: Heightmap, ceiling: float=120, base_elevation: float=None):
+    """
+    mark everything at or below the terrain BLOCKED and the air above it (up to ceiling meters) FREE
+
+    heights are taken relative to base_elevation, which is the elevation at the map's center by default (drones
+    report altitude relative to where they took off). each column gets the highest terrain anywhere under it, so
+    nothing sticking up between samples gets missed
+    """
+    if base_elevation == None:
+        center = world_map._center_coords
+        base_elevation = float(heightmap.sample(np.array([center.lat]), np.array([center.lon]))[0])
+        if math.isnan(base_elevation):
+            raise ValueError("the map's center isn't on the heightmap, base_elevation has to be given")
+
+    x0, y0, lats, lons = _column_grid(world_map, heightmap.south, heightmap.west, heightmap.north, heightmap.east)
+    # the cell under the center of every column...
+    surface = heightmap.sample(lats, lons)
+    # ...and every cell inside a column, for heightmaps finer than the blocks. east only depends on lon and north
+    # only on lat, so the rows and columns of the heightmap can be converted on their own
+    cell_lats, cell_lons = heightmap.cell_centers()
+    center = world_map._center_coords
+    xs = world_map.coords_to_blocks(np.stack([np.full(cell_lons.shape, center.lat), cell_lons,
+                                              np.zeros(cell_lons.shape)], axis=-1))[:, 0]
+    ys = world_map.coords_to_blocks(np.stack([cell_lats, np.full(cell_lats.shape, center.lon),
+                                              np.zeros(cell_lats.shape)], axis=-1))[:, 1]
+    finest = np.full(surface.shape, -np.inf, dtype=np.float32)
+    # fmax skips nan cells
+    np.fmax.at(finest, (xs[None, :] - x0, ys[:, None] - y0), heightmap.heights)
+    surface = np.fmax(surface, np.where(np.isinf(finest), np.nan, finest))
+
+    # block z is floor((altitude - the center's altitude) / resolution), so a surface inside a block blocks all of it
+    center_alt = world_map._center_coords.alt
+    tops = np.floor((surface - base_elevation - center_alt) / world_map._resolution)
+    valid = tops[~np.isnan(tops)]
+    if valid.size == 0:
+        return
+    z_high = int(math.floor((ceiling - center_alt) / world_map._resolution))
+    world_map.fill_columns(x0, y0, tops, int(valid.min()), max(z_high, int(valid.max())), Traversability.BLOCKED,
+                           Traversability.FREE)
+
+def load_obstacles(path: str):
+    """
+    load obstacle footprints from a geojson-like file
+
+    takes a FeatureCollection of Polygon/MultiPolygon features (lon/lat like geojson), each with a "height" property
+    in meters (same frame as drone altitudes). returns [(rings, height)] with rings being [ndarray of (lon, lat)]
+    """
+    with open(path) as f:
+        collection = json.load(f)
+    obstacles = []
+    for feature in collection["features"]:
+        geometry = feature["geometry"]
+        height = float(feature["properties"]["height"])
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            raise ValueError(f"unsupported obstacle geometry {geometry['type']}")
+        for polygon in polygons:
+            obstacles.append(([np.asarray(ring, dtype=float)[:, :2] for ring in polygon], height))
+    return obstacles
+
+def _inside(rings, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """
+    even-odd test of points against polygon rings (so holes work too)
+    """
+    inside = np.zeros(lons.shape, dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for ax, ay, bx, by in zip(x1, y1, x2, y2):
+            if ay == by:
+                continue
+            crosses = (ay > lats) != (by > lats)
+            x_cross = ax + (lats - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (lons < x_cross)
+    return inside
+
+def fill_obstacles(world_map: WorldMap, obstacles):
+    """
+    mark obstacle footprints BLOCKED from the bottom of the map up to their height
+
+    a column counts as part of a footprint if its center is inside it. the rest of the map isn't touched. all
+    obstacles go in as one batch, so the map only gets copied (and published) once
+    """
+    with world_map.batch() as state:
+        bounds = state.blocks.bounds()
+        for rings, height in obstacles:
+            points = np.concatenate(rings)
+            west, south = points.min(axis=0)
+            east, north = points.max(axis=0)
+            x0, y0, lats, lons = _column_grid(world_map, south, west, north, east)
+            top = math.floor((height - world_map._center_coords.alt) / world_map._resolution)
+            z_low = min(bounds[0][2], top) if bounds != None else min(0, top)
+            tops = np.where(_inside(rings, lons, lats), top, np.nan)
+            world_map.fill_columns(x0, y0, tops, z_low, top, Traversability.BLOCKED)
@@ -13,19 +13,27 @@ class Traversability(Enum):
     BLOCKED = 3
 
 
+# (dx, dy, dz, distance) for each of the 26 neighbors of a block
+NEIGHBOR_OFFSETS = [
+        (dx, dy, dz, math.hypot(dx, dy, dz))
+        for dx in [-1, 0, 1]
+        for dy in [-1, 0, 1]
+        for dz in [-1, 0, 1]
+        if not dx == dy == dz == 0
+        ]
+
 def adjacent_blocks(m: MapBlockCoord):
     """
-    returns dict where keys are positions and values are distances (1 or sqrt(2))
+    returns dict where keys are positions and values are distances (1, sqrt(2) or sqrt(3))
     """
-    r = {}
     x, y, z = m
-    for dx in [-1, 0, 1]:
-        for dy in [-1, 0, 1]:
-            for dz in [-1, 0, 1]:
-                if dx == dy == dz == 0:
-                    continue
-                r[x+dx, y+dy, z+dz] = math.hypot(dx, dy, dz)
-    return r
+    return {(x+dx, y+dy, z+dz): d for dx, dy, dz, d in NEIGHBOR_OFFSETS}
+
+def blocks_touch(a: MapBlockCoord, b: MapBlockCoord) -> bool:
+    """
+    true if the blocks are the same or adjacent to each other
+    """
+    return abs(a[0]-b[0]) <= 1 and abs(a[1]-b[1]) <= 1 and abs(a[2]-b[2]) <= 1
 
 def serialize_coordinate(c: Coordinate):
     return {
@@ -0,0 +1,39 @@
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+def crossing_map() -> WorldMap:
+    # 20x20x2 with a wall across the middle that only has a 3 block gap, so drones crossing it have to take turns
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10)
+    world_map.fill_map((0, 0, 0), (19, 19, 1), Traversability.FREE)
+    world_map.fill_map((0, 10, 0), (19, 10, 1), Traversability.BLOCKED)
+    world_map.fill_map((8, 10, 0), (10, 10, 1), Traversability.FREE)
+    return world_map
+
+def test_batch_plans_dont_conflict():
+    world_map = crossing_map()
+    starts = {"a": (2, 2, 0), "b": (6, 2, 0), "c": (14, 18, 0), "d": (18, 18, 0)}
+    goals = {"a": (14, 18, 0), "b": (2, 18, 1), "c": (6, 2, 1), "d": (14, 2, 0)}
+    for id, block in starts.items():
+        world_map.update_drone(id, world_map.get_block_center(block))
+
+    paths = world_map.plan_batch(goals)
+    blocks = world_map.snapshot().blocks
+
+    for id, path in paths.items():
+        assert path != None, f"no path for {id}"
+        assert path[0] == (starts[id], 0)
+        assert path[-1][0] == goals[id]
+        for (a, t_a), (b, t_b) in zip(path, path[1:]):
+            assert t_b == t_a + 1
+            assert blocks_touch(a, b)
+            assert blocks.get(b) == Traversability.FREE
+    # drones stay where their path ends, and no two are ever in or next to each other's block
+    end = max(len(path) for path in paths.values())
+    for t in range(end):
+        at = {id: path[min(t, len(path)-1)][0] for id, path in paths.items()}
+        ids = list(at)
+        for i, a in enumerate(ids):
+            for b in ids[i+1:]:
+                assert not blocks_touch(at[a], at[b]), f"{a} and {b} get too close at timestep {t}"
@@ -0,0 +1,39 @@
+import time
+
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.util import *
+
+TTL = 0.5 # seconds
+STEP = 0.3 # seconds per block, so flying the whole lease takes a lot longer than TTL
+
+def corridor():
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 100), 10)
+    world_map.fill_map((0, 0, 0), (0, 10, 0), Traversability.FREE)
+    world_map.update_drone("a", world_map.get_block_center((0, 0, 0)))
+    return world_map
+
+def test_lease_lasts_while_drone_flies_through_it():
+    world_map = corridor()
+    ahead = [(0, i, 0) for i in range(1, 6)]
+    assert world_map.lease_blocks("a", ahead, ttl=TTL) == ahead
+    for i, block in enumerate(ahead[:-1]):
+        time.sleep(STEP)
+        world_map.update_drone("a", world_map.get_block_center(block))
+        assert world_map.expire_leases() == []
+        # everything not flown through yet is still the drone's
+        assert world_map.snapshot().drone_reservations["a"] == tuple(ahead[i+1:])
+
+def test_lease_expires_when_drone_stops():
+    world_map = corridor()
+    ahead = [(0, i, 0) for i in range(1, 6)]
+    world_map.lease_blocks("a", ahead, ttl=TTL)
+    time.sleep(STEP)
+    world_map.update_drone("a", world_map.get_block_center(ahead[0]))
+    # hovering in the same block doesn't count as getting anywhere
+    time.sleep(STEP)
+    world_map.update_drone("a", world_map.get_block_center(ahead[0]))
+    time.sleep(STEP)
+    assert world_map.expire_leases() == ["a"]
+    assert world_map.reserved_block("a") == None
@@ -0,0 +1,121 @@
+import random
+import threading
+
+import numpy as np
+
+from aerpawlib.util import VectorNED
+
+from lib.mapping import MapBlockCoordSystem, WorldMap
+from lib.util import *
+
+from bench.coords import CENTER, RESOLUTION, RADIUS, legacy_coord_to_block, legacy_get_block_center
+
+def offset_meters(a, b) -> float:
+    # straight line distance between two nearby coordinates, measured on the new tangent plane
+    return float(np.hypot.reduce(MapBlockCoordSystem(a, 1)._coord_to_local(b.lat, b.lon, b.alt)))
+
+def random_blocks(rand: random.Random, n: int):
+    # blocks anywhere within RADIUS of the center, from a bit underground to 200m up
+    r_blocks = RADIUS // RESOLUTION
+    return [(rand.randint(-r_blocks, r_blocks), rand.randint(-r_blocks, r_blocks), rand.randint(-5, 20))
+            for _ in range(n)]
+
+def test_block_centers_match_aerpawlib():
+    coord_system = MapBlockCoordSystem(CENTER, RESOLUTION)
+    blocks = random_blocks(random.Random(0), 5000)
+    # both add the same VectorNED on the same sphere
+    error = max(offset_meters(legacy_get_block_center(coord_system, b), coord_system.get_block_center(b))
+                for b in blocks)
+    assert error < 0.01, f"block centers moved by {error}m"
+
+def test_coord_to_block_matches_aerpawlib():
+    coord_system = MapBlockCoordSystem(CENTER, RESOLUTION)
+    rand = random.Random(1)
+    coords = [coord_system.get_block_center(b) + VectorNED(*[rand.uniform(-5, 5) for _ in range(3)])
+              for b in random_blocks(rand, 5000)]
+    for coord in coords:
+        old = coord - CENTER
+        new = coord_system._coord_to_local(coord.lat, coord.lon, coord.alt)
+        offset_error = max(abs(old.east - new[0]), abs(old.north - new[1]), abs(-old.down - new[2]))
+        assert offset_error < 0.01, f"{coord} is {offset_error}m off"
+        # the floor can only come out different for points within that error of a block edge
+        if legacy_coord_to_block(coord_system, coord) != coord_system.coord_to_block(coord):
+            edge_distance = min(min(i % RESOLUTION, RESOLUTION - i % RESOLUTION) for i in new)
+            assert edge_distance <= offset_error, f"{coord} changed block while {edge_distance}m from an edge"
+
+def test_batch_conversions_match_scalar():
+    coord_system = MapBlockCoordSystem(CENTER, RESOLUTION)
+    rand = random.Random(2)
+    blocks = random_blocks(rand, 2000)
+    coords = [coord_system.get_block_center(b) + VectorNED(*[rand.uniform(-5, 5) for _ in range(3)]) for b in blocks]
+    batch = coord_system.coords_to_blocks([(c.lat, c.lon, c.alt) for c in coords])
+    assert [tuple(b) for b in batch.tolist()] == [coord_system.coord_to_block(c) for c in coords]
+    # block centers round trip exactly
+    centers = coord_system.blocks_to_coords(blocks, centers=True)
+    assert [tuple(b) for b in coord_system.coords_to_blocks(centers).tolist()] == blocks
+    corners = coord_system.blocks_to_coords(blocks)
+    for row, block in zip(corners, blocks):
+        corner = coord_system.block_to_coord(block)
+        assert np.allclose(row, (corner.lat, corner.lon, corner.alt), rtol=0, atol=1e-9)
+
+def snapshot_map() -> WorldMap:
+    world_map = WorldMap(CENTER, RESOLUTION)
+    world_map.fill_map((0, 0, 0), (19, 19, 2), Traversability.FREE)
+    world_map.update_drone("a", world_map.get_block_center((2, 2, 0)))
+    world_map.update_drone("b", world_map.get_block_center((15, 15, 0)))
+    return world_map
+
+def snapshot_contents(snapshot) -> dict:
+    return {
+            "blocks": dict(snapshot.blocks.items()),
+            "speed": snapshot.costs.speed((10, 10, 1)),
+            "drone_blocks": dict(snapshot.drone_blocks),
+            "reservations": dict(snapshot.occupied_blocks),
+            }
+
+def test_snapshots_dont_see_batches():
+    world_map = snapshot_map()
+    before = world_map.snapshot()
+    contents = snapshot_contents(before)
+    published = []
+    world_map.add_listener(lambda snapshot, changes: published.append(snapshot.version))
+
+    seen = {}
+    def _read():
+        # another thread in the middle of the batch, like a viewer or a pathfind
+        seen["snapshot"] = world_map.snapshot()
+        seen["path"] = world_map.find_path((0, 0, 0), (0, 19, 0), {"a", "b"})
+
+    with world_map.batch() as working:
+        # a wall across the map, drone a moving and reserving, and a slow zone
+        world_map.fill_map((0, 10, 0), (19, 10, 2), Traversability.BLOCKED)
+        world_map.update_drone("a", world_map.get_block_center((3, 3, 0)))
+        assert world_map.reserve_block("a", (4, 4, 0))
+        with world_map.batch():
+            world_map.set_speed((5, 5, 0), (14, 14, 2), 0.5)
+        reader = threading.Thread(target=_read)
+        reader.start()
+        reader.join()
+        # the writer sees its own changes
+        assert world_map.drone_block("a") == (3, 3, 0)
+        assert world_map.find_path((0, 0, 0), (0, 19, 0), {"a", "b"}) == None
+        assert published == []
+
+    assert seen["snapshot"] is before
+    assert seen["path"] != None
+    # the old snapshot never changed, the new one has all of it, published once
+    assert snapshot_contents(before) == contents
+    after = world_map.snapshot()
+    assert after is working
+    assert published == [after.version] and after.version == before.version + 1
+    assert after.blocks.get((7, 10, 1)) == Traversability.BLOCKED
+    assert after.drone_blocks["a"] == (3, 3, 0)
+    assert after.occupied_blocks[(4, 4, 0)] == "a"
+    assert after.costs.speed((10, 10, 1)) == 0.5
+
+def test_empty_batch_publishes_nothing():
+    world_map = snapshot_map()
+    before = world_map.snapshot()
+    with world_map.batch():
+        pass
+    assert world_map.snapshot() is before
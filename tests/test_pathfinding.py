@@ -0,0 +1,183 @@
+import math
+import random
+
+import numpy as np
+
+from lib.costs import CostLayer
+from lib.hierarchical import HierarchicalPlanner
+from lib.pathfinding import JPS_MAX_JUMP, AnytimeAstar, astar, jps
+from lib.util import *
+
+SIZE = (10, 10, 3)
+
+def random_map(seed: int, density: float=0.3):
+    """
+    (free blocks, start, goal) on a SIZE box with a density of them blocked, start and goal being free
+    """
+    rand = random.Random(seed)
+    free = {(x, y, z) for x in range(SIZE[0]) for y in range(SIZE[1]) for z in range(SIZE[2])
+            if rand.random() >= density}
+    start, goal = rand.sample(sorted(free), 2)
+    return free, start, goal
+
+def brute_force_costs(start: MapBlockCoord, free: set, costs: CostLayer=None):
+    """
+    the cheapest cost to every block reachable from start, relaxing moves out of every block that got cheaper until
+    nothing does
+    """
+    dists = {start: 0.0}
+    changed = {start}
+    while len(changed) > 0:
+        blocks, changed = changed, set()
+        for block in blocks:
+            x, y, z = block
+            for dx, dy, dz, d_metric in NEIGHBOR_OFFSETS:
+                adj = (x+dx, y+dy, z+dz)
+                if adj not in free:
+                    continue
+                adj_dist = dists[block] + (d_metric if costs == None else costs.step_cost(adj, dz, d_metric))
+                if adj_dist < dists.get(adj, math.inf) - 1e-9:
+                    dists[adj] = adj_dist
+                    changed.add(adj)
+    return dists
+
+def path_cost(path, costs: CostLayer=None) -> float:
+    if costs != None:
+        return costs.path_cost(path)
+    return sum(math.dist(p, q) for p, q in zip(path, path[1:]))
+
+def check_path(path, start: MapBlockCoord, goal: MapBlockCoord, free: set):
+    # starts and ends in the right place, and only makes moves to free blocks next to the last one
+    assert path[0] == start and path[-1] == goal
+    for a, b in zip(path, path[1:]):
+        assert a != b and blocks_touch(a, b), f"{a} -> {b} isn't a move"
+        assert b in free, f"{b} isn't free"
+
+def test_astar_matches_brute_force():
+    for seed in range(30):
+        free, start, goal = random_map(seed)
+        costs = None
+        if seed % 2 == 1:
+            # half of them routing by flight time, with a fast lane, a slow zone and climbing costing extra
+            costs = CostLayer()
+            costs.fill((0, 3, 0), (9, 4, 2), 2)
+            costs.fill((5, 5, 0), (9, 9, 1), 0.5)
+            costs.climb_penalty = 0.7
+        best = brute_force_costs(start, free, costs).get(goal, None)
+        path = astar(start, goal, free.__contains__, costs=costs)
+        if best == None:
+            assert path == None, f"seed {seed}: found a path to an unreachable goal"
+            continue
+        assert path != None, f"seed {seed}: no path found"
+        check_path(path, start, goal, free)
+        assert math.isclose(path_cost(path, costs), best), f"seed {seed}: path isn't optimal"
+
+def test_astar_no_path():
+    free, start, goal = random_map(0, density=0)
+    # wall off the goal completely
+    walls = {(goal[0]+dx, goal[1]+dy, goal[2]+dz) for dx, dy, dz, _ in NEIGHBOR_OFFSETS}
+    free -= walls - {goal}
+    stats = {}
+    assert astar(start, goal, free.__contains__, stats=stats) == None
+    # everything it could get to got expanded once
+    assert stats["expansions"] == len(brute_force_costs(start, free))
+
+def terrain_mask(grid: np.ndarray):
+    """
+    a HierarchicalPlanner terrain_mask for a bool grid of free blocks starting at (0, 0, 0)
+    """
+    def _mask(a: MapBlockCoord, b: MapBlockCoord) -> np.ndarray:
+        mask = np.zeros([j-i+1 for i, j in zip(a, b)], dtype=bool)
+        low = [max(i, 0) for i in a]
+        high = [min(j, n-1) for j, n in zip(b, grid.shape)]
+        if any(l > h for l, h in zip(low, high)):
+            return mask
+        mask[tuple(slice(l-i, h-i+1) for l, h, i in zip(low, high, a))] = \
+                grid[tuple(slice(l, h+1) for l, h in zip(low, high))]
+        return mask
+    return _mask
+
+def test_hierarchical_finds_every_path():
+    # small chunks on noisy maps, so queries cross lots of chunks through awkward entrances
+    for seed in range(6):
+        grid = np.random.default_rng(seed).random((32, 32, 4)) >= 0.25
+        free = {tuple(b) for b in np.argwhere(grid).tolist()}
+        planner = HierarchicalPlanner(terrain_mask(grid), chunk_size=4, entrance_span=4)
+        rand = random.Random(seed)
+        # blocks taken by drones, which only passable knows about
+        drones = set(rand.sample(sorted(free), 40)) if seed % 2 == 1 else set()
+        passable = free - drones
+        for _ in range(10):
+            start, goal = rand.sample(sorted(passable), 2)
+            reachable = goal in brute_force_costs(start, passable)
+            path = planner.find_path(start, goal, passable.__contains__)
+            assert (path != None) == reachable, f"seed {seed}: {start} -> {goal} disagrees on whether there's a path"
+            if path != None:
+                check_path(path, start, goal, passable)
+
+def test_hierarchical_close_to_optimal():
+    # open air with a wall that only has a gap at one end
+    grid = np.ones((48, 48, 4), dtype=bool)
+    grid[:, 24, :] = False
+    grid[30:33, 24, :] = True
+    free = {tuple(b) for b in np.argwhere(grid).tolist()}
+    planner = HierarchicalPlanner(terrain_mask(grid), chunk_size=8)
+    rand = random.Random(0)
+    for _ in range(20):
+        start, goal = rand.sample(sorted(free), 2)
+        stats = {}
+        path = planner.find_path(start, goal, free.__contains__, stats)
+        check_path(path, start, goal, free)
+        assert not stats["fallback"]
+        # bending through chunk entrances costs something, but not much
+        assert path_cost(path) <= 1.5 * brute_force_costs(start, free)[goal]
+
+def test_anytime_bounds_hold():
+    for seed in range(20):
+        free, start, goal = random_map(seed, density=0.2)
+        best = brute_force_costs(start, free).get(goal, None)
+        search = AnytimeAstar(start, goal, free.__contains__)
+        # a few expansions at a time, every path on the way has to be valid and within its bound
+        bounds = []
+        while not search.done:
+            path = search.improve(max_expansions=5)
+            if path != None:
+                check_path(path, start, goal, free)
+                assert path_cost(path) <= search.bound * best + 1e-9, f"seed {seed}: path is worse than its bound"
+                bounds.append(search.bound)
+        assert bounds == sorted(bounds, reverse=True), f"seed {seed}: the bound went up"
+        if best == None:
+            assert search.path == None
+        else:
+            assert search.bound == 1.0
+            assert math.isclose(path_cost(search.path), best), f"seed {seed}: finished path isn't optimal"
+
+def test_anytime_without_budget_is_optimal():
+    for seed in range(10):
+        free, start, goal = random_map(seed)
+        costs = CostLayer()
+        costs.fill((0, 0, 0), (4, 9, 2), 0.5)
+        costs.climb_penalty = 0.3
+        best = brute_force_costs(start, free, costs).get(goal, None)
+        search = AnytimeAstar(start, goal, free.__contains__, costs=costs)
+        path = search.improve()
+        assert search.done
+        if best == None:
+            assert path == None
+        else:
+            check_path(path, start, goal, free)
+            assert math.isclose(path_cost(path, costs), best), f"seed {seed}: path isn't optimal"
+
+def test_jps_matches_brute_force():
+    for seed in range(30):
+        free, start, goal = random_map(seed, density=0.2 if seed % 2 == 0 else 0.4)
+        best = brute_force_costs(start, free).get(goal, None)
+        # short jumps too, stopping early has to be as good as jumping all the way
+        for max_jump in [1, 3, JPS_MAX_JUMP]:
+            path = jps(start, goal, free.__contains__, max_jump=max_jump)
+            if best == None:
+                assert path == None, f"seed {seed}: found a path to an unreachable goal"
+                continue
+            assert path != None, f"seed {seed}: no path found"
+            check_path(path, start, goal, free)
+            assert math.isclose(path_cost(path), best), f"seed {seed}, max_jump {max_jump}: path isn't optimal"
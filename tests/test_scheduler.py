@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from ground.scheduler import AIRBORNE, GROUND, PathfindScheduler
+
+def run_queued(func):
+    """
+    func(scheduler, request) with the scheduler's one worker busy, returns the drones in the order their searches
+    ran after that. request(drone_id, timeout) queues a search for drone_id and gives its task
+    """
+    async def _inner():
+        scheduler = PathfindScheduler(1)
+        runner = asyncio.create_task(scheduler.run())
+        ran = []
+        busy = threading.Event()
+        blocker = asyncio.create_task(scheduler.find_path("blocker", "blocker", busy.wait, 10))
+
+        def request(drone_id: str, timeout: float):
+            return asyncio.create_task(scheduler.find_path(drone_id, drone_id, lambda: ran.append(drone_id), timeout))
+
+        await asyncio.sleep(0.05)
+        tasks = await func(scheduler, request)
+        busy.set()
+        await asyncio.gather(blocker, *tasks)
+        runner.cancel()
+        return ran
+    return asyncio.run(_inner())
+
+def test_landed_drone_loses_priority():
+    async def _queue(scheduler, request):
+        scheduler.set_priority("landed", AIRBORNE)
+        scheduler.set_priority("landed", GROUND)
+        tasks = [request("ground", 5), request("landed", 10)]
+        await asyncio.sleep(0)
+        return tasks
+    assert run_queued(_queue) == ["ground", "landed"]
+
+def test_joined_request_with_later_deadline_requeues():
+    async def _queue(scheduler, request):
+        tasks = [request("a", 5), request("b", 10)]
+        await asyncio.sleep(0)
+        # same search as a's, which only has to be done by then now
+        tasks.append(request("a", 30))
+        await asyncio.sleep(0)
+        tasks[0].cancel()
+        return tasks[1:]
+    assert run_queued(_queue) == ["b", "a"]
+
+def test_taking_off_requeues():
+    async def _queue(scheduler, request):
+        tasks = [request("a", 5), request("b", 10)]
+        await asyncio.sleep(0)
+        scheduler.set_priority("b", AIRBORNE)
+        return tasks
+    assert run_queued(_queue) == ["b", "a"]
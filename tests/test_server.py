@@ -0,0 +1,155 @@
+import asyncio
+
+import numpy as np
+from aiohttp.test_utils import TestClient, TestServer
+from aerpawlib.util import Coordinate
+
+import ground.server as server
+import ground.monitoring as monitoring
+from ground.ground_logger import Logger
+from ground.scheduler import OUTCOMES
+from lib.mapping import PATHFIND_RESULTS, WorldMap
+from lib.terrain import Heightmap, fill_terrain
+from lib.util import *
+
+def setup_server(world_map: WorldMap):
+    server.world_map = world_map
+    server.logger = Logger(world_map)
+    server.drones = monitoring.DroneListing(world_map, server.logger)
+    server.pool = None
+
+def run_with_client(func):
+    # func(client) against a fresh app on the server's current globals
+    async def _inner():
+        client = TestClient(TestServer(server.make_app()))
+        await client.start_server()
+        try:
+            return await func(client)
+        finally:
+            await client.close()
+    return asyncio.run(_inner())
+
+def wall_map() -> WorldMap:
+    # 100x100x5 with a wall that has to be flown around, way too big to search in a few ms
+    world_map = WorldMap(Coordinate(35.7274488, -78.6960209, 30), 10)
+    world_map.fill_map((0, 0, 0), (99, 99, 4), Traversability.FREE)
+    world_map.fill_map((0, 50, 0), (89, 52, 4), Traversability.BLOCKED)
+    world_map.update_drone("a", world_map.get_block_center((5, 5, 0)))
+    return world_map
+
+def test_joined_pathfinds_out_of_budget():
+    world_map = wall_map()
+    setup_server(world_map)
+    target = serialize_coordinate(world_map.get_block_center((5, 95, 4)))
+    coalesced = OUTCOMES.labels("coalesced").value
+
+    async def _pathfind_twice(client):
+        url = "/drone/a/pathfind?budget=0.2"
+        first = asyncio.create_task(client.post(url, json=target))
+        await asyncio.sleep(0.05)
+        second = await client.post(url, json=target)
+        return [(await first).status, second.status, await second.text()]
+
+    first, second, text = run_with_client(_pathfind_twice)
+    assert OUTCOMES.labels("coalesced").value == coalesced + 1
+    # both get told to ask again, not that there's no path
+    assert first == 503
+    assert second == 503, text
+
+def test_takeoff_from_terrain():
+    # flat ground 100m up, with the drone sitting on it where the map's center is (altitudes are relative to there)
+    center = Coordinate(35.7274488, -78.6960209, 30)
+    world_map = WorldMap(center, 10)
+    fill_terrain(world_map, Heightmap(np.full((20, 20), 100.0), center.lat - 0.001, center.lon - 0.001, 0.0001))
+    world_map.update_drone("a", Coordinate(center.lat, center.lon, 0))
+    setup_server(world_map)
+
+    async def _takeoff(client):
+        resp = await client.post("/drone/a/takeoff")
+        return await resp.json()
+
+    j = run_with_client(_takeoff)
+    assert j["clear"]
+    # into the block right above the one the ground is in
+    x, y, z = world_map.drone_block("a")
+    assert world_map.reserved_block("a") == (x, y, z + 1)
+
+def test_bad_map_updates():
+    world_map = wall_map()
+    setup_server(world_map)
+    version = world_map.snapshot().version
+    a = {"x": 0, "y": 0, "z": 0}
+    bad = [
+            {"a": a, "empty": True},
+            {"b": a, "empty": True},
+            {"empty": True},
+            {"a": a, "b": {"x": 1, "y": 1}, "empty": True},
+            {"a": a, "b": a, "empty": "yes"},
+            {"a": a, "b": a, "speed": "fast"},
+            {"climb_penalty": -1},
+            [{"a": a, "b": a, "empty": False}, 3],
+            ]
+
+    async def _post_all(client):
+        return [(await client.post("/map/update", json=update)).status for update in bad]
+
+    assert run_with_client(_post_all) == [400] * len(bad)
+    # the good update in the last one didn't get applied either
+    assert world_map.snapshot().version == version
+
+def test_pathfind_modes():
+    world_map = wall_map()
+    setup_server(world_map)
+    target = serialize_coordinate(world_map.get_block_center((5, 20, 0)))
+    found = {mode: PATHFIND_RESULTS.labels(mode, "found").value for mode in ["astar", "incremental"]}
+
+    async def _pathfind(client):
+        statuses = []
+        for query in ["", "?mode=incremental", "?mode=dijkstra", "?mode=astar&budget=1", "?mode=anytime"]:
+            statuses.append((await client.post(f"/drone/a/pathfind{query}", json=target)).status)
+        return statuses
+
+    assert run_with_client(_pathfind) == [200, 200, 400, 400, 400]
+    # plain a* unless asked for something else
+    assert PATHFIND_RESULTS.labels("astar", "found").value == found["astar"] + 1
+    assert PATHFIND_RESULTS.labels("incremental", "found").value == found["incremental"] + 1
+
+def test_bad_leases():
+    world_map = wall_map()
+    setup_server(world_map)
+    block = serialize_block((5, 6, 0))
+    bad = [
+            [block],
+            {"blocks": [block], "ttl": "5"},
+            {"blocks": [block], "ttl": None},
+            {"blocks": [block], "ttl": 0},
+            {"ttl": 5},
+            {"blocks": block},
+            {"blocks": [block, {"x": 1, "y": 2}]},
+            ]
+
+    async def _post_all(client):
+        statuses = [(await client.post("/drone/a/lease", json=lease)).status for lease in bad]
+        return statuses, (await client.post("/drone/a/lease", json={"blocks": [block], "ttl": 5})).status
+
+    statuses, good = run_with_client(_post_all)
+    assert statuses == [400] * len(bad)
+    assert good == 200
+
+def test_bad_batch_plans():
+    world_map = wall_map()
+    setup_server(world_map)
+    target = serialize_coordinate(world_map.get_block_center((5, 20, 0)))
+    bad = [
+            {"id": "a", "target": target},
+            [{"id": "a"}],
+            [{"target": target}],
+            [{"id": ["a"], "target": target}],
+            [{"id": "a", "target": {"lat": 35.7}}],
+            ["a"],
+            ]
+
+    async def _post_all(client):
+        return [(await client.post("/plan/batch", json=plan)).status for plan in bad]
+
+    assert run_with_client(_post_all) == [400] * len(bad)
@@ -0,0 +1,87 @@
+import random
+
+import numpy as np
+from aerpawlib.util import Coordinate
+
+from lib.mapping import WorldMap
+from lib.storage import DictBlockStorage, GridBlockStorage, dense_grid
+from lib.util import *
+
+from bench.storage import random_fills
+
+CENTER = Coordinate(35.7274488, -78.6960209, 30)
+
+def filled_storages(seed: int):
+    storages = [DictBlockStorage(), GridBlockStorage()]
+    for a, b, traversability in random_fills(seed, 40):
+        for storage in storages:
+            storage.fill(a, b, traversability)
+    return storages
+
+def test_backends_agree():
+    for seed in range(5):
+        dict_storage, grid_storage = filled_storages(seed)
+        assert dict(dict_storage.items()) == dict(grid_storage.items()), "contents differ"
+        assert len(dict_storage) == len(grid_storage)
+        assert dict_storage.bounds() == grid_storage.bounds()
+        rand = random.Random(seed)
+        for _ in range(200):
+            block = (rand.randint(-35, 35), rand.randint(-35, 35), rand.randint(-2, 7))
+            assert dict_storage.get(block) == grid_storage.get(block)
+            assert (block in dict_storage) == (block in grid_storage)
+            assert dict_storage.column(block[0], block[1]) == grid_storage.column(block[0], block[1])
+        # boxes sticking out of the declared blocks too
+        for _ in range(20):
+            a = (rand.randint(-35, 35), rand.randint(-35, 35), rand.randint(-2, 7))
+            b = tuple(i + rand.randint(0, 8) for i in a)
+            assert np.array_equal(dict_storage.box(a, b), grid_storage.box(a, b))
+            for traversability in Traversability:
+                assert np.array_equal(dict_storage.box_mask(a, b, traversability),
+                                      grid_storage.box_mask(a, b, traversability))
+        for grid, origin in [dict_storage.dense(), grid_storage.dense()]:
+            expected, expected_origin = dense_grid(dict(dict_storage.items()))
+            assert origin == expected_origin
+            assert np.array_equal(grid, expected)
+
+def test_fill_columns_agree():
+    rand = np.random.default_rng(0)
+    tops = rand.uniform(-1, 6, (12, 9))
+    tops[rand.random(tops.shape) < 0.2] = np.nan
+    for above in [None, Traversability.FREE]:
+        storages = [DictBlockStorage(), GridBlockStorage()]
+        for storage in storages:
+            storage.fill((0, 0, 0), (3, 3, 3), Traversability.FREE)
+            storage.fill_columns(-2, 1, tops, 0, 5, Traversability.BLOCKED, above)
+        assert dict(storages[0].items()) == dict(storages[1].items())
+
+def test_copies_are_independent():
+    for storage in filled_storages(0):
+        copy = storage.copy()
+        before = dict(storage.items())
+        copy.fill((0, 0, 0), (3, 3, 3), Traversability.BLOCKED)
+        copy.fill((100, 100, 0), (100, 100, 0), Traversability.FREE)
+        assert dict(storage.items()) == before
+        assert copy.get((100, 100, 0)) == Traversability.FREE
+        assert (100, 100, 0) not in storage
+
+def test_world_maps_agree():
+    # the same fills through WorldMap give the same answers to everything that reads the map
+    for seed in range(3):
+        maps = {storage: WorldMap(CENTER, 10, storage=storage) for storage in ["dict", "grid"]}
+        for a, b, traversability in random_fills(seed, 40):
+            for world_map in maps.values():
+                world_map.fill_map(a, b, traversability)
+        dict_map, grid_map = maps["dict"], maps["grid"]
+        rand = random.Random(seed)
+        for world_map in maps.values():
+            world_map.update_drone("other", world_map.get_block_center((3, 3, 2)))
+            world_map.update_drone("me", world_map.get_block_center((-5, -5, 1)))
+        for _ in range(200):
+            block = (rand.randint(-35, 35), rand.randint(-35, 35), rand.randint(-2, 7))
+            assert dict_map.heightslice(block) == grid_map.heightslice(block)
+            assert dict_map.can_reserve_block("me", block, skip_adj=True) \
+                    == grid_map.can_reserve_block("me", block, skip_adj=True)
+        for _ in range(10):
+            a = (rand.randint(-30, 30), rand.randint(-30, 30), rand.randint(0, 5))
+            b = (rand.randint(-30, 30), rand.randint(-30, 30), rand.randint(0, 5))
+            assert dict_map.find_path(a, b, {"me"}) == grid_map.find_path(a, b, {"me"}), f"paths differ for {a} -> {b}"
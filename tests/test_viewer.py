@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from lib.util import *
+
+# the viewer draws with raylib, which headless setups might not have
+pytest.importorskip("raylib")
+from viewer.api import weld_grid
+
+def runs(grid: np.ndarray, origin: MapBlockCoord):
+    """
+    every run of blocked cells along x as (first block, length), going cell by cell
+    """
+    found = []
+    for y in range(grid.shape[1]):
+        for z in range(grid.shape[2]):
+            start = None
+            for x in range(grid.shape[0] + 1):
+                blocked = x < grid.shape[0] and grid[x, y, z] == Traversability.BLOCKED.value
+                if blocked and start == None:
+                    start = x
+                elif not blocked and start != None:
+                    found.append(((start+origin[0], y+origin[1], z+origin[2]), x - start))
+                    start = None
+    return sorted(found)
+
+def welded_runs(grid: np.ndarray, origin: MapBlockCoord):
+    # draw_rect corners are one block below the first block in every direction
+    return sorted(((x+1, y+1, z+1), size[0]) for (x, y, z), size in weld_grid(grid, origin))
+
+def test_weld_box_at_max_x():
+    grid = np.full((6, 3, 2), Traversability.FREE.value, dtype=np.int8)
+    # a box touching the max-x edge, one in the middle, and single blocks at both ends
+    grid[3:6, 0:2, 0] = Traversability.BLOCKED.value
+    grid[1:3, 2, 1] = Traversability.BLOCKED.value
+    grid[0, 0, 1] = Traversability.BLOCKED.value
+    grid[5, 2, 0] = Traversability.BLOCKED.value
+    origin = (-3, 10, 2)
+    welded = weld_grid(grid, origin)
+    assert ((3-3-1, 10-1, 2-1), (3, 1, 1)) in welded
+    assert welded_runs(grid, origin) == runs(grid, origin)
+    assert sum(size[0] for _, size in welded) == np.count_nonzero(grid == Traversability.BLOCKED.value)
+
+def test_weld_random_grids():
+    rand = np.random.default_rng(0)
+    for _ in range(20):
+        grid = rand.choice([0, Traversability.FREE.value, Traversability.BLOCKED.value], size=(7, 4, 3)).astype(np.int8)
+        assert welded_runs(grid, (5, -2, 0)) == runs(grid, (5, -2, 0))
@@ -1,3 +1,6 @@
+import base64
+import json
+import numpy as np
 import requests
 import threading
 import time
@@ -6,11 +9,38 @@ from raylib import *
 
 from aerpawlib.util import Coordinate
 
+from lib.encoding import MAP_CONTENT_TYPE, decode_map
 from lib.mapping import *
+from lib.storage import GridBlockStorage, dense_grid
 from lib.util import *
 
 from viewer.render import *
 
+STREAM_TIMEOUT = 15 # seconds without anything on /viewer/stream before giving up on it, the server pings every 5
+
+def weld_grid(grid: np.ndarray, origin: MapBlockCoord):
+    """
+    merge the blocked cells of an int8 grid of cell values (see lib.storage) into runs along x, so that there's
+    one box to draw per run instead of one per block
+
+    returns [(corner, size)] for draw_rect
+    """
+    if grid.size == 0:
+        return []
+    nx = grid.shape[0]
+    blocked = np.zeros((nx+2,) + grid.shape[1:], dtype=bool)
+    blocked[1:-1] = grid == Traversability.BLOCKED.value
+    starts = np.argwhere(blocked[1:-1] & ~blocked[:-2])
+    ends = np.argwhere(blocked[1:-1] & ~blocked[2:])
+    # both come out sorted by x first, sort by (y, z, x) so that the n-th start and end are the same run
+    starts = starts[np.lexsort((starts[:, 0], starts[:, 2], starts[:, 1]))]
+    ends = ends[np.lexsort((ends[:, 0], ends[:, 2], ends[:, 1]))]
+    # ends are the last cell of each run, so the run is one longer than end - start (runs that reach the end of the
+    # grid too)
+    ox, oy, oz = origin
+    return [((x+ox-1, y+oy-1, z+oz-1), (dx, 1, 1))
+            for (x, y, z), dx in zip(starts.tolist(), (ends[:, 0] + 1 - starts[:, 0]).tolist())]
+
 class MapHandler():
     def __init__(self, ground_host: str, skip_http=False):
         self._ground_host = ground_host
@@ -24,90 +54,128 @@ class MapHandler():
             self._world_map = WorldMap(deserialize_coordinate(j["center"]), j["resolution"])
         else:
             self._world_map = None
+        # _map is only touched by the thread keeping the map up to date (update_map/stream_map), which welds it
+        # again when it changes. the rest get replaced (never changed), so the render loop can use them as is
+        self._map = GridBlockStorage()
+        self._drones = {} # maps id -> block
+        self._reservations = {} # maps id -> [blocks]
+        self._occupied = {}
+        self._reserved = []
         self._welded_blocks = None
 
     def weld_map(self):
-        m = self._world_map._map.copy()
-        if len(m) == 0:
-            self._welded_blocks = []
-            return
-
-        xs = {i[0] for i in m}
-        ys = {i[1] for i in m}
-        zs = {i[2] for i in m}
-
-        x_bounds = (min(xs), max(xs))
-        y_bounds = (min(ys), max(ys))
-        z_bounds = (min(zs), max(zs))
-
-        x_constrained_slices = [] # (corner1, corner2)
-        slices_building = {} # (y, z): corner1
-
-        for x in range(x_bounds[0], x_bounds[1]+1):
-            for y in range(y_bounds[0], y_bounds[1]+1):
-                for z in range(z_bounds[0], z_bounds[1]+1):
-                    if (y, z) in slices_building:
-                        if (x, y, z) not in m \
-                                or m[(x, y, z)] != Traversability.BLOCKED:
-                            x_constrained_slices.append((slices_building[(y, z)], (x, y, z)))
-                            del(slices_building[(y, z)])
-                    elif (x, y, z) in m \
-                            and m[(x, y, z)] == Traversability.BLOCKED:
-                        slices_building[(y, z)] = (x, y, z)
-        for slice in slices_building:
-            y, z = slice
-            x_constrained_slices.append((slices_building[slice], (x_bounds[1], y, z)))
-
-        # just 1d for now.
-        # compute sizes
-        blocks = []
-        for slice in x_constrained_slices:
-            x1, y1, z1 = slice[0]
-            x2, y2, z2 = slice[1]
-            dx = x2-x1
-            dy = y2-y1 + 1
-            dz = z2-z1 + 1
-            blocks.append(((x1-1, y1-1, z1-1), (dx, dy, dz)))
-
-        self._welded_blocks = blocks
+        self._welded_blocks = weld_grid(*self._map.dense())
 
     def render_map(self, camera):
-        if self._welded_blocks == None:
-            self.weld_map()
-        # m = self._world_map._map.copy()
-        o = self._world_map._occupied_blocks.copy()
+        welded_blocks = self._welded_blocks
+        if welded_blocks == None:
+            return
+        o = self._occupied
         # for coord in m:
         #     if m[coord] == Traversability.BLOCKED:
         #         draw_cube(camera, coord, RED, self._world_map)
-        for block in self._welded_blocks:
+        for block in welded_blocks:
             draw_rect(camera, block[0], block[1], RED)
 
+        for block in self._reserved:
+            draw_cube(camera, block, SKYBLUE, self._world_map)
+
         for drone_block in o:
             draw_cube(camera, drone_block, BLUE, self._world_map, o[drone_block])
 
     def update_map(self):
         resp = requests.get(
-                url=f"http://{self._ground_host}/viewer/map"
+                url=f"http://{self._ground_host}/viewer/map",
+                headers={"Accept": f"{MAP_CONTENT_TYPE}, application/json;q=0.5"}
                 )
         assert resp.status_code == 200
-        j = resp.json()
-        # TODO better serialization
-        n_map = {}
-        for block in j["blocks"]:
-            n_map[deserialize_block(block["block"])] = Traversability(block["val"])
-        n_occupied = {}
-        for block in j["occupied"]:
-            n_occupied[deserialize_block(block["block"])] = block["val"]
-        if n_map != self._world_map._map:
-            self._world_map._map = n_map
-            self._welded_blocks = None
-        self._world_map._occupied_blocks = n_occupied
+        if resp.headers.get("Content-Type", "").startswith(MAP_CONTENT_TYPE):
+            grid, origin, j = decode_map(resp.content)
+        else:
+            # older servers only do json
+            j = resp.json()
+            grid, origin = dense_grid({deserialize_block(i["block"]): Traversability(i["val"]) for i in j["blocks"]})
+        old_grid, old_origin = self._map.dense()
+        if origin != old_origin or not np.array_equal(grid, old_grid):
+            self._set_map(grid, origin)
+        self._occupied = {deserialize_block(i["block"]): i["val"] for i in j["occupied"]}
+
+    def _set_map(self, grid: np.ndarray, origin: MapBlockCoord):
+        new_map = GridBlockStorage()
+        new_map.paste(origin, grid)
+        self._map = new_map
+        self.weld_map()
+
+    def stream_map(self, stop_event: threading.Event):
+        """
+        follow /viewer/stream until stop_event is set or the connection drops
+
+        the server sends the whole map once, and after that only the blocks, drones and reservations that change,
+        so keeping up costs about as much as the map changes instead of its size
+        """
+        resp = requests.get(
+                url=f"http://{self._ground_host}/viewer/stream",
+                stream=True,
+                timeout=(5, STREAM_TIMEOUT)
+                )
+        assert resp.status_code == 200
+        with resp:
+            event = None
+            data = []
+            for line in resp.iter_lines(decode_unicode=True):
+                if stop_event.is_set():
+                    return
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+                elif line == "" and event != None:
+                    j = json.loads("\n".join(data))
+                    if event == "snapshot":
+                        self._apply_snapshot(j)
+                    elif event == "delta":
+                        self._apply_delta(j)
+                    event = None
+                    data = []
+
+    def _apply_snapshot(self, j):
+        grid, origin, _ = decode_map(base64.b64decode(j["map"]))
+        self._drones = {id: deserialize_block(block) for id, block in j["drones"].items()}
+        self._reservations = {id: [deserialize_block(i) for i in blocks] for id, blocks in j["reserved"].items()}
+        self._set_map(grid, origin)
+        self._update_occupied()
+
+    def _apply_delta(self, j):
+        for box in j["boxes"]:
+            grid, origin, _ = decode_map(base64.b64decode(box))
+            self._map.paste(origin, grid)
+        if len(j["boxes"]) > 0:
+            self.weld_map()
+        for id, block in j["drones"].items():
+            if block == None:
+                self._drones.pop(id, None)
+            else:
+                self._drones[id] = deserialize_block(block)
+        for id, blocks in j["reserved"].items():
+            if len(blocks) == 0:
+                self._reservations.pop(id, None)
+            else:
+                self._reservations[id] = [deserialize_block(i) for i in blocks]
+        if len(j["drones"]) > 0 or len(j["reserved"]) > 0:
+            self._update_occupied()
+
+    def _update_occupied(self):
+        self._occupied = {block: id for id, block in self._drones.items()}
+        self._reserved = [block for blocks in self._reservations.values() for block in blocks]
 
     def get_daemon_func(self, stop_event: threading.Event, update_delay: int=1):
         def _inner():
             while not stop_event.is_set():
-                self.update_map()
-                time.sleep(update_delay)
+                try:
+                    self.stream_map(stop_event)
+                except Exception as e:
+                    print(f"lost the map stream ({e}), reconnecting in {update_delay}s")
+                    time.sleep(update_delay)
         return _inner
 
 if __name__ == "__main__":
@@ -122,4 +190,5 @@ if __name__ == "__main__":
 
     h = MapHandler("", True)
     h._world_map = world_map
+    h._map = world_map.snapshot().blocks
     h.weld_map()